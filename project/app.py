@@ -1,7 +1,21 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template, stream_with_context
+from collections import OrderedDict
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import os
 import threading
+import time
 from text_data import TextDatabase
 from autocomplete import AutoCompleter
+from prefork import WorkerPool
+from sharding import ShardedCompleter
+from metrics import QueryMetrics, render_gauges
+from models import SearchResult
+from watcher import ArchiveWatcher
+from gemini_api import CLIENTS, make_provider
 
 app = Flask(__name__)
 
@@ -9,15 +23,93 @@ db = None
 ac = None
 data_loaded = False
 
+# Set when serving with pre-forked worker processes
+pool = None
 
-def load_data_thread():
-    global db, ac, data_loaded
-    db = TextDatabase()
-    db.load("Archive")
-    ac = AutoCompleter(db)
+# Switches `ac` to new index generations as files are added or changed (single database only)
+watcher = None
+
+# Per-stage query timings for /metrics; queries slower than this are logged
+SLOW_QUERY_SECONDS = 0.1
+metrics = QueryMetrics(slow_query_seconds=SLOW_QUERY_SECONDS)
+
+# Type-ahead sessions by client-provided id, least recently used first
+SESSION_LIMIT = 1000
+sessions = OrderedDict()
+sessions_lock = threading.Lock()
+
+# Limits for /search/batch
+MAX_BATCH = 10000
+MAX_K = 100
+
+# /admin/reload needs "Authorization: Bearer <token>" with this variable set,
+# and is only answered for local clients without it
+ADMIN_TOKEN_ENV = "AUTOCOMPLETE_ADMIN_TOKEN"
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+# Held while /admin/reload builds a generation; further reloads are refused meanwhile
+reload_lock = threading.Lock()
+
+# Time budget of /search and /search/stream queries, in seconds
+SEARCH_BUDGET_SECONDS = 0.25
+
+# Seconds a client may reuse a /typeahead response before revalidating it
+TYPEAHEAD_MAX_AGE = 60
+# Request header naming the /typeahead client's session (see `get_session`)
+SESSION_HEADER = "X-Typeahead-Session"
+# Smallest /typeahead body worth gzipping, in bytes
+GZIP_MIN_BYTES = 512
+# Tags sharded indexes, which have no version of their own
+STARTED = f"{os.getpid()}-{time.time_ns()}"
+
+
+def load_data_thread(workers=1, shards=1, suffix_array=False, watch=0, suggestions=None,
+                     prefix_table=0, query_log=None):
+    global db, ac, watcher, data_loaded
+    if shards > 1:
+        ac = ShardedCompleter("Archive", shards, metrics=metrics)
+    else:
+        db = TextDatabase()
+        db.load("Archive", workers=workers, suffix_array=suffix_array,
+                prefix_table=prefix_table, query_log=query_log)
+        provider = make_provider(suggestions) if suggestions else None
+        ac = AutoCompleter(db, metrics=metrics, suggestions=provider)
+        watcher = ArchiveWatcher(ac, interval=watch or 30.0)
+        if watch and pool is None:
+            watcher.start()
     data_loaded = True
 
 
+def serialize_results(results):
+    """
+    Convert autocomplete results to the JSON rows returned by the search endpoints.
+    """
+    output = []
+    for r in results:
+        output.append({
+            "completed_sentence": r.completed_sentence,
+            "file": r.source_text.split("/")[-1],
+            "line": r.offset,
+            "score": r.score
+        })
+    return output
+
+
+def get_session(session_id):
+    """
+    Return the type-ahead session for a client, creating it if needed.
+    Only the SESSION_LIMIT most recently used sessions are kept.
+    """
+    with sessions_lock:
+        session = sessions.get(session_id)
+        if session is None or session.completer is not ac:
+            session = ac.session()
+            sessions[session_id] = session
+        sessions.move_to_end(session_id)
+        while len(sessions) > SESSION_LIMIT:
+            sessions.popitem(last=False)
+        return session
+
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -33,24 +125,261 @@ def search_api():
     if not query:
         return jsonify([])
 
-    results = ac.get_best_k_completions(query)
-    output = []
+    session_id = request.args.get('session')
+    searcher = get_session(session_id) if session_id else ac
+    result = searcher.search(query, budget=SEARCH_BUDGET_SECONDS)
+    response = jsonify(serialize_results(result.results))
+    # Set when the time budget ran out before every candidate was scored
+    response.headers["X-Partial-Results"] = "true" if result.partial else "false"
+    return response
+
+
+def compact_results(results):
+    """
+    Compact JSON encoding of results: every file name once, and one
+    [completed_sentence, file index, line, score] array per result.
+    """
+    files = {}
+    rows = []
     for r in results:
-        output.append({
-            "completed_sentence": r.completed_sentence,
-            "file": r.source_text.split("/")[-1],
-            "line": r.offset,
-            "score": r.score
-        })
-    return jsonify(output)
+        name = r.source_text.split("/")[-1]
+        rows.append([r.completed_sentence, files.setdefault(name, len(files)), r.offset, r.score])
+    return {"files": list(files), "rows": rows}
+
+
+def index_version():
+    """
+    Identifier of the index answering queries, shared by all workers serving the same files.
+    """
+    return ac.db.version if getattr(ac, "db", None) is not None else STARTED
+
+
+@app.route('/typeahead')
+def typeahead_api():
+    """
+    Autocomplete for type-ahead clients, cacheable by HTTP caches.
+
+    Responses carry an ETag derived from the index version and the request, so
+    a conditional request (If-None-Match) is answered with 304 without
+    searching until the index changes. ?format=full gives /search rows
+    instead of the compact encoding (see `compact_results`), and bodies of
+    GZIP_MIN_BYTES or more are gzipped for clients that accept it. Results cut
+    short by the time budget are marked "partial" and never cached.
+    The type-ahead session comes in the SESSION_HEADER header, not the URL:
+    it only lets the server reuse work and never changes the response, so the
+    cached response of a URL is shared by every client.
+    """
+    global ac, data_loaded
+    if not data_loaded:
+        return jsonify({"error": "Data is still loading"}), 503
+
+    query = request.args.get('q', '').strip()
+    fmt = request.args.get('format', 'compact')
+    k = request.args.get('k', 5, type=int)
+    if fmt not in ("compact", "full") or not 0 < k <= MAX_K:
+        return jsonify({"error": f"Expected format=compact|full and 0 < k <= {MAX_K}"}), 400
+
+    key = json.dumps([index_version(), " ".join(query.split()), k, fmt])
+    etag = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={TYPEAHEAD_MAX_AGE}",
+               "Vary": "Accept-Encoding"}
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    if query:
+        session_id = request.headers.get(SESSION_HEADER)
+        searcher = get_session(session_id) if session_id else ac
+        result = searcher.search(query, k=k, budget=SEARCH_BUDGET_SECONDS)
+    else:
+        result = SearchResult([])
+    payload = compact_results(result.results) if fmt == "compact" else {"rows": serialize_results(result.results)}
+    payload["partial"] = result.partial
+    if result.partial:
+        headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.accept_encodings:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, mimetype="application/json", headers=headers)
+
+
+@app.route('/search/stream')
+def search_stream_api():
+    """
+    Autocomplete one query progressively as server-sent events.
+
+    Each event is {"results": [...], "partial": bool, "final": bool}: exact
+    matches come first, then better results as one-edit matches are scored.
+    The last event has "final": true, and "partial": true if the time budget ran out.
+    """
+    global ac, data_loaded
+    if not data_loaded:
+        return jsonify({"error": "Data is still loading"}), 503
+
+    query = request.args.get('q', '').strip()
+    searcher = ac
+
+    def events():
+        steps = searcher.stream(query, budget=SEARCH_BUDGET_SECONDS) if query else [SearchResult([])]
+        for result in steps:
+            payload = {"results": serialize_results(result.results),
+                       "partial": result.partial, "final": result.final}
+            yield f"data: {json.dumps(payload)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch_api():
+    """
+    Autocomplete many queries in one request.
+
+    The body is a JSON array of query strings, or an object
+    {"queries": [...], "k": 5}. The response holds one result list per query,
+    in the same order and format as /search.
+    """
+    global ac, data_loaded
+    if not data_loaded:
+        return jsonify({"error": "Data is still loading"}), 503
+
+    body = request.get_json(silent=True)
+    k = 5
+    if isinstance(body, dict):
+        k = body.get('k', k)
+        body = body.get('queries')
+    if (not isinstance(body, list) or not all(isinstance(q, str) for q in body)
+            or not isinstance(k, int) or isinstance(k, bool) or not 0 < k <= MAX_K):
+        return jsonify({"error": "Expected a JSON array of query strings"}), 400
+    if len(body) > MAX_BATCH:
+        return jsonify({"error": f"At most {MAX_BATCH} queries per batch"}), 413
+
+    batches = ac.get_best_k_completions_many([q.strip() for q in body], k=k)
+    return jsonify([serialize_results(results) for results in batches])
+
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_api():
+    """
+    Pick up added, changed and removed archive files now.
+
+    The next index generation is built while /search keeps answering from the
+    current one, then swapped in. With pre-forked workers only the worker
+    handling this request switches; the others follow at their next --watch poll.
+
+    Requests must carry the ADMIN_TOKEN_ENV token as a bearer token, or come
+    from the local host if it is not set. One reload runs at a time; requests
+    arriving meanwhile get 429.
+    """
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    if not data_loaded:
+        return jsonify({"error": "Data is still loading"}), 503
+    if watcher is None:
+        return jsonify({"error": "Live updates are not available with --shards"}), 400
+    if not reload_lock.acquire(blocking=False):
+        return jsonify({"error": "A reload is already running"}), 429
+    try:
+        updated = watcher.check()
+    finally:
+        reload_lock.release()
+    return jsonify({"updated": updated, "generation": ac.db.generation, "sentences": len(ac.db)})
+
+
+def admin_allowed():
+    """
+    Whether the current request may use the /admin endpoints.
+    """
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    if not token:
+        return request.remote_addr in LOCAL_ADDRESSES
+    scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8"))
 
 
 @app.route('/status')
 def status():
-    return jsonify({"loaded": data_loaded})
+    status = {"loaded": data_loaded}
+    if data_loaded:
+        status["cache"] = ac.cache.stats()
+        if watcher is not None:
+            status["generation"] = ac.db.generation
+    if pool is not None:
+        status["worker"] = os.getpid()
+        status["workers"] = pool.status()
+    return jsonify(status)
+
+
+@app.route('/metrics')
+def metrics_api():
+    """
+    Query latency histograms, per-stage timings and counters in the Prometheus text format.
+    """
+    text = metrics.render()
+    if data_loaded:
+        text += "\n".join(render_gauges("autocomplete_cache", ac.cache.stats(),
+                                         "Result cache counter or size.")) + "\n"
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/metrics/slow')
+def slow_queries_api():
+    """
+    The most recent queries slower than SLOW_QUERY_SECONDS, with their per-stage breakdown.
+    """
+    return jsonify(list(metrics.slow_queries))
 
 
 if __name__ == '__main__':
-    thread = threading.Thread(target=load_data_thread)
-    thread.start()
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="Autocomplete web interface.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to build the index (0 = all cores)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="pre-forked worker processes serving requests (0 = all cores); "
+                             "more than one disables the debug server")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the archive into N shards searched by N processes in parallel")
+    parser.add_argument("--suffix-array", action="store_true",
+                        help="also index the sentences in a suffix array to answer exact queries directly")
+    parser.add_argument("--prefix-table", type=int, default=0, metavar="N",
+                        help="precompute the answers of all queries of up to N characters (0 = off)")
+    parser.add_argument("--query-log", metavar="PATH",
+                        help="also precompute the most frequent longer prefixes of the queries in PATH")
+    parser.add_argument("--watch", type=float, default=0, metavar="SECONDS",
+                        help="poll the archive every SECONDS and switch to an updated index "
+                             "without downtime (0 = off)")
+    parser.add_argument("--suggestions", choices=sorted(CLIENTS),
+                        help="fill in queries with fewer than k matches from a language model "
+                             "('fake' answers locally, for offline runs and load tests)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    processes = args.processes or os.cpu_count() or 1
+    if processes > 1 and args.shards > 1:
+        parser.error("--processes and --shards cannot be combined")
+    if args.watch and args.shards > 1:
+        parser.error("--watch and --shards cannot be combined")
+    if args.suggestions and args.shards > 1:
+        parser.error("--suggestions and --shards cannot be combined")
+    if (args.prefix_table or args.query_log) and args.shards > 1:
+        parser.error("--prefix-table and --query-log cannot be combined with --shards")
+    # Shard processes are daemons, which may not start index worker processes
+    if (args.workers != 1 or args.suffix_array) and args.shards > 1:
+        parser.error("--workers and --suffix-array cannot be combined with --shards")
+
+    if processes > 1:
+        pool = WorkerPool(processes)
+        # Load before forking so every worker shares the mapped index
+        load_data_thread(args.workers or None, suffix_array=args.suffix_array, watch=args.watch,
+                         suggestions=args.suggestions, prefix_table=args.prefix_table,
+                         query_log=args.query_log)
+        # Threads do not survive fork, so every worker polls the archive on its own;
+        # the index cache lock lets the first one rebuild it and the others reopen it
+        pool.serve(app, args.host, args.port,
+                   on_worker_start=lambda slot: watcher.start() if args.watch else None)
+    else:
+        thread = threading.Thread(target=load_data_thread, args=(args.workers or None, args.shards, args.suffix_array,
+                                                               args.watch, args.suggestions,
+                                                               args.prefix_table, args.query_log))
+        thread.start()
+        app.run(debug=True, host=args.host, port=args.port)
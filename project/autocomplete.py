@@ -1,15 +1,61 @@
 # autocomplete.py
-from typing import List
+import heapq
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
 from text_data import TextDatabase
 from scoring import _best_substring_score
-from models import Match, AutoCompleteData
-from trigram import _normalize
+from models import Match, AutoCompleteData, SearchResult
+from result_cache import ResultCache
+from gemini_api import SuggestionProvider
+from metrics import Deadline, QueryMetrics, QueryTrace
+from trigram import _min_shared_trigrams, _normalize, _trigrams
+
+QNORM_CACHE_LIMIT = 10000
+
+# Candidates scored between two deadline checks, and between two streamed steps
+DEADLINE_CHECK = 32
+STREAM_STEP = 200
+
+# Adaptive candidate cap: CAP_BUDGET / query length, clamped to [MIN_CAP, MAX_CAP].
+# Short queries share few trigrams with their matches and need a wider net; long
+# queries rank true matches first because they share many trigrams.
+CAP_BUDGET = 4000
+MIN_CAP = 100
+MAX_CAP = 1000
+# Queries of 6+ characters have their hits filtered by the q-gram count lemma
+# (see `_min_shared_trigrams`), so their cap only bounds latency on huge hit lists.
+FILTERED_CAP = 1500
+
+# source_text of results that came from the suggestion provider, not the archive
+SUGGESTION_SOURCE = "suggestion"
+
+def _last(steps: Iterator[SearchResult]) -> SearchResult:
+    """
+    The final step of a search.
+    """
+    for result in steps:
+        pass
+    return result
+
+def _results_size(result: SearchResult) -> int:
+    """
+    Approximate memory footprint in bytes of a cached result.
+    """
+    return 120 + sum(250 + len(r.completed_sentence) + len(r.source_text) for r in result.results)
 
 class AutoCompleter:
-    def __init__(self, db: TextDatabase, cap_per_query: int = 500) -> None:
+    def __init__(self, db: TextDatabase, cap_per_query: Optional[int] = None,
+                 cache: Optional[ResultCache] = None, metrics: Optional[QueryMetrics] = None,
+                 suggestions: Optional[SuggestionProvider] = None) -> None:
         self.db = db
         self.cap = cap_per_query
-        self._qnorm_cache = {}  # raw_query -> normalized
+        self.metrics = metrics  # per-stage query timings, off when None
+        self.suggestions = suggestions  # fills in when the archive has fewer than k results
+        self._qnorm_cache = {}  # raw_query -> normalized, oldest first
+        # (database generation, normalized query, k) -> results
+        self.cache = cache if cache is not None else ResultCache(sizeof=_results_size)
+        self._cache_generation = getattr(db, "generation", None)
 
     def _norm(self, q: str) -> str:
         """
@@ -24,43 +70,408 @@ class AutoCompleter:
         if q in self._qnorm_cache:
             return self._qnorm_cache[q]
         v = _normalize(q)
+        if len(self._qnorm_cache) >= QNORM_CACHE_LIMIT:
+            del self._qnorm_cache[next(iter(self._qnorm_cache))]
         self._qnorm_cache[q] = v
         return v
 
-    def get_best_k_completions(self, query: str, k: int = 5) -> List[AutoCompleteData]:
+    def _cache_key(self, db: TextDatabase, qn: str, k: int) -> Tuple:
+        """
+        Result cache key of (qn, k) on a database. The cache is emptied when the
+        database reloads, so results never outlive the index they came from.
+        """
+        generation = getattr(db, "generation", None)
+        if generation != self._cache_generation:
+            self._cache_generation = generation
+            self.cache.clear()
+        return (generation, qn, k)
+
+    def _cached(self, db: TextDatabase, qn: str, k: int,
+                compute: Callable[[], List[AutoCompleteData]]) -> List[AutoCompleteData]:
+        """
+        Return the results for (qn, k) from the result cache, computing them on a miss.
+
+        Entries are keyed by the database generation, and the cache is emptied
+        when the database reloads, so results never outlive the index they came from.
+
+        Args:
+            db (TextDatabase): Database the results are computed against.
+            qn (str): Normalized query.
+            k (int): Number of completions.
+            compute (Callable[[], List[AutoCompleteData]]): Computes the results on a miss.
+
+        Returns:
+            List[AutoCompleteData]: A new list holding the cached results.
+        """
+        return self._cached_within(db, qn, k, lambda: SearchResult(compute())).results
+
+    def _cached_within(self, db: TextDatabase, qn: str, k: int, compute: Callable[[], SearchResult],
+                       deadline: Optional[Deadline] = None) -> SearchResult:
+        """
+        Like `_cached` for a query with an optional time budget. A concurrent
+        identical query is waited for until the deadline passes, then the result
+        is computed here too; only complete results are cached.
+        """
+        result = self.cache.get_or_compute(self._cache_key(db, qn, k), compute,
+                                           deadline.remaining() if deadline is not None else None,
+                                           cacheable=lambda r: not r.partial)
+        return SearchResult(list(result.results), result.partial, result.final)
+
+    def use_database(self, db: TextDatabase) -> None:
+        """
+        Switch to another database, such as a newer generation of the same archive.
+
+        Every query reads `self.db` once when it starts and uses that database to
+        the end, so queries already running finish on the old one. Cached results
+        are keyed by generation, so none of the old database's results are served.
+        """
+        self.db = db
+
+    def _top_up(self, query: str, result: SearchResult, k: int, trace: Optional[QueryTrace] = None,
+                deadline: Optional[Deadline] = None) -> SearchResult:
+        """
+        Fill a complete result with fewer than k entries from the suggestion provider.
+
+        Suggestions come after the archive's results, with source_text
+        SUGGESTION_SOURCE and score 0, skipping sentences already in the results.
+        They are not kept in the result cache; the provider has its own.
+        With a deadline, suggestions are waited for only until it passes, and a
+        result whose suggestions were cut short is marked partial.
+        """
+        if self.suggestions is None or result.partial or len(result.results) >= k:
+            return result
+        if deadline is not None and deadline.passed():
+            return SearchResult(result.results, True, result.final)
+        timeout = deadline.remaining() if deadline is not None else None
+        suggestions = self.suggestions.suggest_sync(query, k, timeout)
+        if deadline is not None and deadline.passed():
+            return SearchResult(result.results, True, result.final)
+        seen = {r.completed_sentence for r in result.results}
+        extra = []
+        for s in suggestions:
+            if s not in seen:
+                seen.add(s)
+                extra.append(AutoCompleteData(s, SUGGESTION_SOURCE, 0, 0))
+        if trace is not None:
+            trace.lap("suggest")
+        return SearchResult(result.results + extra[:k - len(result.results)], result.partial, result.final)
+
+    def cap_for(self, qn: str) -> int:
+        """
+        Number of candidates to score for a normalized query: the fixed
+        `cap_per_query` if one was given, FILTERED_CAP when the candidates are
+        filtered down to possible matches, otherwise a cap that shrinks with query length.
+        """
+        if self.cap is not None:
+            return self.cap
+        if _min_shared_trigrams(len(qn)):
+            return FILTERED_CAP
+        return max(MIN_CAP, min(MAX_CAP, CAP_BUDGET // max(1, len(qn))))
+
+    def get_best_k_completions(self, query: str, k: int = 5,
+                               budget: Optional[float] = None) -> List[AutoCompleteData]:
         """
         Get the best k autocomplete suggestions matching the given query.
 
         The method normalizes the query, retrieves candidate sentence indices from
         the database using character trigram indexing, scores each candidate against
         the query allowing at most one edit, and returns the top k scored matches.
+        If the query is in the database's prefix table, or the database has a
+        suffix array and the query occurs exactly in at least k sentences, those
+        are the results and no trigram is counted.
+        Results are cached per (normalized query, k); concurrent identical queries
+        are computed once. With `metrics` set, the time of every stage is recorded.
+        With `suggestions` set, fewer than k results are filled in from the
+        suggestion provider (see `_top_up`).
 
         Args:
             query (str): The raw input query string.
             k (int, optional): Number of top completions to return. Defaults to 5.
+            budget (Optional[float]): Time budget in seconds; see `search`.
 
         Returns:
             List[AutoCompleteData]: List of autocomplete results sorted by descending score
                 and then alphabetically by completed sentence.
         """
+        return self.search(query, k, budget).results
+
+    def search(self, query: str, k: int = 5, budget: Optional[float] = None) -> SearchResult:
+        """
+        Like `get_best_k_completions`, but within an optional time budget.
+
+        When the budget runs out, posting lists not yet counted and candidates
+        not yet scored are skipped, and the best results found so far are
+        returned marked as partial. Partial results are not cached, and a query
+        with a budget waits for a concurrent identical query, and for
+        suggestions, only until its budget runs out.
+
+        Args:
+            query (str): The raw input query string.
+            k (int, optional): Number of top completions to return. Defaults to 5.
+            budget (Optional[float]): Time budget in seconds, or None for no limit.
+
+        Returns:
+            SearchResult: The results, and whether they are partial.
+        """
+        trace = QueryTrace(query) if self.metrics is not None else None
         qn = self._norm(query)
+        if trace is not None:
+            trace.lap("normalize")
         if not qn:
-            return []
-        cand_indices = self.db.candidates_by_query(qn, cap=self.cap)
+            return SearchResult([])
+        db = self.db
+        deadline = None
+        if budget is None:
+            result = SearchResult(self._cached(db, qn, k, lambda: _last(self._steps(db, qn, k, trace)).results))
+        else:
+            deadline = Deadline(budget)
+            result = self._cached_within(db, qn, k, lambda: _last(self._steps(db, qn, k, trace, deadline)), deadline)
+        if trace is not None:
+            trace.lap("cache")
+        result = self._top_up(query, result, k, trace, deadline)
+        if trace is not None:
+            self.metrics.record(trace)
+        return result
 
-        matches: List[Match] = []
-        qn_len = len(qn)
+    def stream(self, query: str, k: int = 5, budget: Optional[float] = None) -> Iterator[SearchResult]:
+        """
+        Search progressively: yield the exact matches among the candidates first,
+        then better results as one-edit matches are scored.
+
+        Every step but the last is marked partial and not final. The last step
+        is the same as `search(query, k, budget)`; a cached query yields it alone.
+
+        Args:
+            query (str): The raw input query string.
+            k (int, optional): Number of top completions to return. Defaults to 5.
+            budget (Optional[float]): Time budget in seconds, or None for no limit.
+
+        Yields:
+            SearchResult: The results known so far.
+        """
+        qn = self._norm(query)
+        if not qn:
+            yield SearchResult([])
+            return
+        db = self.db
+        key = self._cache_key(db, qn, k)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield SearchResult(list(cached.results))
+            return
+        deadline = Deadline(budget) if budget is not None else None
+        for result in self._steps(db, qn, k, deadline=deadline, step=STREAM_STEP):
+            if result.final and not result.partial:
+                self.cache.put(key, SearchResult(list(result.results)))
+            yield result
+
+    def get_best_k_completions_many(self, queries: Iterable[str], k: int = 5) -> List[List[AutoCompleteData]]:
+        """
+        Get the best k autocomplete suggestions for many queries at once.
+
+        Queries are normalized and deduplicated, and the posting list of every
+        trigram in the batch is fetched once; each query then counts its
+        trigrams from those shared lists. Queries are processed in sorted order
+        through one `TypeaheadSession`, so a query that extends the query just
+        before it in that order (such as the keystrokes of one logged query)
+        adds only the postings of its new trigrams to the previous counts.
+        Candidates are ranked and scored per query, as `get_best_k_completions`
+        does. Results already in the result cache are reused and new ones are
+        added to it.
+
+        Args:
+            queries (Iterable[str]): Raw query strings.
+            k (int, optional): Number of top completions per query. Defaults to 5.
 
-        # Evaluate candidates
-        for idx in cand_indices:
-            original, fpath, line, s_norm = self.db.items[idx]
-            score = _best_substring_score(qn, s_norm)
+        Returns:
+            List[List[AutoCompleteData]]: One result list per query, in input order,
+                each equal to `get_best_k_completions(query, k)`.
+        """
+        normalized = [self._norm(q) for q in queries]
+        distinct = sorted(set(normalized) - {""})
+        db = self.db
+        fetched = db.postings(g for qn in distinct for g in _trigrams(qn))
+        session = self.session()
+        by_qn: Dict[str, List[AutoCompleteData]] = {"": []}
+        for qn in distinct:
+            by_qn[qn] = self._cached(db, qn, k, lambda qn=qn: _last(session._steps(db, qn, k, fetched=fetched)).results)
+        return [list(by_qn[qn]) for qn in normalized]
+
+    def session(self) -> "TypeaheadSession":
+        """
+        Start an incremental type-ahead session for one user.
+
+        Returns:
+            TypeaheadSession: Session answering a query that grows one keystroke at a time.
+        """
+        return TypeaheadSession(self)
+
+    def _exact_results(self, db: TextDatabase, qn: str, k: int,
+                       trace: Optional[QueryTrace] = None) -> Optional[List[AutoCompleteData]]:
+        """
+        Results made only of exact matches, found with the database's prefix
+        table or suffix array.
+
+        Exact matches score 2 * len(qn), which no edit reaches, so when there are
+        at least k of them they fill the top k and nothing else needs scoring.
+        The prefix table holds the first k of them for short and hot queries.
+
+        Returns:
+            Optional[List[AutoCompleteData]]: The top k results, or None if the
+                query is in neither index or occurs on fewer than k lines.
+        """
+        if k <= 0:
+            return None
+        stored = db.prefix_candidates(qn, k, trace=trace)
+        if stored is not None:
+            return self._build_results(db, [(2 * len(qn), idx) for idx in stored], k, trace)
+        exact = db.exact_candidates(qn, cap=self.cap_for(qn), trace=trace)
+        if exact is None or sum(map(db.location_count, exact)) < k:
+            return None
+        if trace is not None:
+            trace.add("candidates", len(exact))
+        return self._build_results(db, [(2 * len(qn), idx) for idx in exact], k, trace)
+
+    def _steps(self, db: TextDatabase, qn: str, k: int, trace: Optional[QueryTrace] = None,
+               deadline: Optional[Deadline] = None, step: int = 0) -> Iterator[SearchResult]:
+        """
+        Compute the results of a normalized query, yielding intermediate steps
+        when `step` is set (see `_score_steps`).
+        """
+        exact = self._exact_results(db, qn, k, trace)
+        if exact is not None:
+            yield SearchResult(exact)
+            return
+        cand_indices, counts = db.candidates_with_counts(qn, cap=self.cap_for(qn), trace=trace,
+                                                         deadline=deadline)
+        yield from self._score_steps(db, qn, cand_indices, k, counts, trace, deadline, step)
+
+    def _score_steps(self, db: TextDatabase, qn: str, cand_indices: List[int], k: int,
+                     counts: Optional[Mapping[int, int]] = None, trace: Optional[QueryTrace] = None,
+                     deadline: Optional[Deadline] = None, step: int = 0) -> Iterator[SearchResult]:
+        """
+        Score candidate sentences against a normalized query and build the top k results.
+
+        When the shared-trigram counts are known, each candidate's score is bounded
+        from above: only a sentence containing every query trigram can be an exact
+        match (2 * len(qn)); any other scores at most 2 * len(qn) - 1 (one replace
+        late in the query). Candidates arrive in descending count order, so the
+        bound never increases, and scoring stops as soon as it falls below the
+        k-th best score found so far. Ties with the k-th score are still scored,
+        so the result is identical to scoring every candidate.
+
+        With a deadline, scoring stops once it passes (but never before k
+        candidates are scored), and the results are partial. With `step`, the
+        exact matches are found first with a substring test, and the top k is
+        yielded after them and then every `step` candidates, whenever it changed.
+
+        Args:
+            db (TextDatabase): Database the candidates come from.
+            qn (str): Normalized query.
+            cand_indices (List[int]): Candidate sentence indices from the database.
+            k (int): Number of top completions to return.
+            counts (Optional[Mapping[int, int]]): Sentence index -> shared trigrams, if known.
+            trace (Optional[QueryTrace]): Records the "score" and "results" stages
+                and the number of candidates scored.
+            deadline (Optional[Deadline]): Time budget of the query.
+            step (int): Candidates scored between intermediate steps, 0 for none.
+
+        Yields:
+            SearchResult: Intermediate steps, then the results sorted by descending
+                score, then alphabetically.
+        """
+        if k <= 0:
+            yield SearchResult([])
+            return
+        n = len(qn)
+        total_grams = n - 2 if counts is not None and n >= 3 else 0
+
+        # Evaluate candidates, keeping the k best scores in a min-heap
+        scored = []
+        top: List[int] = []
+        exact = set()
+        shown: List[Tuple[int, int]] = []
+        if step:
+            exact = {idx for idx in cand_indices if qn in db.norm(idx)}
+            scored = [(2 * n, idx) for idx in exact]
+            top = [2 * n] * min(k, len(exact))
+        examined = len(cand_indices)
+        for i, idx in enumerate(cand_indices):
+            if total_grams and len(top) == k:
+                bound = 2 * n if counts[idx] >= total_grams else 2 * n - 1
+                if bound < top[0]:
+                    examined = i
+                    break
+            if deadline is not None and i >= k and i % DEADLINE_CHECK == 0 and deadline.passed():
+                examined = i
+                break
+            if step and i % step == 0:
+                shown = yield from self._yield_step(db, scored, k, shown)
+            if idx in exact:
+                continue
+            score = _best_substring_score(qn, db.norm(idx))
             if score > 0:
-                matches.append(Match(score=score, file_path=fpath, line_num=line, original=original))
+                scored.append((score, idx))
+                if len(top) < k:
+                    heapq.heappush(top, score)
+                elif score > top[0]:
+                    heapq.heapreplace(top, score)
+        if trace is not None:
+            trace.add("scored", examined)
+            trace.lap("score")
+        partial = deadline is not None and deadline.expired
+        yield SearchResult(self._build_results(db, scored, k, trace), partial=partial)
 
-        if not matches:
+    def _yield_step(self, db: TextDatabase, scored: List[Tuple[int, int]], k: int,
+                    shown: List[Tuple[int, int]]) -> Iterator[SearchResult]:
+        """
+        Yield an intermediate step if the scored sentences that can make the top k
+        changed since the last step. Returns them, to be passed in next time.
+        """
+        contenders = sorted(scored, reverse=True)
+        if len(contenders) > k:
+            kth = contenders[k - 1][0]
+            contenders = [t for t in contenders if t[0] >= kth]
+        if contenders != shown:
+            yield SearchResult(self._build_results(db, list(scored), k), partial=True, final=False)
+        return contenders
+
+    def _build_results(self, db: TextDatabase, scored: List[Tuple[int, int]], k: int,
+                       trace: Optional[QueryTrace] = None) -> List[AutoCompleteData]:
+        """
+        Build the top k results from scored sentences.
+
+        Args:
+            db (TextDatabase): Database the sentences come from.
+            scored (List[Tuple[int, int]]): (positive score, sentence index) pairs.
+            k (int): Number of top completions to return.
+            trace (Optional[QueryTrace]): Records the "results" stage.
+
+        Returns:
+            List[AutoCompleteData]: Results sorted by descending score, then alphabetically.
+        """
+        if not scored:
+            if trace is not None:
+                trace.lap("results")
             return []
 
+        # Only the k best scores, plus anything tied with the k-th, can make the
+        # output. A sentence stands for every line it occurs on, so its lines
+        # count towards k, and only the sentences kept are expanded into (at
+        # most k) lines whose originals are read from the source files
+        scored.sort(key=lambda t: -t[0])
+        kept: List[Tuple[int, int]] = []
+        lines = 0
+        for score, idx in scored:
+            if lines >= k and score < kept[-1][0]:
+                break
+            kept.append((score, idx))
+            lines += db.location_count(idx)
+        matches: List[Match] = []
+        for (score, _), rows in zip(kept, db.occurrences([idx for _, idx in kept], k)):
+            for fpath, line, original in rows:
+                matches.append(Match(score=score, file_path=fpath, line_num=line, original=original))
+
         # Sort: higher score first; tie-breaker alphabetical by completed_sentence (case-insensitive)
         matches.sort(key=lambda m: (-m.score, m.original.lower()))
 
@@ -73,4 +484,112 @@ class AutoCompleter:
                 offset=m.line_num,
                 score=m.score
             ))
+        if trace is not None:
+            trace.lap("results")
         return out
+
+
+class TypeaheadSession:
+    """
+    Incremental search state for a query typed one keystroke at a time.
+
+    The session keeps the shared-trigram counts of the last query. When the new
+    normalized query extends the previous one, only the postings of the trigrams
+    that end in the new characters are added to those counts; the surviving top
+    candidates are then rescored. Backspaces, edits and short queries fall back
+    to a full search. Results are the same as `AutoCompleter.get_best_k_completions`.
+    """
+
+    def __init__(self, completer: AutoCompleter) -> None:
+        self.completer = completer
+        self._lock = threading.Lock()
+        self._db: Optional[TextDatabase] = None
+        self._qn = ""
+        self._counts: Optional[Counter] = None
+
+    def get_best_k_completions(self, query: str, k: int = 5,
+                               budget: Optional[float] = None) -> List[AutoCompleteData]:
+        """
+        Get the best k autocomplete suggestions, reusing the previous keystroke's work.
+
+        Args:
+            query (str): The raw input query string.
+            k (int, optional): Number of top completions to return. Defaults to 5.
+            budget (Optional[float]): Time budget in seconds; see `AutoCompleter.search`.
+
+        Returns:
+            List[AutoCompleteData]: Same results as `AutoCompleter.get_best_k_completions`.
+        """
+        return self.search(query, k, budget).results
+
+    def search(self, query: str, k: int = 5, budget: Optional[float] = None) -> SearchResult:
+        """
+        Like `AutoCompleter.search`, reusing the previous keystroke's work.
+        """
+        ac = self.completer
+        trace = QueryTrace(query) if ac.metrics is not None else None
+        qn = ac._norm(query)
+        if trace is not None:
+            trace.lap("normalize")
+        if not qn:
+            with self._lock:
+                self._qn, self._counts = "", None
+            return SearchResult([])
+        db = ac.db
+        deadline = None
+        if budget is None:
+            result = SearchResult(ac._cached(db, qn, k, lambda: _last(self._steps(db, qn, k, trace)).results))
+        else:
+            deadline = Deadline(budget)
+            result = ac._cached_within(db, qn, k, lambda: _last(self._steps(db, qn, k, trace, deadline)), deadline)
+        if trace is not None:
+            trace.lap("cache")
+        result = ac._top_up(query, result, k, trace, deadline)
+        if trace is not None:
+            ac.metrics.record(trace)
+        return result
+
+    def _steps(self, db: TextDatabase, qn: str, k: int, trace: Optional[QueryTrace] = None,
+               deadline: Optional[Deadline] = None,
+               fetched: Optional[Mapping[str, Sequence[int]]] = None) -> Iterator[SearchResult]:
+        """
+        Update the session's trigram counts for qn and score the top candidates.
+
+        On a result cache hit or an answer from exact matches this is skipped and
+        the counts stay at an older prefix of the query, which the next extension
+        still builds on. Counts cut short by the deadline are not kept. `fetched`
+        holds posting lists shared by a batch (see `TextDatabase.count_grams`).
+        """
+        ac = self.completer
+        exact = ac._exact_results(db, qn, k, trace)
+        if exact is not None:
+            yield SearchResult(exact)
+            return
+        with self._lock:
+            reusable = self._counts is not None and self._db is db and len(self._qn) >= 3
+            if reusable and qn == self._qn:
+                counts = self._counts
+            elif reusable and qn.startswith(self._qn):
+                # Trigrams of the old query are a prefix of the new query's trigrams
+                counts = db.count_grams(_trigrams(qn[len(self._qn) - 2:]), self._counts, trace, deadline, fetched)
+            else:
+                counts = db.count_grams(_trigrams(qn), trace=trace, deadline=deadline, fetched=fetched)
+            complete = deadline is None or not deadline.expired
+            if complete:
+                self._db, self._qn, self._counts = db, qn, counts
+            else:
+                self._qn, self._counts = "", None
+            cap = ac.cap_for(qn)
+            if counts:
+                cand_indices = db.rank_candidates(counts, cap, len(qn) if complete else 0, trace)
+            elif complete and _min_shared_trigrams(len(qn)):
+                cand_indices = []  # no sentence shares enough trigrams to match
+            else:
+                cand_indices = db.fallback_candidates(qn, cap)
+            if trace is not None:
+                trace.add("candidates", len(cand_indices))
+                if not counts:
+                    trace.add("fallback")
+                trace.lap("rank" if counts else "fallback")
+        yield from ac._score_steps(db, qn, cand_indices, k, counts if complete and counts else None,
+                                   trace, deadline)
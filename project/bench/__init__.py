@@ -0,0 +1,8 @@
+"""
+Reproducible benchmarks for index building and the query path.
+
+Run from the project directory:
+
+    python -m bench --save baseline.json      # record a baseline
+    python -m bench --compare baseline.json   # fail on latency regressions
+"""
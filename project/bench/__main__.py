@@ -0,0 +1,44 @@
+"""
+Command line entry point: python -m bench [--save FILE] [--compare FILE].
+"""
+
+import argparse
+import json
+import sys
+from .runner import DEFAULT_CONFIG, compare, format_report, run
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark index building and queries on a synthetic corpus.")
+    for key, default in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, default=default)
+    parser.add_argument("--workdir", help="keep the corpus and index in this folder")
+    parser.add_argument("--save", metavar="FILE", help="write the report as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before a regression is reported")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG}
+    report = run(config, workdir=args.workdir)
+    print(format_report(report))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline: {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, notes = compare(report, baseline, args.tolerance)
+        for note in notes:
+            print(f"[WARN] {note}")
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Deterministic synthetic corpus generator.
+"""
+
+import os
+import random
+import string
+from typing import List
+
+# Never generated, so queries made of them have no hits
+NO_HIT_CHARS = "0123456789"
+
+
+def make_vocabulary(size: int, seed: int = 0) -> List[str]:
+    """
+    Build `size` distinct lowercase words of 2 to 10 letters.
+    """
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10))))
+    return sorted(words)
+
+
+def generate_corpus(root: str, files: int = 20, lines: int = 1000, vocab: int = 2000,
+                    min_words: int = 3, max_words: int = 14, seed: int = 0) -> List[str]:
+    """
+    Write a synthetic archive of .txt files. The same arguments always produce
+    the same bytes.
+
+    Word frequencies follow a Zipf-like distribution, so a few words are very
+    common as in real text. Some words are capitalized and some lines end in
+    punctuation to exercise normalization.
+
+    Args:
+        root (str): Folder to write the files into (created if missing).
+        files (int): Number of files.
+        lines (int): Lines per file.
+        vocab (int): Vocabulary size.
+        min_words (int): Minimum words per line.
+        max_words (int): Maximum words per line.
+        seed (int): Random seed.
+
+    Returns:
+        List[str]: Paths of the written files.
+    """
+    rng = random.Random(seed)
+    words = make_vocabulary(vocab, seed)
+    weights = [1.0 / rank for rank in range(1, len(words) + 1)]
+    paths = []
+    for f in range(files):
+        sub = os.path.join(root, f"part{f % 4}")
+        os.makedirs(sub, exist_ok=True)
+        path = os.path.join(sub, f"doc{f:04d}.txt")
+        out = []
+        for _ in range(lines):
+            line = rng.choices(words, weights, k=rng.randint(min_words, max_words))
+            if rng.random() < 0.2:
+                line[0] = line[0].capitalize()
+            out.append(' '.join(line) + rng.choice(("", "", "", ".", ",", "!", "?")))
+        with open(path, "w", encoding="utf-8", newline="\n") as fh:
+            fh.write('\n'.join(out) + '\n')
+        paths.append(path)
+    return paths
@@ -0,0 +1,239 @@
+"""
+Benchmark runner and baseline comparison.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from text_data import TextDatabase
+from autocomplete import AutoCompleter
+from result_cache import ResultCache
+from scoring import _best_substring_score
+from trigram import _normalize
+from .corpus import generate_corpus
+from .workloads import make_workloads
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "files": 20,
+    "lines": 1000,
+    "vocab": 2000,
+    "min_words": 3,
+    "max_words": 14,
+    "seed": 0,
+    "queries": 200,        # per workload
+    "k": 5,
+    "load_runs": 5,        # warm loads timed
+    "score_samples": 50,   # candidates scored per query for _best_substring_score
+    "workers": 1,
+}
+
+# Latencies are reported in milliseconds under these names
+OPERATIONS = ("candidates_by_query", "_best_substring_score", "get_best_k_completions")
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples given in seconds as milliseconds.
+
+    Returns:
+        Dict[str, float]: n, mean, p50, p95 and p99 (nearest rank).
+    """
+    if not samples:
+        return {"n": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+
+    def rank(p: float) -> float:
+        return round(ordered[min(last, int(p * len(ordered)))] * 1000, 4)
+
+    return {"n": len(ordered), "mean": round(sum(ordered) / len(ordered) * 1000, 4),
+            "p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99)}
+
+
+def _timed(fn: Callable[[], Any]) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    value = fn()
+    return time.perf_counter() - start, value
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """
+    Peak resident set size of this process, where the platform reports it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def run(config: Optional[Dict[str, Any]] = None, workdir: Optional[str] = None,
+        log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Generate the corpus, build its index and time every benchmarked operation.
+
+    Args:
+        config (Optional[Dict[str, Any]]): Overrides of DEFAULT_CONFIG.
+        workdir (Optional[str]): Folder for the corpus and index. A temporary
+            folder, removed afterwards, if omitted.
+        log (Callable[[str], None]): Progress output.
+
+    Returns:
+        Dict[str, Any]: JSON-serializable report with the config, build stats,
+            latency percentiles per operation and workload, and a digest of the
+            query results per workload.
+    """
+    cfg = dict(DEFAULT_CONFIG, **(config or {}))
+    tmp = None
+    if workdir is None:
+        workdir = tmp = tempfile.mkdtemp(prefix="ac-bench-")
+    try:
+        root = os.path.join(workdir, "Archive")
+        index_path = os.path.join(workdir, "bench.idx")
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        log(f"Generating {cfg['files']} files x {cfg['lines']} lines")
+        generate_corpus(root, cfg["files"], cfg["lines"], cfg["vocab"],
+                        cfg["min_words"], cfg["max_words"], cfg["seed"])
+
+        log("Building index")
+        db = TextDatabase()
+        with redirect_stdout(io.StringIO()):  # silence per-file progress
+            build_seconds, _ = _timed(lambda: db.load(root, index_path=index_path, workers=cfg["workers"]))
+        log("Timing warm loads")
+        with redirect_stdout(io.StringIO()):
+            load_samples = []
+            for _ in range(cfg["load_runs"]):
+                seconds, _ = _timed(lambda: TextDatabase().load(root, index_path=index_path))
+                load_samples.append(seconds)
+            tracemalloc.start()
+            warm = TextDatabase()
+            warm.load(root, index_path=index_path)
+            _, open_heap = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del warm
+
+        report: Dict[str, Any] = {
+            "config": cfg,
+            "build": {
+                "seconds": round(build_seconds, 4),
+                "sentences": len(db),
+                "index_bytes": os.path.getsize(index_path),
+                "open_heap_bytes": open_heap,
+            },
+            "latency": {"load": percentiles(load_samples)},
+            "results": {},
+        }
+        for op in OPERATIONS:
+            report["latency"][op] = {}
+
+        ac = AutoCompleter(db, cache=ResultCache(max_entries=0))
+        for kind, queries in make_workloads(db, cfg["queries"], cfg["seed"]).items():
+            log(f"Running workload {kind}")
+            cand_samples, score_samples, query_samples = [], [], []
+            digest = hashlib.sha1()
+            for q in queries:
+                qn = _normalize(q)
+                seconds, cands = _timed(lambda: db.candidates_by_query(qn, ac.cap_for(qn)))
+                cand_samples.append(seconds)
+                for idx in cands[:cfg["score_samples"]]:
+                    s = db.norm(idx)
+                    seconds, _ = _timed(lambda: _best_substring_score(qn, s))
+                    score_samples.append(seconds)
+                seconds, results = _timed(lambda: ac.get_best_k_completions(q, k=cfg["k"]))
+                query_samples.append(seconds)
+                for r in results:
+                    digest.update(f"{r.completed_sentence}\0{os.path.basename(r.source_text)}"
+                                  f"\0{r.offset}\0{r.score}\n".encode('utf-8'))
+                digest.update(b"\x1e")
+            report["latency"]["candidates_by_query"][kind] = percentiles(cand_samples)
+            report["latency"]["_best_substring_score"][kind] = percentiles(score_samples)
+            report["latency"]["get_best_k_completions"][kind] = percentiles(query_samples)
+            report["results"][kind] = digest.hexdigest()
+        report["build"]["peak_rss_bytes"] = _peak_rss_bytes()
+        return report
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _latency_rows(report: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Flatten the latency section to "operation" or "operation/workload" -> stats.
+    """
+    rows = {}
+    for op, stats in report["latency"].items():
+        if "p50" in stats:
+            rows[op] = stats
+        else:
+            for kind, kind_stats in stats.items():
+                rows[f"{op}/{kind}"] = kind_stats
+    return rows
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.25,
+            min_ms: float = 0.25) -> Tuple[List[str], List[str]]:
+    """
+    Compare a report against a saved baseline.
+
+    A latency percentile or the build time regresses when it is more than
+    `tolerance` (relative) and more than `min_ms` (absolute) above the baseline,
+    so that timer noise on fast operations is ignored.
+
+    Args:
+        current (Dict[str, Any]): Report from `run`.
+        baseline (Dict[str, Any]): Earlier report from `run`.
+        tolerance (float): Allowed relative slowdown.
+        min_ms (float): Allowed absolute slowdown in milliseconds.
+
+    Returns:
+        Tuple[List[str], List[str]]: Regressions, and notes on other differences
+            (config mismatch, changed query results).
+    """
+    regressions: List[str] = []
+    notes: List[str] = []
+    if current["config"] != baseline["config"]:
+        notes.append("config differs from the baseline; timings are not comparable")
+
+    def check(name: str, now: float, before: float, unit_ms: float) -> None:
+        if now > before * (1 + tolerance) and (now - before) * unit_ms > min_ms:
+            regressions.append(f"{name}: {before:g} -> {now:g} (+{(now / before - 1) * 100 if before else 100:.0f}%)")
+
+    check("build.seconds", current["build"]["seconds"], baseline["build"]["seconds"], 1000)
+    before_rows = _latency_rows(baseline)
+    for name, stats in _latency_rows(current).items():
+        before = before_rows.get(name)
+        if before is None:
+            notes.append(f"{name}: not in the baseline")
+            continue
+        for p in ("p50", "p95", "p99"):
+            check(f"{name}.{p}", stats[p], before[p], 1)
+    for kind, digest in current["results"].items():
+        if baseline["results"].get(kind) not in (None, digest):
+            notes.append(f"results of workload {kind} differ from the baseline")
+    return regressions, notes
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Render a report as a text table.
+    """
+    build = report["build"]
+    lines = [
+        f"build: {build['seconds']:.3f}s, {build['sentences']} sentences, "
+        f"index {build['index_bytes'] / 2**20:.1f} MiB, open heap {build['open_heap_bytes'] / 2**20:.1f} MiB"
+        + (f", peak RSS {build['peak_rss_bytes'] / 2**20:.1f} MiB" if build.get("peak_rss_bytes") else ""),
+        f"{'operation':<44} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}",
+    ]
+    for name, stats in _latency_rows(report).items():
+        lines.append(f"{name:<44} {stats['n']:>6} {stats['p50']:>9.3f} {stats['p95']:>9.3f} {stats['p99']:>9.3f}")
+    return '\n'.join(lines)
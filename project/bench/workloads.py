@@ -0,0 +1,62 @@
+"""
+Query workloads drawn from a loaded database.
+"""
+
+import random
+import string
+from typing import Dict, List
+from text_data import TextDatabase
+from .corpus import NO_HIT_CHARS
+
+WORKLOADS = ("exact", "typo", "short_prefix", "no_hit")
+
+
+def _substring(rng: random.Random, s: str, min_len: int, max_len: int) -> str:
+    """
+    A random substring of s, as long as s allows.
+    """
+    length = min(len(s), rng.randint(min_len, max_len))
+    start = rng.randint(0, len(s) - length)
+    return s[start:start + length]
+
+
+def _typo(rng: random.Random, q: str) -> str:
+    """
+    Apply one random replace, insert or delete to q, never at its first character.
+    """
+    if len(q) < 3:
+        return q
+    p = rng.randint(1, len(q) - 1)
+    op = rng.choice(("replace", "insert", "delete"))
+    if op == "replace":
+        return q[:p] + rng.choice(string.ascii_lowercase.replace(q[p], "")) + q[p + 1:]
+    if op == "insert":
+        return q[:p] + rng.choice(string.ascii_lowercase) + q[p:]
+    return q[:p] + q[p + 1:]
+
+
+def make_workloads(db: TextDatabase, per_kind: int = 200, seed: int = 0) -> Dict[str, List[str]]:
+    """
+    Build the benchmark queries for a loaded database.
+
+    Args:
+        db (TextDatabase): Loaded database to sample sentences from.
+        per_kind (int): Number of queries per workload.
+        seed (int): Random seed.
+
+    Returns:
+        Dict[str, List[str]]: Workload name -> queries:
+            exact: substrings of indexed sentences;
+            typo: the same with one edit after the first character;
+            short_prefix: the first 1 to 3 characters of a word;
+            no_hit: strings of characters the corpus never contains.
+    """
+    rng = random.Random(seed)
+    sample = [db.norm(rng.randrange(len(db))) for _ in range(per_kind)] if len(db) else []
+    exact = [_substring(rng, s, 6, 24) for s in sample]
+    typo = [_typo(rng, _substring(rng, s, 6, 24)) for s in sample]
+    words = [rng.choice(s.split()) for s in sample]
+    short_prefix = [w[:rng.randint(1, 3)] for w in words]
+    no_hit = [''.join(rng.choice(NO_HIT_CHARS) for _ in range(rng.randint(4, 12)))
+              for _ in range(per_kind)]
+    return {"exact": exact, "typo": typo, "short_prefix": short_prefix, "no_hit": no_hit}
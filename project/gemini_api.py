@@ -1,27 +1,402 @@
-from google import genai
+"""
+Sentence suggestions from a language model, for queries the local archive cannot fill.
 
-import os
-os.environ["GEMINI_API_KEY"] = ""
+`SuggestionProvider` runs an asyncio event loop in a background thread and
+sends queries to a pluggable client: `GeminiClient` for the Gemini API, or
+`FakeClient` to run offline and under load tests. Queries arriving within a
+short window are batched into one call, identical queries in flight share
+one answer, calls are bounded in number and time, and answers are kept in an
+on-disk LRU cache.
+"""
 
-# The client gets the API key from the environment variable `GEMINI_API_KEY`.
-client = genai.Client()
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Sequence, Tuple
 
-while True:
+DEFAULT_MODEL = "gemini-2.5-flash"
 
-    prompt = """Act like you're completing sentences and correcting mistakes.
-    what i want you to do is to feel my sentences for search just like google search and typing error correction.
-    i want 5 suggestions, sort the suggestions from the most common to the least.
-    i want the sugggestion's by order with nothing by the suggestions.
-    do this for everything im gonna enter you from now.
-    the input is: """
+PROMPT = """Act like a search engine completing what users type and correcting their typing errors.
+For each numbered query below, give up to {k} completed or corrected sentences, most common first.
+Answer with JSON only: a list holding one list of strings per query, in the same order.
 
-    inp = input('quary: ')
+"""
 
-    prompt += inp
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash", contents=prompt
-    )
+class GeminiClient:
+    """
+    Client of the Gemini API. Requires the google-genai package; the API key
+    is read from the GEMINI_API_KEY environment variable.
+    """
 
-    print(response.text)
+    name = "gemini"
 
+    def __init__(self, model: str = DEFAULT_MODEL, api_key: Optional[str] = None) -> None:
+        try:
+            from google import genai
+        except ImportError as e:
+            raise ImportError("GeminiClient needs the google-genai package") from e
+        self.model = model
+        self._client = genai.Client(api_key=api_key) if api_key else genai.Client()
+
+    async def complete(self, queries: Sequence[str], k: int) -> List[List[str]]:
+        """
+        Suggest up to k sentences for every query, in one request.
+        """
+        prompt = PROMPT.format(k=k) + "\n".join(f"{i}. {q}" for i, q in enumerate(queries, start=1))
+        response = await self._client.aio.models.generate_content(
+            model=self.model, contents=prompt,
+            config={"response_mime_type": "application/json"},
+        )
+        return parse_suggestions(response.text, len(queries), k)
+
+
+class FakeClient:
+    """
+    Local stand-in for `GeminiClient`: answers after a fixed latency with
+    deterministic suggestions made from the query, and counts its calls.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0, fail: bool = False) -> None:
+        """
+        Args:
+            latency (float): Seconds every call takes.
+            fail (bool): Raise an error instead of answering.
+        """
+        self.latency = latency
+        self.fail = fail
+        self.calls: List[List[str]] = []
+        self.active = 0
+        self.max_active = 0
+
+    async def complete(self, queries: Sequence[str], k: int) -> List[List[str]]:
+        self.calls.append(list(queries))
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.fail:
+                raise RuntimeError("fake client failure")
+            return [[f"{q} suggestion {i}" for i in range(1, k + 1)] for q in queries]
+        finally:
+            self.active -= 1
+
+
+def parse_suggestions(text: Optional[str], count: int, k: int) -> List[List[str]]:
+    """
+    Read a model answer as `count` lists of at most k suggestions.
+    Anything that is not a list of string lists gives empty lists.
+    """
+    try:
+        data = json.loads(text or "")
+    except ValueError:
+        data = None
+    if not isinstance(data, list):
+        return [[] for _ in range(count)]
+    out = []
+    for i in range(count):
+        row = data[i] if i < len(data) and isinstance(data[i], list) else []
+        out.append([s.strip() for s in row if isinstance(s, str) and s.strip()][:k])
+    return out
+
+
+class DiskLRU:
+    """
+    On-disk LRU map of string keys to JSON values, bounded by entry count, in SQLite.
+
+    Recency is tracked to `touch_after` seconds: a hit only writes its new
+    use time when the stored one is older than that.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, touch_after: float = 60.0) -> None:
+        self.max_entries = max_entries
+        self.touch_after = touch_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self._db.commit()
+
+    def get(self, key: str):
+        """
+        Return the value for key, marking it recently used, or None.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value, used FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] >= self.touch_after:
+                self._db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+                self._db.commit()
+            return json.loads(row[0])
+
+    def put(self, key: str, value) -> None:
+        """
+        Store a value, evicting the least recently used entries above max_entries.
+        """
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Sequence[Tuple[str, object]]) -> None:
+        """
+        Store several values in one transaction, then evict as `put` does.
+        """
+        with self._lock:
+            now = time.time()
+            self._db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                                 [(key, json.dumps(value), now) for key, value in items])
+            self._db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+                             "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class SuggestionProvider:
+    """
+    Async suggestion backend with batching, request coalescing, bounded
+    concurrency, per-call deadlines and an on-disk cache.
+
+    `suggest` is a coroutine for the provider's own loop; `suggest_sync` can be
+    called from any thread. Failed or timed-out calls give no suggestions and
+    are not cached; cache errors count as misses. The SQLite cache is used
+    from its own thread, so a slow disk never holds up the event loop. The loop thread and the cache are started on first use, so
+    a provider created before pre-forking is started separately in each worker.
+    """
+
+    def __init__(self, client, max_concurrency: int = 4, timeout: float = 2.0,
+                 batch_window: float = 0.01, max_batch: int = 16,
+                 cache_path: Optional[str] = None, cache_entries: int = 10000) -> None:
+        """
+        Args:
+            client: `GeminiClient`, `FakeClient` or any object with the same
+                `name` and async `complete(queries, k)`.
+            max_concurrency (int): Most client calls in progress at once.
+            timeout (float): Seconds a client call may take.
+            batch_window (float): Seconds to wait for more queries before a call.
+            max_batch (int): Most queries per call.
+            cache_path (Optional[str]): SQLite file of the suggestion cache; None disables it.
+            cache_entries (int): Most cached answers.
+        """
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_path = cache_path
+        self.cache_entries = cache_entries
+        self.cache: Optional[DiskLRU] = None
+        self._cache_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[Tuple[str, str, int]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "calls": 0, "errors": 0,
+                      "cache_errors": 0}
+
+    def _key(self, qn: str, k: int) -> str:
+        return hashlib.sha1(f"{self.client.name}\0{k}\0{qn}".encode("utf-8")).hexdigest()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """
+        Start the event loop thread and open the cache, once per process.
+        A cache that cannot be opened is left out: suggestions are optional.
+        """
+        with self._lock:
+            if self._loop is None:
+                if self.cache_path is not None:
+                    try:
+                        self.cache = DiskLRU(self.cache_path, self.cache_entries)
+                        self._cache_executor = ThreadPoolExecutor(1, thread_name_prefix="suggestion-cache")
+                    except (sqlite3.Error, OSError) as e:
+                        self._cache_failed(e)
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="suggestions", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def suggest_sync(self, query: str, k: int = 5, timeout: Optional[float] = None) -> List[str]:
+        """
+        Blocking `suggest`, waiting at most the batch window plus the call
+        timeout, or `timeout` seconds if that is shorter. Gives no suggestions
+        when the wait runs out; the call goes on and its answer is cached.
+        """
+        wait = self.batch_window + self.timeout + 0.5
+        if timeout is not None:
+            wait = min(wait, timeout)
+        loop = self._start()
+        future = asyncio.run_coroutine_threadsafe(self.suggest(query, k), loop)
+        try:
+            return future.result(wait)
+        except FutureTimeoutError:
+            future.cancel()
+            return []
+
+    async def suggest(self, query: str, k: int = 5) -> List[str]:
+        """
+        Up to k suggestions for a query, from the cache or the client.
+        Must run on the provider's loop (see `suggest_sync`).
+
+        Args:
+            query (str): The query as typed; surrounding whitespace is ignored.
+            k (int): Most suggestions wanted.
+
+        Returns:
+            List[str]: Suggestions, most likely first; empty on errors and timeouts.
+        """
+        qn = " ".join(query.split())
+        if not qn or k <= 0:
+            return []
+        self.stats["requests"] += 1
+        key = self._key(qn, k)
+        cached = await self._cache_get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return list(await asyncio.shield(future))
+        loop = asyncio.get_running_loop()
+        future = self._inflight[key] = loop.create_future()
+        self._pending.append((key, qn, k))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return list(await asyncio.shield(future))
+
+    def _flush(self) -> None:
+        """
+        Send the pending queries to the client as one batch.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._call(batch))
+
+    async def _call(self, batch: List[Tuple[str, str, int]]) -> None:
+        """
+        One client call for a batch, resolving every waiting query.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        k = max(k for _, _, k in batch)
+        answers: Optional[List[List[str]]] = None
+        try:
+            async with self._semaphore:
+                self.stats["calls"] += 1
+                try:
+                    answers = await asyncio.wait_for(
+                        self.client.complete([qn for _, qn, _ in batch], k), self.timeout)
+                except Exception as e:  # includes timeouts
+                    self.stats["errors"] += 1
+                    print(f"[WARN] Suggestion call failed: {type(e).__name__}: {e}")
+        finally:
+            # Whatever happened, no query is left waiting on its future
+            results = [answers[i][:want] if answers is not None and i < len(answers) else []
+                       for i, (_, _, want) in enumerate(batch)]
+            for (key, _, _), suggestions in zip(batch, results):
+                future = self._inflight.get(key)
+                if future is not None and not future.done():
+                    future.set_result(suggestions)
+        # The answered futures stay in flight until the answers are cached, so
+        # the same query asked meanwhile reuses them instead of a new call
+        try:
+            if answers is not None:
+                await self._cache_put([(key, suggestions) for (key, _, _), suggestions in zip(batch, results)])
+        finally:
+            for key, _, _ in batch:
+                self._inflight.pop(key, None)
+
+    async def _cache_get(self, key: str) -> Optional[List[str]]:
+        """
+        Cached suggestions for key, or None; a failing cache counts as a miss.
+        """
+        if self.cache is None:
+            return None
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._cache_executor, self.cache.get, key)
+        except (sqlite3.Error, ValueError) as e:
+            self._cache_failed(e)
+            return None
+
+    async def _cache_put(self, items: List[Tuple[str, List[str]]]) -> None:
+        """
+        Cache the suggestions of several keys; a failing cache only loses the entries.
+        """
+        if self.cache is None:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._cache_executor, self.cache.put_many, items)
+        except (sqlite3.Error, ValueError) as e:
+            self._cache_failed(e)
+
+    def _cache_failed(self, e: Exception) -> None:
+        self.stats["cache_errors"] += 1
+        print(f"[WARN] Suggestion cache failed: {type(e).__name__}: {e}")
+
+    def close(self) -> None:
+        """
+        Stop the loop thread and close the cache.
+        """
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        if self._cache_executor is not None:
+            self._cache_executor.shutdown(wait=True)
+            self._cache_executor = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+CLIENTS = {"gemini": GeminiClient, "fake": FakeClient}
+
+DEFAULT_CACHE_PATH = "suggestions.sqlite"
+
+
+def make_provider(client: str, cache_path: Optional[str] = DEFAULT_CACHE_PATH) -> SuggestionProvider:
+    """
+    Suggestion provider with a client named in CLIENTS and default limits.
+    """
+    return SuggestionProvider(CLIENTS[client](), cache_path=cache_path)
+
+
+def main() -> None:
+    """
+    Interactive loop printing Gemini suggestions for every query entered.
+    """
+    provider = make_provider("gemini")
+    try:
+        while True:
+            query = input("query: ").strip()
+            if query.lower() == "exit":
+                break
+            for i, suggestion in enumerate(provider.suggest_sync(query, 5), 1):
+                print(f"{i:>2}. {suggestion}")
+    finally:
+        provider.close()
+
+
+if __name__ == "__main__":
+    main()
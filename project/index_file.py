@@ -0,0 +1,443 @@
+"""
+Versioned binary on-disk format for the text database.
+
+The file is opened with mmap and read in place: posting lists and the sentence
+table are memoryview slices of the mapping, so opening an index is cheap and
+several processes serving the same file share its page cache.
+
+Layout:
+    header   magic (8 bytes) | version (u32) | reserved (u32) | meta offset (u64)
+    sections raw arrays and UTF-8 blobs, each aligned to 8 bytes
+    meta     UTF-8 JSON with the section table and build metadata
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+from trigram import _pack_gram, _unpack_gram
+
+MAGIC = b"ACIDX\x00\x00\x00"
+VERSION = 6
+
+_HEADER = struct.Struct("<8sIIQ")
+_ALIGN = 8
+
+Chunk = Union[bytes, bytearray, array]
+
+
+def _write_section(f, sections: Dict[str, List], name: str, typecode: str, chunks: Iterable[Chunk]) -> None:
+    """
+    Append one section to an open index file and record it in the section table.
+
+    Args:
+        f: Binary file object positioned at the end of the file.
+        sections (Dict[str, List]): Section table being filled, name -> [offset, nbytes, typecode].
+        name (str): Section name.
+        typecode (str): array typecode of the section, or 'B' for a raw byte blob.
+        chunks (Iterable[Chunk]): Data written back to back into the section.
+    """
+    f.write(b"\x00" * (-f.tell() % _ALIGN))
+    start = f.tell()
+    for chunk in chunks:
+        if isinstance(chunk, array):
+            chunk.tofile(f)
+        else:
+            f.write(chunk)
+    sections[name] = [start, f.tell() - start, typecode]
+
+
+def _write_postings(f, sections: Dict[str, List], prefix: str,
+                    table: Mapping[str, Sequence[int]]) -> None:
+    """
+    Append a posting table as three sections: the keys packed into integers
+    (see `trigram._pack_gram`) in ascending order, and all posting lists back
+    to back with their offsets.
+
+    Args:
+        f: Binary file object positioned at the end of the file.
+        sections (Dict[str, List]): Section table being filled.
+        prefix (str): Name prefix of the three sections.
+        table (Mapping[str, Sequence[int]]): Key of one to three characters -> ascending item indices.
+    """
+    packed = sorted((_pack_gram(key), key) for key in table)
+    keys = [key for _, key in packed]
+    post_offsets = array('Q', [0])
+    total = 0
+    for key in keys:
+        total += len(table[key])
+        post_offsets.append(total)
+    _write_section(f, sections, f"{prefix}_keys", 'Q', [array('Q', [p for p, _ in packed])])
+    _write_section(f, sections, f"{prefix}_post_offsets", 'Q', [post_offsets])
+    _write_section(f, sections, f"{prefix}_postings", 'I',
+                   (array('I', table[key]) for key in keys))
+
+
+def write_index(path: str,
+                sentences: "SentenceTable",
+                gram_index: Mapping[str, Sequence[int]],
+                char_index: Mapping[str, Sequence[int]],
+                meta: Optional[Dict[str, Any]] = None,
+                suffixes: Optional[Sequence[int]] = None,
+                prefixes: Optional[Tuple[List[str], Sequence[int]]] = None) -> None:
+    """
+    Write a sentence table and its posting tables to `path` in the binary index format.
+
+    The file is written next to its destination and moved into place, so readers
+    that still map an older version of the file are not affected.
+
+    Args:
+        sentences (SentenceTable): The sentences to store.
+        gram_index (Mapping[str, Sequence[int]]): Trigram -> ascending sentence indices.
+        char_index (Mapping[str, Sequence[int]]): Character -> ascending indices
+            of the sentences whose normalized line contains it.
+        meta (Optional[Dict[str, Any]]): Extra JSON-serializable build metadata.
+        suffixes (Optional[Sequence[int]]): Suffix array over the normalized text
+            (see `suffix_array.build_suffix_array`), stored only if given.
+        prefixes (Optional[Tuple[List[str], Sequence[int]]]): Keys and rows of a
+            `prefix_table.PrefixTable`, stored only if given.
+    """
+    sections: Dict[str, List] = {}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, 0))
+        _write_section(f, sections, "file_ids", 'I', [sentences.file_ids])
+        _write_section(f, sections, "lines", 'I', [sentences.lines])
+        _write_section(f, sections, "offsets", 'Q', [sentences.offsets])
+        _write_section(f, sections, "norm_offsets", 'Q', [sentences.norm_offsets])
+        _write_section(f, sections, "norm_text", 'B', [sentences.norm_text])
+        _write_section(f, sections, "norm_lengths", 'I', [sentences.norm_lengths])
+        sentences.group_locations()
+        _write_section(f, sections, "loc_sentences", 'I', [sentences.loc_sentences])
+        _write_section(f, sections, "loc_starts", 'Q', [sentences.loc_starts])
+        _write_section(f, sections, "loc_ids", 'I', [sentences.loc_ids])
+        _write_postings(f, sections, "gram", gram_index)
+        _write_postings(f, sections, "char", char_index)
+        if suffixes is not None:
+            _write_section(f, sections, "suffixes", 'Q', [array('Q', suffixes)])
+        if prefixes is not None:
+            keys, rows = prefixes
+            _write_section(f, sections, "prefix_keys", 'B', ["\n".join(keys).encode('utf-8')])
+            _write_section(f, sections, "prefix_rows", 'I', [array('I', rows)])
+        meta_offset = f.tell()
+        f.write(json.dumps({
+            "byteorder": sys.byteorder,
+            "count": len(sentences),
+            "files": sentences.files,
+            "sections": sections,
+            "build": meta or {},
+        }).encode('utf-8'))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, meta_offset))
+    os.replace(tmp_path, path)
+
+
+class _PostingTable(Mapping):
+    """
+    Read-only mapping of key (trigram or character) -> posting list backed by the mapped file.
+    Values are memoryviews of unsigned 32-bit item indices.
+
+    Keys are looked up by binary search over the sorted packed keys in the file,
+    so opening a table does no work per key.
+    """
+
+    def __init__(self, keys: memoryview, post_offsets: memoryview, postings: memoryview) -> None:
+        self._keys = keys
+        self._post_offsets = post_offsets
+        self._postings = postings
+
+    def _slot(self, gram: str) -> int:
+        """
+        Position of a key in the table, or -1 if it is absent.
+        """
+        if not 0 < len(gram) <= 3:
+            return -1
+        packed = _pack_gram(gram)
+        i = bisect_left(self._keys, packed)
+        return i if i < len(self._keys) and self._keys[i] == packed else -1
+
+    def __getitem__(self, gram: str) -> memoryview:
+        i = self._slot(gram)
+        if i < 0:
+            raise KeyError(gram)
+        return self._postings[self._post_offsets[i]:self._post_offsets[i + 1]]
+
+    def get(self, gram: str, default=None):
+        i = self._slot(gram)
+        if i < 0:
+            return default
+        return self._postings[self._post_offsets[i]:self._post_offsets[i + 1]]
+
+    def __contains__(self, gram: object) -> bool:
+        return isinstance(gram, str) and self._slot(gram) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return map(_unpack_gram, self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class SentenceTable:
+    """
+    Compact sentence storage with every distinct normalized sentence stored once.
+
+    Sentences hold the normalized text in one contiguous UTF-8 buffer. Locations
+    are the lines a sentence occurs on: a file-id table, line numbers and byte
+    offsets into the source file, kept in file order with the sentence of each
+    location. Each sentence's locations are also grouped by sentence (`loc_starts`
+    into `loc_ids`). Original lines are not stored; callers read them back from
+    the source files at the recorded byte offsets.
+
+    A table created without arguments is growable and used while building.
+    `IndexFile` creates read-only tables over views of the mapped file.
+    """
+
+    def __init__(self, files: Optional[List[str]] = None,
+                 file_ids: Optional[Sequence[int]] = None,
+                 lines: Optional[Sequence[int]] = None,
+                 offsets: Optional[Sequence[int]] = None,
+                 norm_offsets: Optional[Sequence[int]] = None,
+                 norm_text: Union[bytearray, memoryview, None] = None,
+                 norm_lengths: Optional[Sequence[int]] = None,
+                 loc_sentences: Optional[Sequence[int]] = None,
+                 loc_starts: Optional[Sequence[int]] = None,
+                 loc_ids: Optional[Sequence[int]] = None) -> None:
+        self.files: List[str] = files if files is not None else []
+        self.file_ids = file_ids if file_ids is not None else array('I')
+        self.lines = lines if lines is not None else array('I')
+        self.offsets = offsets if offsets is not None else array('Q')
+        self.norm_offsets = norm_offsets if norm_offsets is not None else array('Q', [0])
+        self.norm_text = norm_text if norm_text is not None else bytearray()
+        self.norm_lengths = norm_lengths if norm_lengths is not None else array('I')
+        self.loc_sentences = loc_sentences if loc_sentences is not None else array('I')
+        # None while locations added to existing sentences are not grouped yet
+        self.loc_starts: Optional[Sequence[int]] = loc_starts if loc_starts is not None else array('Q', [0])
+        self.loc_ids = loc_ids if loc_ids is not None else array('I')
+
+    def __len__(self) -> int:
+        return len(self.norm_lengths)
+
+    @property
+    def location_count(self) -> int:
+        """
+        Number of locations of all sentences.
+        """
+        return len(self.lines)
+
+    def add_file(self, fpath: str) -> int:
+        """
+        Register a source file and return its file id.
+        """
+        self.files.append(fpath)
+        return len(self.files) - 1
+
+    def add_sentence(self, norm: str) -> int:
+        """
+        Append a sentence without locations and return its index.
+        """
+        self.norm_text += norm.encode('utf-8')
+        self.norm_offsets.append(len(self.norm_text))
+        self.norm_lengths.append(len(norm))
+        if self.loc_starts is not None:
+            self.loc_starts.append(len(self.loc_ids))
+        return len(self.norm_lengths) - 1
+
+    def extend_sentences(self, other: "SentenceTable", indices: Sequence[int]) -> int:
+        """
+        Append sentences of another table, without locations, copying runs of
+        consecutive indices at once.
+
+        Args:
+            other (SentenceTable): Table to copy from.
+            indices (Sequence[int]): Sentence indices in `other`, in the order to append.
+
+        Returns:
+            int: Index of the first appended sentence; the others follow in order.
+        """
+        first_new = len(self.norm_lengths)
+        i = 0
+        while i < len(indices):
+            first = indices[i]
+            end = i + 1
+            while end < len(indices) and indices[end] == first + (end - i):
+                end += 1
+            last = first + (end - i)
+            start = other.norm_offsets[first]
+            shift = len(self.norm_text) - start
+            self.norm_text += other.norm_text[start:other.norm_offsets[last]]
+            self.norm_offsets.extend(map(shift.__add__, other.norm_offsets[first + 1:last + 1]))
+            self.norm_lengths.extend(other.norm_lengths[first:last])
+            i = end
+        if self.loc_starts is not None:
+            self.loc_starts.extend([len(self.loc_ids)] * (len(self.norm_lengths) - first_new))
+        return first_new
+
+    def add_location(self, file_id: int, line: int, offset: int, sentence: int) -> None:
+        """
+        Record that a sentence occurs on a line.
+
+        Args:
+            file_id (int): Id returned by `add_file`.
+            line (int): 1-based line number in the source file.
+            offset (int): Byte offset of the line in the source file.
+            sentence (int): Index of the sentence.
+        """
+        self.file_ids.append(file_id)
+        self.lines.append(line)
+        self.offsets.append(offset)
+        self.loc_sentences.append(sentence)
+        if self.loc_starts is not None and sentence == len(self.loc_starts) - 2:
+            self.loc_ids.append(len(self.lines) - 1)
+            self.loc_starts[-1] = len(self.loc_ids)
+        else:
+            self.loc_starts = None
+
+    def append(self, file_id: int, line: int, offset: int, norm: str) -> None:
+        """
+        Append one sentence occurring on one line, even if an equal sentence exists.
+
+        Args:
+            file_id (int): Id returned by `add_file`.
+            line (int): 1-based line number in the source file.
+            offset (int): Byte offset of the line in the source file.
+            norm (str): Normalized sentence.
+        """
+        self.add_location(file_id, line, offset, self.add_sentence(norm))
+
+    def extend_locations(self, file_id: int, lines: Sequence[int], offsets: Sequence[int],
+                         sentences: Iterable[int]) -> None:
+        """
+        Append the locations of one file's lines.
+
+        Args:
+            file_id (int): Id returned by `add_file`.
+            lines (Sequence[int]): 1-based line numbers.
+            offsets (Sequence[int]): Byte offsets of the lines in the source file.
+            sentences (Iterable[int]): Sentence index of each line.
+        """
+        self.file_ids.extend([file_id] * len(lines))
+        self.lines.extend(lines)
+        self.offsets.extend(offsets)
+        self.loc_sentences.extend(sentences)
+        self.loc_starts = None
+
+    def copy_locations(self, other: "SentenceTable", first: int, count: int, file_id: int,
+                       remap: Sequence[int]) -> None:
+        """
+        Append a contiguous run of locations copied from another table, such as
+        the lines of a file that did not change since the last build.
+
+        Args:
+            other (SentenceTable): Table to copy from.
+            first (int): Index of the first location in `other`.
+            count (int): Number of locations to copy.
+            file_id (int): File id of the copied locations in this table.
+            remap (Sequence[int]): Sentence index in `other` -> sentence index in this table.
+        """
+        self.extend_locations(file_id, other.lines[first:first + count], other.offsets[first:first + count],
+                              map(remap.__getitem__, other.loc_sentences[first:first + count]))
+
+    def group_locations(self) -> None:
+        """
+        Group the locations by sentence, keeping file order within a sentence.
+        Needed after locations were added to sentences other than the last one.
+        """
+        if self.loc_starts is not None:
+            return
+        counts = Counter(self.loc_sentences)
+        self.loc_ids = array('I', sorted(range(len(self.loc_sentences)), key=self.loc_sentences.__getitem__))
+        self.loc_starts = array('Q', accumulate(map(counts.__getitem__, range(len(self))), initial=0))
+
+    def norm(self, i: int) -> str:
+        """
+        Return the normalized text of sentence i.
+        """
+        return str(self.norm_text[self.norm_offsets[i]:self.norm_offsets[i + 1]], 'utf-8')
+
+    def locations_of(self, i: int) -> Sequence[int]:
+        """
+        Return the location ids of sentence i, in file order.
+        """
+        self.group_locations()
+        return self.loc_ids[self.loc_starts[i]:self.loc_starts[i + 1]]
+
+    def location_at(self, loc: int) -> Tuple[str, int, int]:
+        """
+        Return (file path, line number, byte offset) of location loc.
+        """
+        return self.files[self.file_ids[loc]], self.lines[loc], self.offsets[loc]
+
+    def location(self, i: int) -> Tuple[str, int, int]:
+        """
+        Return (file path, line number, byte offset) of the first location of sentence i.
+        """
+        return self.location_at(self.locations_of(i)[0])
+
+
+class IndexFile:
+    """
+    A memory-mapped index written by `write_index`.
+
+    Attributes:
+        sentences (SentenceTable): The sentence table.
+        grams (Mapping[str, memoryview]): Trigram -> posting list.
+        chars (Mapping[str, memoryview]): Character -> posting list.
+        suffixes (Optional[memoryview]): Suffix array over the normalized text, if one was written.
+        prefixes (Optional[Tuple[List[str], memoryview]]): Keys and rows of the prefix table, if one was written.
+        meta (Dict[str, Any]): Build metadata passed to `write_index`.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < _HEADER.size:
+            raise ValueError("index file is truncated")
+        magic, version, _, meta_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("not an index file")
+        if version != VERSION:
+            raise ValueError(f"unsupported index version {version}")
+        info = json.loads(self._mm[meta_offset:].decode('utf-8'))
+        if info["byteorder"] != sys.byteorder:
+            raise ValueError("index was written on a machine with a different byte order")
+        self._buf = memoryview(self._mm)
+        self._sections = info["sections"]
+        self.meta: Dict[str, Any] = info["build"]
+        self.sentences = SentenceTable(
+            info["files"],
+            self._section("file_ids"), self._section("lines"), self._section("offsets"),
+            self._section("norm_offsets"), self._section("norm_text"),
+            self._section("norm_lengths"), self._section("loc_sentences"),
+            self._section("loc_starts"), self._section("loc_ids"),
+        )
+        self.grams = self._postings("gram")
+        self.chars = self._postings("char")
+        self.suffixes = self._section("suffixes") if "suffixes" in self._sections else None
+        self.prefixes = None
+        if "prefix_keys" in self._sections:
+            blob = str(self._section("prefix_keys"), 'utf-8')
+            self.prefixes = (blob.split("\n") if blob else [], self._section("prefix_rows"))
+
+    def _postings(self, prefix: str) -> _PostingTable:
+        """
+        Return the posting table stored under the given section prefix.
+        """
+        return _PostingTable(
+            self._section(f"{prefix}_keys"), self._section(f"{prefix}_post_offsets"),
+            self._section(f"{prefix}_postings"),
+        )
+
+    def _section(self, name: str) -> memoryview:
+        """
+        Return a zero-copy view of a section, cast to its element type.
+        """
+        offset, nbytes, typecode = self._sections[name]
+        view = self._buf[offset:offset + nbytes]
+        return view if typecode == 'B' else view.cast(typecode)
@@ -1,13 +1,43 @@
 # main.py
+import argparse
 import os
 from text_data import TextDatabase
 from autocomplete import AutoCompleter
+from sharding import ShardedCompleter
+from gemini_api import CLIENTS, make_provider
 
 def main():
-    db = TextDatabase()
+    parser = argparse.ArgumentParser(description="Autocomplete sentences from a text archive.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to build the index (0 = all cores)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the archive into N shards searched by N processes in parallel")
+    parser.add_argument("--suffix-array", action="store_true",
+                        help="also index the sentences in a suffix array to answer exact queries directly")
+    parser.add_argument("--prefix-table", type=int, default=0, metavar="N",
+                        help="precompute the answers of all queries of up to N characters (0 = off)")
+    parser.add_argument("--query-log", metavar="PATH",
+                        help="also precompute the most frequent longer prefixes of the queries in PATH")
+    parser.add_argument("--suggestions", choices=sorted(CLIENTS),
+                        help="fill in queries with fewer than 5 matches from a language model "
+                             "('fake' answers locally)")
+    args = parser.parse_args()
+    if args.suggestions and args.shards > 1:
+        parser.error("--suggestions and --shards cannot be combined")
+    if (args.prefix_table or args.query_log) and args.shards > 1:
+        parser.error("--prefix-table and --query-log cannot be combined with --shards")
+    # Shard processes are daemons, which may not start index worker processes
+    if (args.workers != 1 or args.suffix_array) and args.shards > 1:
+        parser.error("--workers and --suffix-array cannot be combined with --shards")
+
     root = os.environ.get("AC_ARCHIVE", "Archive")
-    db.load(root)
-    ac = AutoCompleter(db)
+    if args.shards > 1:
+        ac = ShardedCompleter(root, args.shards)
+    else:
+        db = TextDatabase()
+        db.load(root, workers=args.workers or None, suffix_array=args.suffix_array,
+                prefix_table=args.prefix_table, query_log=args.query_log)
+        ac = AutoCompleter(db, suggestions=make_provider(args.suggestions) if args.suggestions else None)
     print("Type your query and press Enter.")
     print("Type 'exit' to quit.")
     while True:
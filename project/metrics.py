@@ -0,0 +1,215 @@
+"""
+Per-query stage timings, counters and histograms in the Prometheus text format.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, Dict, List, Mapping, Optional, Sequence, Tuple
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+
+class QueryTrace:
+    """
+    Stage timings and counters of one query.
+
+    `lap(stage)` charges the time since the previous lap to a stage, so each
+    stage costs one clock read. The stages of a query are normalize, prefix
+    (prefix table lookup), exact (suffix array lookup), postings (posting list
+    traversal), rank or fallback (candidate selection), score, results (reading
+    original lines and building results), cache (result cache lookup, or
+    waiting for a concurrent identical query) and suggest (suggestion provider,
+    when used); a sharded completer records shards (fan-out and merge) instead
+    of the middle stages. The counters are prefix (sentences found in the prefix
+    table), exact (sentences found by the suffix array), postings, filtered
+    (hits that cannot match within one edit), candidates, scored and fallback.
+    """
+
+    __slots__ = ("query", "stages", "counts", "_start", "_mark")
+
+    def __init__(self, query: str) -> None:
+        self.query = query
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._start = self._mark = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        """
+        Add the time since the previous lap (or the start) to a stage.
+        """
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._mark
+        self._mark = now
+
+    def add(self, counter: str, n: int = 1) -> None:
+        """
+        Add n to a counter.
+        """
+        self.counts[counter] = self.counts.get(counter, 0) + n
+
+    @property
+    def total(self) -> float:
+        """
+        Seconds from the start to the last lap.
+        """
+        return self._mark - self._start
+
+
+class Deadline:
+    """
+    Time budget of one query, shared by its stages.
+
+    Once `passed()` has returned True, `expired` stays set, so the caller can
+    tell afterwards that some stage was cut short.
+    """
+
+    __slots__ = ("at", "expired")
+
+    def __init__(self, seconds: float) -> None:
+        self.at = time.perf_counter() + seconds
+        self.expired = False
+
+    def passed(self) -> bool:
+        """
+        Whether the budget is used up.
+        """
+        if not self.expired and time.perf_counter() >= self.at:
+            self.expired = True
+        return self.expired
+
+    def remaining(self) -> float:
+        """
+        Seconds left in the budget, 0 once it is used up.
+        """
+        return max(0.0, self.at - time.perf_counter())
+
+
+class Histogram:
+    """
+    Thread-safe cumulative histogram with one series per label value.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], label: Optional[str] = None) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._lock = threading.Lock()
+        # label value -> (per-bucket counts, with +Inf last; sum)
+        self._series: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, list(c), s[0]) for k, (c, s) in self._series.items())
+        for label_value, counts, total in series:
+            labels = f'{self.label}="{label_value}",' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels[:-1]}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total:g}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def render_gauges(prefix: str, values: Mapping[str, float], help: str) -> List[str]:
+    """
+    Render a group of gauges, one per key, in the Prometheus text format.
+    """
+    lines = []
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value:g}"]
+    return lines
+
+
+class QueryMetrics:
+    """
+    Aggregates query traces into histograms and keeps a log of slow queries.
+
+    Metrics are per process: with pre-forked workers each worker reports its own.
+    """
+
+    def __init__(self, slow_query_seconds: Optional[float] = 0.1, slow_log_size: int = 100) -> None:
+        """
+        Args:
+            slow_query_seconds (Optional[float]): Queries at least this slow are
+                printed and kept in `slow_queries`. None disables the slow-query log.
+            slow_log_size (int): Number of recent slow queries kept.
+        """
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_queries: Deque[Dict] = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.fallbacks = 0
+        self.slow = 0
+        self.query_seconds = Histogram(
+            "autocomplete_query_seconds", "Query latency in seconds.", TIME_BUCKETS)
+        self.stage_seconds = Histogram(
+            "autocomplete_stage_seconds", "Time spent in each query stage in seconds.", TIME_BUCKETS, "stage")
+        self.candidates = Histogram(
+            "autocomplete_candidates", "Candidates per query, ranked and actually scored.", COUNT_BUCKETS, "kind")
+        self.postings = Histogram(
+            "autocomplete_postings", "Posting list entries read per query.", COUNT_BUCKETS)
+
+    def record(self, trace: QueryTrace) -> None:
+        """
+        Add a finished query to the histograms, and to the slow-query log if it was slow.
+        """
+        total = trace.total
+        self.query_seconds.observe(total)
+        for stage, seconds in trace.stages.items():
+            self.stage_seconds.observe(seconds, stage)
+        counts = trace.counts
+        if "candidates" in counts:
+            self.candidates.observe(counts["candidates"], "ranked")
+            self.candidates.observe(counts.get("scored", 0), "scored")
+        if "postings" in counts:
+            self.postings.observe(counts["postings"])
+        slow = self.slow_query_seconds is not None and total >= self.slow_query_seconds
+        with self._lock:
+            self.queries += 1
+            self.fallbacks += counts.get("fallback", 0)
+            if slow:
+                self.slow += 1
+        if slow:
+            entry = {
+                "query": trace.query,
+                "ms": round(total * 1000, 3),
+                "stages_ms": {s: round(t * 1000, 3) for s, t in trace.stages.items()},
+                "counts": dict(counts),
+                "time": time.time(),
+            }
+            self.slow_queries.append(entry)
+            stages = " ".join(f"{s}={t:.1f}ms" for s, t in entry["stages_ms"].items())
+            counters = " ".join(f"{c}={n}" for c, n in counts.items())
+            print(f"[SLOW] {entry['ms']:.1f} ms query={trace.query!r} {stages} {counters}")
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            totals = [("autocomplete_queries_total", "Queries traced.", self.queries),
+                      ("autocomplete_fallback_total", "Queries answered from the character fallback scan.", self.fallbacks),
+                      ("autocomplete_slow_queries_total", "Queries slower than the slow-query threshold.", self.slow)]
+        lines = []
+        for name, help, value in totals:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {value}"]
+        for histogram in (self.query_seconds, self.stage_seconds, self.candidates, self.postings):
+            lines += histogram.render()
+        return "\n".join(lines) + "\n"
@@ -3,6 +3,7 @@ Data classes for autocomplete matches and results.
 """
 
 from dataclasses import dataclass
+from typing import List
 
 @dataclass
 class Match:
@@ -23,3 +24,15 @@ class AutoCompleteData:
     source_text: str
     offset: int
     score: int
+
+@dataclass
+class SearchResult:
+    """
+    The results of one query, or one step of a streamed query.
+
+    partial is set when the results are not known to be the best k: the query
+    ran out of its time budget, or this is not the final step of a stream.
+    """
+    results: List[AutoCompleteData]
+    partial: bool = False
+    final: bool = True
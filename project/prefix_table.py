@@ -0,0 +1,142 @@
+"""
+Precomputed answers for short and frequently typed queries.
+
+A prefix table maps a normalized query to the sentences that answer it: the
+first TOP_K sentences containing it exactly, in the order results are listed
+(by lowercased original line). Every string of up to `max_len` characters
+occurring in the archive gets an entry, as do the most frequent longer
+prefixes of a query log. Only queries with at least TOP_K exact matches are
+stored, since those are the whole answer (an exact match outscores any edit);
+other queries are left to the trigram search.
+"""
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+from index_file import SentenceTable
+from trigram import _normalize, _trigram_set
+
+# Sentences stored per query; larger k is searched as usual
+TOP_K = 10
+
+# Most query-log prefixes stored, and how often one must be typed to count
+HOT_PREFIXES = 1000
+HOT_MIN_COUNT = 2
+
+
+def hot_prefixes(queries: Iterable[str], max_len: int, limit: int = HOT_PREFIXES) -> List[str]:
+    """
+    The most frequent normalized prefixes longer than max_len among logged queries.
+
+    Every query counts once for each of its prefixes, so a query typed one
+    keystroke at a time and logged as a whole is counted like its keystrokes.
+
+    Args:
+        queries (Iterable[str]): Raw queries, one per logged search.
+        max_len (int): Prefixes up to this length are not counted.
+        limit (int): Most prefixes returned.
+
+    Returns:
+        List[str]: Prefixes typed at least HOT_MIN_COUNT times, most frequent first.
+    """
+    counts: Counter = Counter()
+    for query in queries:
+        qn = _normalize(query)
+        counts.update(qn[:i] for i in range(max_len + 1, len(qn) + 1) if qn[i - 1] != ' ')
+    return sorted(p for p, c in counts.most_common(limit) if c >= HOT_MIN_COUNT)
+
+
+def build_prefix_table(sentences: SentenceTable, grams: Mapping[str, Sequence[int]],
+                       keys: Sequence[str], max_len: int, hot: Sequence[str] = ()) -> Dict[str, List[int]]:
+    """
+    Find the first TOP_K sentences in key order containing every short string and hot prefix.
+
+    Short strings come from one pass over the sentences in key order, which
+    adds each sentence to the entries of its substrings that are not full yet.
+    A hot prefix is looked up in the shortest posting list of its trigrams.
+
+    Exact matches all score the same, so results list them by lowercased
+    original line, and every sentence lists its smallest one first. With
+    that as its key, the first k stored sentences hold the top k lines of a
+    search: any other sentence's lines come after the k lines listed first.
+
+    Args:
+        sentences (SentenceTable): The sentences to search.
+        grams (Mapping[str, Sequence[int]]): Trigram -> ascending sentence indices.
+        keys (Sequence[str]): Sort key of every sentence: the smallest
+            lowercased original among its lines.
+        max_len (int): Longest string stored from the sentences themselves.
+        hot (Sequence[str]): Normalized prefixes longer than max_len to store too.
+
+    Returns:
+        Dict[str, List[int]]: Query -> TOP_K sentence indices in key order
+            (ties in index order), for queries with at least TOP_K exact matches.
+    """
+    entries: Dict[str, List[int]] = {}
+    full = set()
+    if max_len > 0:
+        for idx in sorted(range(len(sentences)), key=lambda idx: (keys[idx], idx)):
+            s = sentences.norm(idx)
+            subs = {s[i:i + n] for n in range(1, max_len + 1) for i in range(len(s) - n + 1)}
+            for sub in subs - full:
+                found = entries.setdefault(sub, [])
+                found.append(idx)
+                if len(found) == TOP_K:
+                    full.add(sub)
+    table = {q: entries[q] for q in full if q[0] != ' ' and q[-1] != ' '}
+    for q in hot:
+        if len(q) < 3 or q in table:
+            continue
+        postings = min((grams.get(g, ()) for g in _trigram_set(q)), key=len)
+        found = [idx for idx in postings if q in sentences.norm(idx)]
+        if len(found) >= TOP_K:
+            table[q] = sorted(found, key=lambda idx: (keys[idx], idx))[:TOP_K]
+    return table
+
+
+class PrefixTable:
+    """
+    Read-only prefix table: query -> sentence indices in O(1).
+    """
+
+    def __init__(self, keys: List[str], rows: Sequence[int]) -> None:
+        """
+        Args:
+            keys (List[str]): Stored queries.
+            rows (Sequence[int]): TOP_K sentence indices per key, back to back in key order.
+        """
+        self._slots = {key: i * TOP_K for i, key in enumerate(keys)}
+        self._rows = rows
+
+    @classmethod
+    def from_entries(cls, table: Mapping[str, Sequence[int]]) -> "PrefixTable":
+        """
+        Table over the result of `build_prefix_table`.
+        """
+        keys = sorted(table)
+        return cls(keys, array('I', [idx for key in keys for idx in table[key]]))
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, q_norm: object) -> bool:
+        return q_norm in self._slots
+
+    def keys(self) -> List[str]:
+        return list(self._slots)
+
+    def rows(self) -> Sequence[int]:
+        return self._rows
+
+    def get(self, q_norm: str, k: int) -> Optional[Sequence[int]]:
+        """
+        The first k sentences in result order containing a normalized query.
+
+        Returns:
+            Optional[Sequence[int]]: Sentence indices, or None if the query is
+                not stored or k is larger than TOP_K.
+        """
+        slot = self._slots.get(q_norm)
+        if slot is None or k > TOP_K:
+            return None
+        return self._rows[slot:slot + k]
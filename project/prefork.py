@@ -0,0 +1,123 @@
+"""
+Pre-forked multi-process serving for the Flask app.
+
+The parent process loads the index, opens one listening socket and forks the
+worker processes. Each worker runs its own single-threaded WSGI server that
+accepts connections from the shared socket, so the kernel spreads requests
+over the workers and /search can use every core. Workers inherit the loaded
+database through fork: the memory-mapped index file is shared through the page
+cache and the rest is shared copy-on-write.
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class WorkerPool:
+    """
+    Supervises a fixed number of pre-forked WSGI worker processes.
+
+    Worker pids and readiness flags live in shared memory created before the
+    fork, so any worker can report the state of all of them.
+    """
+
+    def __init__(self, processes: int) -> None:
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self.processes = processes
+        self._pids = multiprocessing.Array('i', processes, lock=False)
+        self._ready = multiprocessing.Array('b', processes, lock=False)
+        self._running = False
+
+    def status(self) -> List[Dict[str, object]]:
+        """
+        Return the pid and readiness of every worker slot.
+        """
+        return [{"slot": i, "pid": self._pids[i], "ready": bool(self._ready[i])}
+                for i in range(self.processes)]
+
+    def serve(self, app, host: str = "127.0.0.1", port: int = 5000,
+              on_worker_start: Optional[Callable[[int], None]] = None) -> None:
+        """
+        Fork the workers and supervise them until SIGINT or SIGTERM.
+
+        A worker that exits is forked again. Call this from the main thread of a
+        process that has not started other threads, since only the calling
+        thread survives a fork.
+
+        Args:
+            app: WSGI application served by every worker.
+            host (str): Address to listen on.
+            port (int): Port to listen on.
+            on_worker_start (Optional[Callable[[int], None]]): Called in each new
+                worker with its slot number before it starts accepting requests.
+        """
+        sock = socket.create_server((host, port), backlog=1024)
+        sock.set_inheritable(True)
+        self._running = True
+
+        def stop(signum, frame):
+            self._running = False
+            for pid in self._pids:
+                if pid:
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        print(f"Serving on http://{host}:{port} with {self.processes} worker processes")
+        try:
+            for slot in range(self.processes):
+                self._spawn(slot, app, sock, host, port, on_worker_start)
+            while any(self._pids):
+                try:
+                    pid, _ = os.wait()
+                except ChildProcessError:
+                    break
+                except InterruptedError:
+                    continue
+                if pid not in self._pids:
+                    continue
+                slot = list(self._pids).index(pid)
+                self._pids[slot] = 0
+                self._ready[slot] = 0
+                if self._running:
+                    print(f"[WARN] Worker {pid} exited, restarting slot {slot}")
+                    time.sleep(0.5)  # avoid a tight loop if workers crash on start
+                    self._spawn(slot, app, sock, host, port, on_worker_start)
+        finally:
+            sock.close()
+
+    def _spawn(self, slot: int, app, sock: socket.socket, host: str, port: int,
+               on_worker_start: Optional[Callable[[int], None]]) -> None:
+        """
+        Fork one worker into the given slot.
+        """
+        pid = os.fork()
+        if pid:
+            self._pids[slot] = pid
+            return
+
+        # Worker process
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl+C
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            from werkzeug.serving import make_server
+            if on_worker_start is not None:
+                on_worker_start(slot)
+            server = make_server(host, port, app, threaded=False, fd=sock.fileno())
+            self._ready[slot] = 1
+            server.serve_forever()
+        except BaseException as e:
+            print(f"[WARN] Worker slot {slot} failed: {e}")
+            code = 1
+        finally:
+            self._ready[slot] = 0
+            os._exit(code)
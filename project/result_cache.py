@@ -0,0 +1,190 @@
+"""
+Bounded result cache with single-flight computation.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Flight:
+    """
+    A computation in progress that concurrent callers of the same key wait on.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by entry count, approximate memory and age.
+
+    `get_or_compute` coalesces concurrent misses on the same key: the first
+    caller computes the value while the others wait for it, so a burst of
+    identical requests costs a single computation. A caller with a deadline
+    stops waiting when it passes. Partial values are not cached.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: Optional[float] = 300.0,
+                 sizeof: Callable[[Any], int] = lambda value: 1024,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Args:
+            max_entries (int): Maximum number of cached values.
+            max_bytes (int): Maximum total of `sizeof` over cached values.
+            ttl (Optional[float]): Seconds a value stays valid; None keeps values until evicted.
+            sizeof (Callable[[Any], int]): Approximate size in bytes of a cached value.
+            clock (Callable[[], float]): Monotonic time source.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Return (found, value) for a fresh entry, dropping it if expired. Caller holds the lock.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, size, expires = entry
+        if expires < self._clock():
+            del self._entries[key]
+            self._bytes -= size
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        """
+        Insert a value and evict least recently used entries over the bounds. Caller holds the lock.
+        """
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        expires = self._clock() + self.ttl if self.ttl is not None else float("inf")
+        self._entries[key] = (value, size, expires)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value for key, or default.
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Cache a value for key.
+        """
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], timeout: Optional[float] = None,
+                       cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+        """
+        Return the cached value for key, computing and caching it on a miss.
+
+        If another thread is already computing the same key, wait for its
+        result instead of computing it again. Errors are propagated to every
+        waiting caller and nothing is cached.
+
+        Args:
+            key (Hashable): Cache key.
+            compute (Callable[[], Any]): Produces the value on a miss.
+            timeout (Optional[float]): Most seconds to wait for another thread's
+                computation, after which the value is computed here as well.
+                None waits until it is done.
+            cacheable (Callable[[Any], bool]): Whether a computed value is cached;
+                callers waiting for it get it either way.
+
+        Returns:
+            Any: The cached or computed value.
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if flight.done.wait(timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.value
+            value = compute()
+            if cacheable(value):
+                self.put(key, value)
+            return value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and cacheable(flight.value):
+                    self._store(key, flight.value)
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def clear(self) -> None:
+        """
+        Drop every cached value. Computations in progress are not affected.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the cache counters and current size.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 def _penalty_replace(pos1: int) -> int:
     """
@@ -157,11 +157,58 @@ def _find_candidate_windows(s: str, L: int, q_hint: str) -> List[int]:
         return list(range(len(s) - L + 1))
     return starts
 
+def _char_masks(s: str, chars: str) -> Dict[str, int]:
+    """
+    Build, for each distinct character of `chars`, a bitmask of its positions in s.
+
+    Args:
+        s (str): Candidate string.
+        chars (str): Characters to locate (the query).
+
+    Returns:
+        Dict[str, int]: Character -> int with bit i set iff s[i] == character.
+    """
+    masks = {}
+    for ch in set(chars):
+        m = 0
+        i = s.find(ch)
+        while i != -1:
+            m |= 1 << i
+            i = s.find(ch, i + 1)
+        masks[ch] = m
+    return masks
+
+def _window_starts(masks: Dict[str, int], len_s: int, L: int, first: str) -> int:
+    """
+    Bit-parallel counterpart of `_find_candidate_windows`: the set of window starts
+    of length L as a bitmask, restricted to starts at `first` when there are any.
+
+    Args:
+        masks (Dict[str, int]): Character position masks of the candidate string.
+        len_s (int): Length of the candidate string.
+        L (int): Window length.
+        first (str): First character of the query.
+
+    Returns:
+        int: Bitmask of the window starts to consider.
+    """
+    if L <= 0 or L > len_s:
+        return 0
+    valid = (1 << (len_s - L + 1)) - 1
+    return (valid & masks[first]) or valid
+
 def _best_substring_score(q: str, s: str) -> int:
     """
     Compute the best match score of normalized query q against all substrings of normalized sentence s,
     allowing exact match or one edit (replace, add, delete).
 
+    All windows are matched at once with bitmasks over the positions of s:
+    pre[p] marks the starts where q[:p] occurs and suf[p] the starts where q[p:]
+    occurs. A one-edit match at 1-based position p is then one AND of a prefix
+    and a shifted suffix mask, and scanning p from the end finds the latest edit
+    position, which carries the smallest penalty. Window starts and edit
+    positions follow `_find_candidate_windows` and `_match_one_replace/_add/_del`.
+
     Args:
         q (str): Normalized query.
         s (str): Normalized candidate string.
@@ -176,32 +223,40 @@ def _best_substring_score(q: str, s: str) -> int:
     if q in s:
         return 2 * n
 
+    len_s = len(s)
+    masks = _char_masks(s, q)
+    full = (1 << (len_s + 1)) - 1
+    pre = [full]
+    for p in range(n):
+        pre.append(pre[p] & (masks[q[p]] >> p))
+    suf = [0] * n + [full]
+    for p in range(n - 1, -1, -1):
+        suf[p] = masks[q[p]] & (suf[p + 1] >> 1)
+
     best = 0
 
-    # One replace
-    if len(s) >= n:
-        for start in _find_candidate_windows(s, n, q):
-            cand = s[start:start+n]
-            ok, score = _match_one_replace(q, cand)
-            if ok and score > best:
-                best = score
-                if best == 2 * n - 1:
-                    break
-
-    # One add (query longer by one)
-    if n >= 2 and len(s) >= n - 1:
-        for start in _find_candidate_windows(s, n-1, q[:-1] if n > 1 else q):
-            cand = s[start:start + n - 1]
-            ok, score = _match_one_add(q, cand)
-            if ok and score > best:
-                best = score
-
-    # One delete (query shorter by one)
-    if len(s) >= n + 1:
-        for start in _find_candidate_windows(s, n+1, q):
-            cand = s[start:start + n + 1]
-            ok, score = _match_one_del(q, cand)
-            if ok and score > best:
-                best = score
+    # One replace: window q[:p-1] + ? + q[p:]
+    starts = _window_starts(masks, len_s, n, q[0])
+    if starts:
+        for p in range(n, 0, -1):
+            if pre[p - 1] & (suf[p] >> p) & starts:
+                best = max(best, 2 * n - _penalty_replace(p))
+                break
+
+    # One add (query longer by one): window q[:p-1] + q[p:]
+    starts = _window_starts(masks, len_s, n - 1, q[0]) if n >= 2 else 0
+    if starts:
+        for p in range(n, 0, -1):
+            if pre[p - 1] & (suf[p] >> (p - 1)) & starts:
+                best = max(best, 2 * (n - 1) - _penalty_add_del(p))
+                break
+
+    # One delete (query shorter by one): window q[:p-1] + ? + q[p-1:]
+    starts = _window_starts(masks, len_s, n + 1, q[0])
+    if starts:
+        for p in range(n + 1, 0, -1):
+            if pre[p - 1] & (suf[p - 1] >> p) & starts:
+                best = max(best, 2 * n - _penalty_add_del(p))
+                break
 
     return best
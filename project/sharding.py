@@ -0,0 +1,457 @@
+"""
+Sharded autocomplete: the archive is split by file into several databases,
+each loaded and searched in its own worker process.
+"""
+
+import heapq
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+from itertools import count, islice
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+from text_data import TextDatabase
+from autocomplete import AutoCompleter, _last
+from models import AutoCompleteData, SearchResult
+from result_cache import ResultCache
+from metrics import QueryMetrics, QueryTrace
+from trigram import _min_shared_trigrams, _trigram_set, _trigrams
+
+def shard_index_path(index_path: Optional[str], shard_index: int, shards: int) -> str:
+    """
+    Index cache file of one shard, derived from the unsharded index path
+    (cache.idx next to text_data.py by default).
+    """
+    if index_path is None:
+        index_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache.idx")
+    base, ext = os.path.splitext(index_path)
+    return f"{base}.shard{shard_index}of{shards}{ext}"
+
+
+class _ShardCompleter(AutoCompleter):
+    """
+    Completer of one shard, answering the two phases of a sharded query.
+
+    A candidate cap over the whole archive can cut a tie group anywhere, so a
+    shard cannot pick its candidates alone: it first reports its own best
+    candidates with everything that orders them in one database, and the
+    coordinator picks the overall best (see `ShardedCompleter`). The shard then
+    scores those of the picked sentences it holds.
+    """
+
+    def candidates(self, qn: str, cap: int, fetched: Optional[Mapping[str, Sequence[int]]] = None
+                   ) -> Tuple[str, List[Tuple[tuple, str, int, str, int]]]:
+        """
+        The `cap` best candidates of this shard for a normalized query, as
+        `TextDatabase.candidates_with_counts` picks them. `fetched` holds posting
+        lists shared by a batch (see `TextDatabase.count_grams`).
+
+        Returns:
+            Tuple[str, List[Tuple[tuple, str, int, str, int]]]: "ranked", "fallback"
+                or "none", and a (rank key, file path, line number, normalized
+                sentence, sentence index) row per candidate, best first. The rank key
+                is (-shared trigrams, length, first query trigram in the sentence)
+                for ranked candidates and empty for fallback candidates; the first
+                line of the sentence breaks ties, as sentence indices do in one database.
+        """
+        db = self.db
+        grams = list(_trigrams(qn))
+        counts = db.count_grams(grams, fetched=fetched)
+        if counts:
+            kind, found = "ranked", db.rank_candidates(counts, cap, len(qn))
+        elif grams and not _min_shared_trigrams(len(qn)):
+            kind, found = "fallback", db.fallback_candidates(qn, cap)
+        else:
+            return "none", []
+        rows = []
+        for idx in found:
+            norm = db.norm(idx)
+            key: tuple = ()
+            if counts:
+                shared = _trigram_set(norm)
+                key = (-counts[idx], len(norm), next(j for j, g in enumerate(grams) if g in shared))
+            rows.append((key, *db.location(idx), norm, idx))
+        return kind, rows
+
+    def score(self, qn: str, k: int, counted: bool,
+              chosen: List[Tuple[str, Optional[int], Optional[int]]]) -> List[AutoCompleteData]:
+        """
+        Score the chosen candidates this shard holds and return its top k results.
+
+        Args:
+            qn (str): Normalized query.
+            k (int): Number of top completions to return.
+            counted (bool): Whether the candidates come with shared-trigram counts.
+            chosen (List[Tuple[str, Optional[int], Optional[int]]]): (normalized
+                sentence, index in this shard if known, shared trigrams) per
+                candidate, best first.
+        """
+        db = self.db
+        indices: List[int] = []
+        counts: Dict[int, int] = {}
+        for norm, idx, shared in chosen:
+            if idx is None:
+                idx = db.find_sentence(norm)
+            if idx is not None:
+                indices.append(idx)
+                counts[idx] = shared
+        return _last(self._score_steps(db, qn, indices, k, counts if counted else None)).results
+
+
+def _shard_main(conn, root_folder: str, shard_index: int, shards: int, index_path: str) -> None:
+    """
+    Worker process: load one shard and answer requests from the coordinator.
+
+    Requests are (id, "candidates", [(normalized query, cap), ...]) and
+    (id, "score", (k, [(normalized query, counted, chosen), ...])), answered
+    with one `_ShardCompleter.candidates` or `_ShardCompleter.score` value per
+    query; None stops the worker. The first message sent back is ("ready",
+    sentence count) or ("error", message); every reply after that is
+    (request id, "ok", values) or (request id, "error", message).
+    Requests are answered in order, but the coordinator may send several
+    before reading the replies.
+    """
+    try:
+        db = TextDatabase()
+        db.load(root_folder, index_path=index_path, shard=(shard_index, shards))
+        # The coordinator caches merged results, so shards keep no cache of their own
+        ac = _ShardCompleter(db, cache=ResultCache(max_entries=0))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", len(db)))
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        request_id, op, payload = request
+        try:
+            if op == "candidates":
+                fetched = db.postings(g for qn, _ in payload for g in _trigrams(qn))
+                values = [ac.candidates(qn, cap, fetched) for qn, cap in payload]
+            else:
+                k, queries = payload
+                values = [ac.score(qn, k, counted, chosen) for qn, counted, chosen in queries]
+            conn.send((request_id, "ok", values))
+        except Exception as e:
+            conn.send((request_id, "error", f"{type(e).__name__}: {e}"))
+
+
+def _choose(replies: Sequence[Tuple[str, list]], cap: int,
+            positions: Dict[str, int]) -> Tuple[bool, List[Tuple[str, Optional[int], Dict[int, int]]]]:
+    """
+    Pick the `cap` best candidates of the whole archive from every shard's
+    `_ShardCompleter.candidates` reply.
+
+    A sentence keeps the best rank key of its copies, and its first line is
+    placed by the position of its file in the walk order of the whole archive.
+    Each shard's list holds every one of the overall best that ranks first in
+    that shard, so the choice is the same as one database's.
+
+    Returns:
+        Tuple[bool, List[Tuple[str, Optional[int], Dict[int, int]]]]: Whether the
+            candidates are counted, and (normalized sentence, shared trigrams,
+            shard number -> sentence index) per chosen candidate, best first.
+    """
+    kinds = {kind for kind, _ in replies}
+    kind = "ranked" if "ranked" in kinds else "fallback" if "fallback" in kinds else None
+    if kind is None:
+        return False, []
+    best: Dict[str, tuple] = {}
+    copies: Dict[str, Dict[int, int]] = {}
+    for shard, (shard_kind, rows) in enumerate(replies):
+        if shard_kind != kind:
+            continue
+        for key, fpath, line, norm, idx in rows:
+            key += (positions[fpath], line)
+            copies.setdefault(norm, {})[shard] = idx
+            if norm not in best or key < best[norm]:
+                best[norm] = key
+    chosen = heapq.nsmallest(cap, best, key=best.__getitem__)
+    counted = kind == "ranked"
+    return counted, [(norm, -best[norm][0] if counted else None, copies[norm]) for norm in chosen]
+
+
+def _merge_top_k(lists: Iterable[List[AutoCompleteData]], k: int,
+                 positions: Dict[str, int]) -> List[AutoCompleteData]:
+    """
+    Merge per-shard result lists, each sorted by (-score, sentence.lower()) and
+    then file order, into the overall top k.
+    """
+    merged = heapq.merge(*lists, key=lambda r: (-r.score, r.completed_sentence.lower(),
+                                                positions[r.source_text], r.offset))
+    return list(islice(merged, k))
+
+
+class _Shard:
+    """
+    Coordinator side of one shard worker process.
+
+    Requests are tagged with an id and may be sent by several threads at once;
+    a reader thread hands every reply to the future of its request, so a
+    query waits only for its own replies.
+    """
+
+    def __init__(self, process, conn) -> None:
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()  # held while sending, and by the reader when the pipe closes
+        self._ids = count()
+        self._pending: Dict[int, Future] = {}
+        self._closed: Optional[str] = None
+
+    def receive(self):
+        """
+        Wait for the worker's first message, then start reading replies.
+        """
+        try:
+            status, value = self.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"shard process {self.process.pid} exited") from None
+        if status == "error":
+            raise RuntimeError(f"shard process {self.process.pid} failed: {value}")
+        threading.Thread(target=self._read, name=f"shard-{self.process.pid}", daemon=True).start()
+        return value
+
+    def request(self, op: str, payload: Any) -> Future:
+        """
+        Send a request; the returned future gets the reply.
+        """
+        future: Future = Future()
+        with self.lock:
+            if self._closed is not None:
+                raise RuntimeError(self._closed)
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self.conn.send((request_id, op, payload))
+            except BaseException:
+                del self._pending[request_id]
+                raise
+        return future
+
+    def _read(self) -> None:
+        """
+        Reader thread: resolve the future of every reply until the pipe closes.
+        """
+        while True:
+            try:
+                request_id, status, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id)
+            if status == "error":
+                future.set_exception(RuntimeError(f"shard process {self.process.pid} failed: {value}"))
+            else:
+                future.set_result(value)
+        with self.lock:
+            self._closed = f"shard process {self.process.pid} exited"
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(self._closed))
+
+
+class ShardedCompleter(AutoCompleter):
+    """
+    Coordinator over N shard processes, each holding the database of a disjoint
+    subset of the archive's files.
+
+    Every query takes two rounds over all shards at once. In the first, each
+    shard reports its best candidates up to the candidate cap, and the
+    coordinator picks the cap best of the whole archive from them (see
+    `_choose`). In the second, each shard scores the picked sentences it holds
+    and returns its own top k, and the coordinator merges them with the same
+    (-score, sentence.lower(), file order) ordering as `AutoCompleter`. The
+    results are the same as those of one database over the whole archive.
+    Shards load in parallel, and each round costs only as much as the slowest shard.
+
+    Merged results are cached here as in `AutoCompleter`.
+    """
+
+    def __init__(self, root_folder: str, shards: int, index_path: Optional[str] = None,
+                 cap_per_query: Optional[int] = None, cache: Optional[ResultCache] = None,
+                 metrics: Optional[QueryMetrics] = None) -> None:
+        """
+        Start the shard processes and wait until every shard is loaded.
+
+        Args:
+            root_folder (str): Path to the root folder containing .txt files.
+            shards (int): Number of shard processes.
+            index_path (Optional[str]): Unsharded index cache path; each shard
+                stores its own index cache next to it (see `shard_index_path`).
+            cap_per_query (Optional[int]): Candidate cap over the whole archive,
+                as in `AutoCompleter`.
+            cache (Optional[ResultCache]): Cache of merged results.
+            metrics (Optional[QueryMetrics]): Records the normalize, shards
+                (fan-out and merge) and cache stages of every query.
+        """
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        super().__init__(None, cap_per_query=cap_per_query, cache=cache, metrics=metrics)
+        self.shards: List[_Shard] = []
+        try:
+            for i in range(shards):
+                conn, child_conn = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_shard_main,
+                    args=(child_conn, root_folder, i, shards, shard_index_path(index_path, i, shards)),
+                    daemon=True,
+                )
+                process.start()
+                child_conn.close()
+                self.shards.append(_Shard(process, conn))
+            self.sizes = [shard.receive() for shard in self.shards]
+            # Walk position of every file, to order lines as one database over the archive does
+            self.positions = {fpath: i for i, fpath in enumerate(TextDatabase.archive_files(root_folder))}
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        return sum(self.sizes)
+
+    def close(self) -> None:
+        """
+        Stop the shard processes.
+        """
+        for shard in self.shards:
+            try:
+                with shard.lock:
+                    shard.conn.send(None)
+            except OSError:
+                pass
+        for shard in self.shards:
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.conn.close()
+        self.shards = []
+
+    def __enter__(self) -> "ShardedCompleter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _fan_out(self, op: str, payloads: Sequence[Any]) -> list:
+        """
+        Send one request to every shard, then collect the replies in shard order.
+        Other threads may have requests in flight on the same shards meanwhile.
+        """
+        futures = [shard.request(op, payload) for shard, payload in zip(self.shards, payloads)]
+        return [future.result() for future in futures]
+
+    def _search_many(self, qns: List[str], k: int) -> List[List[AutoCompleteData]]:
+        """
+        Compute the results of normalized queries with the two rounds over the shards.
+        """
+        caps = [(qn, self.cap_for(qn)) for qn in qns]
+        replies = self._fan_out("candidates", [caps] * len(self.shards))
+        jobs: List[list] = [[] for _ in self.shards]
+        for i, (qn, cap) in enumerate(caps):
+            counted, chosen = _choose([reply[i] for reply in replies], cap, self.positions)
+            for shard, shard_jobs in enumerate(jobs):
+                shard_jobs.append((qn, counted, [(norm, copies.get(shard), shared)
+                                                 for norm, shared, copies in chosen]))
+        per_shard = self._fan_out("score", [(k, shard_jobs) for shard_jobs in jobs])
+        return [_merge_top_k((results[i] for results in per_shard), k, self.positions)
+                for i in range(len(qns))]
+
+    def get_best_k_completions(self, query: str, k: int = 5,
+                               budget: Optional[float] = None) -> List[AutoCompleteData]:
+        """
+        Get the best k autocomplete suggestions over all shards.
+
+        Args:
+            query (str): The raw input query string.
+            k (int, optional): Number of top completions to return. Defaults to 5.
+            budget (Optional[float]): Not enforced: every shard searches in full.
+
+        Returns:
+            List[AutoCompleteData]: Results sorted by descending score, then alphabetically.
+        """
+        trace = QueryTrace(query) if self.metrics is not None else None
+        qn = self._norm(query)
+        if trace is not None:
+            trace.lap("normalize")
+        if not qn or k <= 0:
+            return []
+
+        def compute() -> List[AutoCompleteData]:
+            results = self._search_many([qn], k)[0]
+            if trace is not None:
+                trace.lap("shards")
+            return results
+
+        results = self._cached(None, qn, k, compute)
+        if trace is not None:
+            trace.lap("cache")
+            self.metrics.record(trace)
+        return results
+
+    def search(self, query: str, k: int = 5, budget: Optional[float] = None) -> SearchResult:
+        """
+        Same as `get_best_k_completions`; the results are never partial.
+        """
+        return SearchResult(self.get_best_k_completions(query, k))
+
+    def stream(self, query: str, k: int = 5, budget: Optional[float] = None) -> Iterator[SearchResult]:
+        """
+        Yield the final results only, as shards do not report intermediate steps.
+        """
+        yield self.search(query, k, budget)
+
+    def get_best_k_completions_many(self, queries: Iterable[str], k: int = 5) -> List[List[AutoCompleteData]]:
+        """
+        Get the best k autocomplete suggestions for many queries, sending the
+        queries missing from the result cache to every shard as one batch.
+
+        Args:
+            queries (Iterable[str]): Raw query strings.
+            k (int, optional): Number of top completions per query. Defaults to 5.
+
+        Returns:
+            List[List[AutoCompleteData]]: One result list per query, in input order.
+        """
+        normalized = [self._norm(q) for q in queries]
+        if k <= 0:
+            return [[] for _ in normalized]
+        by_qn = {"": []}
+        missing = []
+        for qn in sorted(set(normalized) - {""}):
+            cached = self.cache.get((None, qn, k))
+            if cached is None:
+                missing.append(qn)
+            else:
+                by_qn[qn] = cached.results
+        if missing:
+            for qn, results in zip(missing, self._search_many(missing, k)):
+                by_qn[qn] = results
+                self.cache.put((None, qn, k), SearchResult(results))
+        return [list(by_qn[qn]) for qn in normalized]
+
+    def session(self) -> "ShardedSession":
+        """
+        Start a type-ahead session. Shards do not keep per-user state, so every
+        keystroke is a full (cached) query.
+        """
+        return ShardedSession(self)
+
+
+class ShardedSession:
+    """
+    Type-ahead session of a `ShardedCompleter`, with the same interface as `TypeaheadSession`.
+    """
+
+    def __init__(self, completer: ShardedCompleter) -> None:
+        self.completer = completer
+
+    def get_best_k_completions(self, query: str, k: int = 5,
+                               budget: Optional[float] = None) -> List[AutoCompleteData]:
+        return self.completer.get_best_k_completions(query, k)
+
+    def search(self, query: str, k: int = 5, budget: Optional[float] = None) -> SearchResult:
+        return self.completer.search(query, k)
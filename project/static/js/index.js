@@ -3,53 +3,108 @@ document.addEventListener("DOMContentLoaded", () => {
   const resultsBox = document.getElementById("resultsBox");
   const loading = document.getElementById("loading");
   const button = document.getElementById("searchButton");
+  // Lets the server reuse work while the query grows one keystroke at a time
+  const sessionId = window.crypto && crypto.randomUUID
+    ? crypto.randomUUID()
+    : Math.random().toString(36).slice(2);
+
+  // Wait this long after the last keystroke before searching
+  const DEBOUNCE_MS = 150;
+  // Recent responses by query, least recently used first, so backspacing is instant
+  const CACHE_LIMIT = 50;
+  const cache = new Map();
+
+  let timer = null;
+  let controller = null;
 
   function showLoading(show) {
     loading.style.display = show ? "block" : "none";
   }
 
+  function cached(query) {
+    const data = cache.get(query);
+    if (data !== undefined) {
+      cache.delete(query);
+      cache.set(query, data);
+    }
+    return data;
+  }
+
+  function remember(query, data) {
+    cache.set(query, data);
+    if (cache.size > CACHE_LIMIT) {
+      cache.delete(cache.keys().next().value);
+    }
+  }
+
+  function render(data) {
+    if (data.rows.length === 0) {
+      resultsBox.innerHTML = "No results found.";
+      return;
+    }
+    resultsBox.innerHTML = "";
+    // Compact rows: [completed_sentence, index in data.files, line, score]
+    data.rows.forEach(([sentence, file, line, score]) => {
+      const div = document.createElement("div");
+      div.classList.add("result-item");
+      div.innerHTML = `${sentence} <div class="result-file">[File: ${data.files[file]}, Line: ${line}, Score: ${score}]</div>`;
+      resultsBox.appendChild(div);
+    });
+  }
+
   async function performSearch() {
+    clearTimeout(timer);
     const query = input.value.trim();
+    // Only the latest query's response is shown; older requests are aborted
+    if (controller) {
+      controller.abort();
+      controller = null;
+    }
     if (!query) {
       resultsBox.innerHTML = "";
+      showLoading(false);
+      return;
+    }
+    const hit = cached(query);
+    if (hit) {
+      // The fetch aborted above no longer hides the spinner itself
+      showLoading(false);
+      render(hit);
       return;
     }
 
-    // Loading
-    button.disabled = true;
-    const originalText = button.textContent;
-    button.textContent = "Loading...";
-
+    const current = controller = new AbortController();
     showLoading(true);
     try {
-      const res = await fetch(`/search?q=${encodeURIComponent(query)}`);
+      // The session goes in a header so the URL, and the HTTP cache entry, is shared by every tab
+      const res = await fetch(`/typeahead?q=${encodeURIComponent(query)}`, {
+        signal: current.signal,
+        headers: { "X-Typeahead-Session": sessionId },
+      });
       const data = await res.json();
-
-      showLoading(false);
-
-      if (data.length === 0) {
-        resultsBox.innerHTML = "No results found.";
-        return;
+      if (!data.partial) {
+        remember(query, data);
       }
-
-      resultsBox.innerHTML = "";
-      data.forEach(item => {
-        const div = document.createElement("div");
-        div.classList.add("result-item");
-        div.innerHTML = `${item.completed_sentence} <div class="result-file">[File: ${item.file}, Line: ${item.line}, Score: ${item.score}]</div>`;
-        resultsBox.appendChild(div);
-      });
+      render(data);
     } catch (e) {
-      showLoading(false);
+      if (e.name === "AbortError") return;
       resultsBox.innerHTML = "Error fetching results.";
     } finally {
-      button.disabled = false;
-      button.textContent = originalText;
+      if (controller === current) {
+        controller = null;
+        showLoading(false);
+      }
     }
   }
 
   button.addEventListener("click", performSearch);
 
+  // Search as the user types, once typing pauses
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(performSearch, DEBOUNCE_MS);
+  });
+
   // Enter for search
   input.addEventListener("keydown", (e) => {
     if (e.key === "Enter") {
@@ -0,0 +1,159 @@
+"""
+Suffix array over the normalized sentences, for answering exact substring queries
+without counting trigram postings.
+
+Every suffix starts at a character boundary of a sentence's UTF-8 text and ends
+at the end of that sentence, so a match never runs into the next sentence.
+Since UTF-8 is self-synchronizing, a byte match at a character boundary is a
+character match.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+Text = Union[bytes, bytearray, memoryview]
+
+
+# Characters of every suffix compared directly before prefix doubling
+PREFIX_CHARS = 16
+
+
+def build_suffix_array(norm_text: Text, norm_offsets: Sequence[int]) -> array:
+    """
+    Sort the suffixes of every sentence.
+
+    Suffixes are compared as byte strings cut at the end of their sentence;
+    equal suffixes keep their text order. UTF-8 orders characters like their
+    code points, so suffixes are sorted as character strings: grouped by their
+    first PREFIX_CHARS characters, then by prefix doubling (Larsson-Sadakane),
+    which splits every group of suffixes with equal h-character prefixes by the
+    rank of the suffix h characters further, doubling h until every group is
+    a single suffix. Only rank, position and sentence-end arrays span the whole
+    text, so memory grows linearly with it. The whole array is still rebuilt
+    on every index build.
+
+    Args:
+        norm_text (Text): Normalized sentences back to back, UTF-8 encoded.
+        norm_offsets (Sequence[int]): Start of every sentence in norm_text, plus the end.
+
+    Returns:
+        array: Byte positions in norm_text ('Q'), in ascending order of their suffix.
+    """
+    data = bytes(norm_text)
+    text = data.decode('utf-8')
+    n = len(text)
+    typecode = 'I' if n < 1 << 32 else 'Q'
+    ends = array(typecode)  # character position -> where its sentence ends
+    # First two characters of every suffix -> suffixes, in text order
+    buckets: Dict[str, array] = {}
+    for s in range(len(norm_offsets) - 1):
+        sentence = data[norm_offsets[s]:norm_offsets[s + 1]].decode('utf-8')
+        p = len(ends)
+        ends.extend(array(typecode, [p + len(sentence)]) * len(sentence))
+        for p, head in enumerate([sentence[i:i + 2] for i in range(len(sentence))], p):
+            bucket = buckets.get(head)
+            if bucket is None:
+                bucket = buckets[head] = array(typecode)
+            bucket.append(p)
+
+    sa = array(typecode, bytes(ends.itemsize * n))
+    rank = array(typecode, bytes(ends.itemsize * n))  # suffix -> position of its group in sa
+    groups = array('Q')  # start, stop of every group still to sort, back to back
+
+    def place(start: int, members: List[int], keys: list, final) -> None:
+        """
+        Store members sorted by keys at sa[start:], one group per run of equal keys.
+        """
+        sa[start:start + len(members)] = array(typecode, members)
+        ranks = list(range(start, start + len(members)))
+        for i in [i for i in range(1, len(keys)) if keys[i] == keys[i - 1]]:
+            if final(keys[i]):
+                continue
+            head = ranks[i] = ranks[i - 1]
+            if head == start + i - 1:
+                groups.extend((head, start + i + 1))
+            else:
+                groups[-1] = start + i + 1
+        for p, r in zip(members, ranks):
+            rank[p] = r
+
+    # First characters, sorted one bucket at a time to bound the memory of each
+    # sort; suffixes shorter than PREFIX_CHARS that are equal stay in text order
+    start = 0
+    for head in sorted(buckets):
+        bucket = buckets.pop(head)
+        prefixes = [text[p:min(p + PREFIX_CHARS, ends[p])] for p in bucket]
+        order = sorted(range(len(bucket)), key=prefixes.__getitem__)
+        place(start, [bucket[i] for i in order], [prefixes[i] for i in order],
+              lambda prefix: len(prefix) < PREFIX_CHARS)
+        start += len(bucket)
+
+    # Then doubling: a suffix ending within h characters sorts first, in text
+    # order (key p < n); the others by the rank of the suffix h further (key >= n)
+    shift = max(1, n.bit_length())
+    mask = (1 << shift) - 1
+    h = PREFIX_CHARS
+    while groups:
+        current, groups = groups, array('Q')
+        for start, stop in zip(current[::2], current[1::2]):
+            packed = sorted(((rank[p + h] + n if p + h < ends[p] else p) << shift) | p
+                            for p in sa[start:stop])
+            place(start, [v & mask for v in packed], [v >> shift for v in packed], lambda key: False)
+        h *= 2
+
+    del rank, ends, text
+    if len(data) == n:  # ASCII: characters are bytes
+        return array('Q', sa)
+    starts = array('Q', (p for p in range(len(data)) if data[p] & 0xC0 != 0x80))
+    return array('Q', map(starts.__getitem__, sa))
+
+
+class SuffixArray:
+    """
+    Exact substring search over the sentences of a `SentenceTable`.
+    """
+
+    def __init__(self, suffixes: Sequence[int], norm_text: Text, norm_offsets: Sequence[int]) -> None:
+        self.suffixes = suffixes
+        self._text = norm_text
+        self._offsets = norm_offsets
+
+    def _prefix(self, p: int, m: int) -> bytes:
+        """
+        Up to m bytes of the suffix at position p, cut at the end of its sentence.
+        """
+        end = self._offsets[bisect_right(self._offsets, p)]
+        return bytes(self._text[p:min(p + m, end)])
+
+    def find(self, q_norm: str) -> Tuple[int, int]:
+        """
+        Locate the suffixes starting with a normalized query, with two binary searches.
+
+        Returns:
+            Tuple[int, int]: The range [lo, hi) of matching rows in `suffixes`.
+        """
+        qb = q_norm.encode('utf-8')
+        m = len(qb)
+        key = lambda p: self._prefix(p, m)
+        lo = bisect_left(self.suffixes, qb, key=key)
+        hi = bisect_right(self.suffixes, qb, lo=lo, key=key)
+        return lo, hi
+
+    def sentences(self, q_norm: str, limit: int) -> Optional[List[int]]:
+        """
+        Indices of the sentences containing a normalized query.
+
+        Args:
+            q_norm (str): Normalized query.
+            limit (int): Most occurrences to resolve to sentences.
+
+        Returns:
+            Optional[List[int]]: Distinct sentence indices in ascending order,
+                or None if the query occurs more than `limit` times.
+        """
+        lo, hi = self.find(q_norm)
+        if hi - lo > limit:
+            return None
+        offsets = self._offsets
+        return sorted({bisect_right(offsets, p) - 1 for p in self.suffixes[lo:hi]})
@@ -1,16 +1,24 @@
 import pytest
 from unittest.mock import MagicMock, patch
-from project.autocomplete import AutoCompleter
+from project.autocomplete import FILTERED_CAP, AutoCompleter
 from project.models import AutoCompleteData, Match
+from project.result_cache import ResultCache
 
 @pytest.fixture
 def mock_db():
     db = MagicMock()
-    db.candidates_by_query.return_value = [0, 1]
-    db.items = [
+    db.candidates_with_counts.return_value = ([0, 1], None)
+    db.prefix_candidates.return_value = None
+    sentences = [
         ("Hello World", "file1.txt", 10, "hello world"),
         ("Hi There", "file2.txt", 20, "hi there"),
     ]
+    db.norm.side_effect = lambda i: sentences[i][3]
+    db.location.side_effect = lambda i: (sentences[i][1], sentences[i][2])
+    db.originals.side_effect = lambda idxs: [sentences[i][0] for i in idxs]
+    db.location_count.return_value = 1
+    db.occurrences.side_effect = lambda idxs, limit: [[(sentences[i][1], sentences[i][2], sentences[i][0])]
+                                                      for i in idxs]
     return db
 
 def test_norm_caching(mock_db):
@@ -27,7 +35,7 @@ def test_get_best_k_completions_empty_query(mock_db):
     with patch("project.autocomplete._normalize", return_value="") as mock_norm:
         results = ac.get_best_k_completions("  ")
         assert results == []
-        mock_db.candidates_by_query.assert_not_called()
+        mock_db.candidates_with_counts.assert_not_called()
 
 def test_get_best_k_completions_with_matches(mock_db):
     ac = AutoCompleter(mock_db)
@@ -51,3 +59,221 @@ def test_get_best_k_completions_no_positive_score(mock_db):
          patch("project.autocomplete._best_substring_score", return_value=0):
         results = ac.get_best_k_completions("hello")
         assert results == []
+
+def test_typeahead_session_matches_full_search(tmp_path):
+    from project.text_data import TextDatabase
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_text(
+        "Hello world\nhelp wanted\nthe world is wide\nhello there world\nworld of hello\n",
+        encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    ac = AutoCompleter(db)
+    reference = AutoCompleter(db, cache=ResultCache(max_entries=0))
+    session = ac.session()
+    typed = ["h", "he", "hel", "hell", "hello", "hello", "hello ", "hello w", "hello wo",
+             "hello w", "help", "helo worl", "", "wor", "world"]
+    for q in typed:
+        assert session.get_best_k_completions(q, k=3) == reference.get_best_k_completions(q, k=3), q
+
+def test_results_are_cached_per_generation(mock_db):
+    mock_db.generation = 1
+    ac = AutoCompleter(mock_db)
+    with patch("project.autocomplete._normalize", return_value="hello"), \
+         patch("project.autocomplete._best_substring_score", return_value=10):
+        first = ac.get_best_k_completions("hello", k=1)
+        assert ac.get_best_k_completions("hello", k=1) == first
+        assert mock_db.candidates_with_counts.call_count == 1
+        mock_db.generation = 2
+        ac.get_best_k_completions("hello", k=1)
+        assert mock_db.candidates_with_counts.call_count == 2
+    assert ac.cache.stats()["hits"] == 1
+
+@pytest.fixture
+def corpus_db(tmp_path):
+    import random
+    from project.text_data import TextDatabase
+    rng = random.Random(11)
+    words = ["hello", "help", "world", "word", "there", "the", "other", "then", "wide", "hold"]
+    root = tmp_path / "Archive"
+    root.mkdir()
+    for f in range(3):
+        lines = [" ".join(rng.choice(words) for _ in range(rng.randint(2, 6))) for _ in range(200)]
+        (root / f"f{f}.txt").write_text("\n".join(lines), encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    return db
+
+def _exhaustive(db, qn, cap, k):
+    from project.scoring import _best_substring_score
+    scored = [(_best_substring_score(qn, db.norm(i)), i) for i in db.candidates_by_query(qn, cap)]
+    scored = [(s, i) for s, i in scored if s > 0]
+    rows = [(s, orig, (fpath, line)) for s, i in scored for fpath, line, orig in db.occurrences([i], k)[0]]
+    rows.sort(key=lambda r: (-r[0], r[1].lower()))
+    return [(orig, fpath, line, s) for s, orig, (fpath, line) in rows[:k]]
+
+def test_pruned_top_k_matches_exhaustive_scoring(corpus_db):
+    queries = ["hello world", "helo wrld", "the other", "word then", "hold", "xyz",
+               "wide hello there", "thre", "help wide", "other then world"]
+    for cap in (20, 500):
+        ac = AutoCompleter(corpus_db, cap_per_query=cap)
+        for q in queries:
+            for k in (1, 3, 10):
+                got = [(r.completed_sentence, r.source_text, r.offset, r.score)
+                       for r in ac.get_best_k_completions(q, k=k)]
+                assert got == _exhaustive(corpus_db, q, cap, k), (q, cap, k)
+
+def test_pruning_skips_hopeless_candidates(corpus_db):
+    from project import scoring
+    ac = AutoCompleter(corpus_db, cap_per_query=500)
+    with patch("project.autocomplete._best_substring_score",
+               wraps=scoring._best_substring_score) as mock_score:
+        ac.get_best_k_completions("hello world", k=3)
+    assert mock_score.call_count < len(corpus_db.candidates_by_query("hello world", 500))
+
+def test_adaptive_cap_shrinks_with_query_length(mock_db):
+    ac = AutoCompleter(mock_db)
+    caps = [ac.cap_for("x" * n) for n in (1, 3, 4, 5)]
+    assert caps == sorted(caps, reverse=True)
+    assert ac.cap_for("x" * 6) == ac.cap_for("x" * 200) == FILTERED_CAP
+    assert AutoCompleter(mock_db, cap_per_query=42).cap_for("anything") == 42
+
+def test_batch_matches_single_queries(corpus_db):
+    queries = ["hello world", "hello", "hello wor", "", "helo", "hello world", "xyz", "Hello, World!"]
+    batch = AutoCompleter(corpus_db).get_best_k_completions_many(queries, k=3)
+    single = AutoCompleter(corpus_db, cache=ResultCache(max_entries=0))
+    assert batch == [single.get_best_k_completions(q, k=3) for q in queries]
+
+def test_batch_fetches_each_posting_list_once(corpus_db, monkeypatch):
+    queries = ["hello world", "world hello", "the other", "hello", "other then", "helo"]
+    single = AutoCompleter(corpus_db, cache=ResultCache(max_entries=0))
+    expected = [single.get_best_k_completions(q, k=3) for q in queries]
+    index, fetched = corpus_db._gram_index, []
+
+    class CountingIndex:
+        def get(self, gram, default=None):
+            fetched.append(gram)
+            return index.get(gram, default)
+
+    monkeypatch.setattr(corpus_db, "_gram_index", CountingIndex())
+    assert AutoCompleter(corpus_db).get_best_k_completions_many(queries, k=3) == expected
+    assert fetched and len(fetched) == len(set(fetched))
+
+def test_count_filter_drops_only_hopeless_candidates(corpus_db):
+    from project.scoring import _best_substring_score
+    from project.trigram import _trigrams
+    for qn in ["hello world", "helo wrld", "other then world", "wide hello there", "hold", "xyzxyzxyz"]:
+        counts = corpus_db.count_grams(_trigrams(qn))
+        kept = set(corpus_db.rank_candidates(counts, len(corpus_db), len(qn)))
+        matches = {i for i in range(len(corpus_db)) if _best_substring_score(qn, corpus_db.norm(i)) > 0}
+        assert matches <= kept, qn
+        if len(qn) >= 6:
+            assert len(kept) < len(counts) or not counts, qn
+
+def test_suffix_array_answers_exact_queries(corpus_db, tmp_path):
+    from project import scoring
+    from project.text_data import TextDatabase
+    db = TextDatabase()
+    db.load(str(tmp_path / "Archive"), index_path=str(tmp_path / "cache.idx"), suffix_array=True)
+    ac = AutoCompleter(db, cap_per_query=10000, cache=ResultCache(max_entries=0))
+    reference = AutoCompleter(corpus_db, cap_per_query=10000, cache=ResultCache(max_entries=0))
+    for q in ["hello world", "helo wrld", "the other", "hold", "xyz", "wide hello there", "word then"]:
+        for k in (1, 5):
+            assert ac.get_best_k_completions(q, k=k) == reference.get_best_k_completions(q, k=k), (q, k)
+    with patch("project.autocomplete._best_substring_score",
+               wraps=scoring._best_substring_score) as mock_score:
+        assert ac.get_best_k_completions("hello world", k=3)
+    assert mock_score.call_count == 0
+
+def test_budget_returns_partial_results(corpus_db):
+    full = AutoCompleter(corpus_db, cache=ResultCache(max_entries=0))
+    ac = AutoCompleter(corpus_db)
+    expected = full.get_best_k_completions("hello world", k=3)
+    result = ac.search("hello world", k=3, budget=0)
+    assert result.partial and result.results
+    assert len(ac.cache) == 0  # partial results are not cached
+    result = ac.search("hello world", k=3, budget=60)
+    assert (result.results, result.partial) == (expected, False)
+    result = ac.search("hello world", k=3, budget=0)  # now cached
+    assert (result.results, result.partial) == (expected, False)
+    session = ac.session()
+    assert session.search("helo", k=3, budget=0).partial
+    assert session.get_best_k_completions("helo wo", k=3) == full.get_best_k_completions("helo wo", k=3)
+
+def test_budgeted_queries_share_one_computation(corpus_db):
+    import threading
+    import time
+    from project import scoring
+    ac = AutoCompleter(corpus_db)
+    release = threading.Event()
+
+    def slow_score(q, s):
+        release.wait(5)
+        return scoring._best_substring_score(q, s)
+
+    results = []
+    with patch("project.autocomplete._best_substring_score", side_effect=slow_score):
+        threads = [threading.Thread(target=lambda: results.append(ac.search("helo wrld", k=3, budget=5)))
+                   for _ in range(3)]
+        for t in threads:
+            t.start()
+        deadline = time.monotonic() + 5
+        while ac.cache.stats()["coalesced"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for t in threads:
+            t.join()
+    assert ac.cache.stats()["misses"] == 1
+    assert len({tuple(map(repr, r.results)) for r in results}) == 1 and not results[0].partial
+
+def test_stream_sends_exact_matches_first(corpus_db):
+    reference = AutoCompleter(corpus_db, cache=ResultCache(max_entries=0))
+    for q in ["hello world", "helo wrld", "then wide", "xyz"]:
+        ac = AutoCompleter(corpus_db)
+        steps = list(ac.stream(q, k=5))
+        last = steps[-1]
+        assert (last.results, last.partial, last.final) == (reference.get_best_k_completions(q, k=5), False, True), q
+        assert all(s.partial and not s.final for s in steps[:-1])
+        if len(steps) > 1:
+            assert all(r.score == 2 * len(q) for r in steps[0].results), q
+        assert list(ac.stream(q, k=5)) == [steps[-1]]  # cached
+
+def test_repeated_sentence_lists_its_lines_like_separate_lines(tmp_path):
+    from project.text_data import TextDatabase
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_text("Hello, World\nhello world\nHELLO WORLD!\n", encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    ac = AutoCompleter(db)
+    assert len(db) == 1
+    got = [[(r.completed_sentence, r.offset) for r in ac.get_best_k_completions("hello wor", k=k)] for k in (1, 2, 3)]
+    assert got == [[("hello world", 2)],
+                   [("hello world", 2), ("HELLO WORLD!", 3)],
+                   [("hello world", 2), ("HELLO WORLD!", 3), ("Hello, World", 1)]]
+
+def test_prefix_table_answers_short_queries(tmp_path):
+    from project.text_data import TextDatabase
+    root = tmp_path / "Archive"
+    root.mkdir()
+    # "Line 2 of b2!" is stored with "line 2 of b2" but lists after it
+    (root / "a.txt").write_text("".join(f"line {i} of b{i % 3}\n" for i in range(30)) + "Line 2 of b2!\n",
+                                encoding="utf-8")
+    plain, table = TextDatabase(), TextDatabase()
+    plain.load(str(root), index_path=str(tmp_path / "plain.idx"))
+    table.load(str(root), index_path=str(tmp_path / "table.idx"), prefix_table=2)
+    reference = AutoCompleter(plain, cache=ResultCache(max_entries=0))
+    ac = AutoCompleter(table, cache=ResultCache(max_entries=0))
+    table.candidates_with_counts = None  # must not be searched
+    results = ac.get_best_k_completions("b1", k=3)
+    assert [r.completed_sentence for r in results] == ["line 1 of b1", "line 10 of b1", "line 13 of b1"]
+    assert all(r.score == 4 for r in results)
+    for q in ["b1", "1", "li", "f"]:
+        for k in (1, 3, 10):
+            assert ac.get_best_k_completions(q, k=k) == reference.get_best_k_completions(q, k=k), (q, k)
+    assert ac.get_best_k_completions("b2", k=3) == reference.get_best_k_completions("b2", k=3)
+    # Beyond the table's k the query is searched as usual
+    del table.candidates_with_counts
+    assert (AutoCompleter(table).get_best_k_completions("b1", k=20)
+            == AutoCompleter(plain).get_best_k_completions("b1", k=20))
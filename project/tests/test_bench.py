@@ -0,0 +1,33 @@
+from project.bench.corpus import NO_HIT_CHARS, generate_corpus
+from project.bench.runner import compare, percentiles, run
+from project.bench.workloads import WORKLOADS
+
+def _read_all(paths):
+    return [open(p, encoding="utf-8").read() for p in paths]
+
+def test_corpus_is_deterministic(tmp_path):
+    a = generate_corpus(str(tmp_path / "a"), files=3, lines=20, vocab=50, seed=7)
+    b = generate_corpus(str(tmp_path / "b"), files=3, lines=20, vocab=50, seed=7)
+    c = generate_corpus(str(tmp_path / "c"), files=3, lines=20, vocab=50, seed=8)
+    assert _read_all(a) == _read_all(b)
+    assert _read_all(a) != _read_all(c)
+    assert not any(ch in text for text in _read_all(a) for ch in NO_HIT_CHARS)
+
+def test_percentiles_use_nearest_rank():
+    stats = percentiles([i / 1000 for i in range(1, 101)])
+    assert (stats["n"], stats["p50"], stats["p95"], stats["p99"]) == (100, 51.0, 96.0, 100.0)
+
+def test_run_and_compare_against_itself(tmp_path):
+    config = {"files": 2, "lines": 30, "vocab": 40, "queries": 5, "load_runs": 1}
+    report = run(config, workdir=str(tmp_path), log=lambda msg: None)
+    assert set(report["latency"]["get_best_k_completions"]) == set(WORKLOADS)
+    assert report["build"]["sentences"] == 60
+    assert report["latency"]["candidates_by_query"]["no_hit"]["n"] == 5
+    assert compare(report, report) == ([], [])
+
+    again = run(config, workdir=str(tmp_path), log=lambda msg: None)
+    assert again["results"] == report["results"]
+
+    slower = dict(report, build=dict(report["build"], seconds=report["build"]["seconds"] + 10))
+    regressions, _ = compare(slower, report)
+    assert regressions and regressions[0].startswith("build.seconds")
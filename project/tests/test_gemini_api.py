@@ -0,0 +1,147 @@
+import asyncio
+
+from project.autocomplete import AutoCompleter, SUGGESTION_SOURCE
+from project.gemini_api import DiskLRU, FakeClient, SuggestionProvider, parse_suggestions
+from project.text_data import TextDatabase
+
+def _settle(provider):
+    """Wait until answered queries are cached and out of flight."""
+    import time
+    deadline = time.monotonic() + 5
+    while provider._inflight and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+def test_parse_suggestions_keeps_string_lists_only():
+    assert parse_suggestions('[["a b", " c ", 3], "x"]', 3, 1) == [["a b"], [], []]
+    assert parse_suggestions("not json", 2, 5) == [[], []]
+
+def test_disk_lru_evicts_least_recently_used(tmp_path):
+    cache = DiskLRU(str(tmp_path / "s.sqlite"), max_entries=2, touch_after=0)
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+    assert cache.get("a") == ["1"]
+    cache.put("c", ["3"])
+    assert cache.get("b") is None and cache.get("a") == ["1"] and len(cache) == 2
+    cache.close()
+
+def test_disk_lru_hits_write_only_stale_use_times(tmp_path):
+    cache = DiskLRU(str(tmp_path / "s.sqlite"), touch_after=60)
+    cache.put_many([("a", ["1"]), ("b", ["2"])])
+    changes = cache._db.total_changes
+    assert cache.get("a") == ["1"] and cache._db.total_changes == changes
+    cache._db.execute("UPDATE entries SET used = 0 WHERE key = 'a'")
+    changes = cache._db.total_changes
+    assert cache.get("a") == ["1"] and cache._db.total_changes == changes + 1
+    cache.close()
+
+def test_cache_is_used_off_the_event_loop(tmp_path):
+    import threading
+    provider = SuggestionProvider(FakeClient(), cache_path=str(tmp_path / "s.sqlite"))
+    provider._start()
+    threads = []
+    get, put_many = provider.cache.get, provider.cache.put_many
+    provider.cache.get = lambda *a: threads.append(threading.current_thread().name) or get(*a)
+    provider.cache.put_many = lambda *a: threads.append(threading.current_thread().name) or put_many(*a)
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    _settle(provider)
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    assert len(threads) == 3 and all(name.startswith("suggestion-cache") for name in threads)
+    assert provider.stats["cache_hits"] == 1 and not provider._inflight
+    provider.close()
+
+def test_concurrent_queries_are_batched_and_coalesced():
+    client = FakeClient(latency=0.01)
+    provider = SuggestionProvider(client, batch_window=0.02)
+
+    async def run():
+        return await asyncio.gather(provider.suggest("hello", 2), provider.suggest(" hello ", 2),
+                                    provider.suggest("world", 2))
+
+    a, b, c = asyncio.run(run())
+    assert a == b == ["hello suggestion 1", "hello suggestion 2"]
+    assert c == ["world suggestion 1", "world suggestion 2"]
+    assert client.calls == [["hello", "world"]]
+    assert provider.stats["coalesced"] == 1
+
+def test_calls_are_bounded_and_timed_out():
+    client = FakeClient(latency=0.05)
+    provider = SuggestionProvider(client, max_concurrency=2, batch_window=0, max_batch=1, timeout=1.0)
+
+    async def run():
+        return await asyncio.gather(*(provider.suggest(f"q{i}", 1) for i in range(6)))
+
+    assert all(r for r in asyncio.run(run()))
+    assert client.max_active == 2
+
+    slow = SuggestionProvider(FakeClient(latency=1.0), timeout=0.01)
+    assert slow.suggest_sync("hello") == []
+    assert slow.stats["errors"] == 1
+    slow.close()
+
+def test_answers_are_cached_on_disk(tmp_path):
+    path = str(tmp_path / "s.sqlite")
+    provider = SuggestionProvider(FakeClient(), cache_path=path)
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    _settle(provider)
+    provider.close()
+
+    client = FakeClient(fail=True)
+    provider = SuggestionProvider(client, cache_path=path)
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    assert provider.suggest_sync("other", 1) == []  # failures are not cached
+    assert client.calls == [["other"]] and len(provider.cache) == 1
+    provider.close()
+
+def test_cache_errors_count_as_misses(tmp_path):
+    provider = SuggestionProvider(FakeClient(), cache_path=str(tmp_path / "s.sqlite"))
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    _settle(provider)
+    provider.cache._db.close()  # every later get and put fails
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    assert provider.suggest_sync("other", 1) == ["other suggestion 1"]
+    _settle(provider)
+    assert provider.stats["cache_errors"] == 4 and not provider._inflight
+    provider.close()
+
+def test_unopenable_cache_is_left_out(tmp_path):
+    provider = SuggestionProvider(FakeClient(), cache_path=str(tmp_path / "missing" / "s.sqlite"))
+    assert provider.suggest_sync("hello", 1) == ["hello suggestion 1"]
+    assert provider.cache is None and provider.stats["cache_errors"] == 1
+    provider.close()
+
+def test_completer_asks_for_suggestions_only_when_short_of_k(tmp_path):
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_text("hello world\nhello there\n", encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    client = FakeClient()
+    ac = AutoCompleter(db, suggestions=SuggestionProvider(client))
+
+    assert len(ac.get_best_k_completions("hello", k=2)) == 2
+    assert client.calls == []
+
+    results = ac.get_best_k_completions("hello", k=3)
+    assert [r.source_text for r in results][:2] != [SUGGESTION_SOURCE] * 2
+    assert results[2].completed_sentence == "hello suggestion 1"
+    assert (results[2].source_text, results[2].score) == (SUGGESTION_SOURCE, 0)
+    assert client.calls == [["hello"]]
+    ac.suggestions.close()
+
+def test_budgeted_search_waits_for_suggestions_only_within_budget(tmp_path):
+    import time
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_text("hello world\nhello there\n", encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    ac = AutoCompleter(db, suggestions=SuggestionProvider(FakeClient(latency=1.0)))
+
+    start = time.perf_counter()
+    result = ac.search("hello", k=3, budget=0.1)
+    assert time.perf_counter() - start < 0.5
+    assert result.partial and len(result.results) == 2
+    assert ac.search("hello", k=3, budget=0).partial  # no budget left to ask
+    result = ac.search("hello", k=3, budget=2.0)
+    assert not result.partial and result.results[2].source_text == SUGGESTION_SOURCE
+    ac.suggestions.close()
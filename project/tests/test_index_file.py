@@ -0,0 +1,71 @@
+import pytest
+from project.index_file import IndexFile, SentenceTable, write_index
+
+ROWS = [
+    ("a.txt", 1, 0, "hello world"),
+    ("b.txt", 4, 37, "héllo there"),
+]
+GRAMS = {"hel": [0], "llo": [0, 1], "éll": [1]}
+CHARS = {"h": [0, 1], "w": [0], "é": [1]}
+
+def _table():
+    table = SentenceTable()
+    for fpath, line, offset, norm in ROWS:
+        table.append(table.add_file(fpath), line, offset, norm)
+    return table
+
+def _rows(table):
+    return [table.location(i) + (table.norm(i),) for i in range(len(table))]
+
+def test_index_round_trip(tmp_path):
+    path = str(tmp_path / "cache.idx")
+    write_index(path, _table(), GRAMS, CHARS, meta={"root": "Archive"})
+    index = IndexFile(path)
+    assert _rows(index.sentences) == ROWS
+    assert list(index.sentences.norm_lengths) == [11, 11]
+    assert {g: list(p) for g, p in index.grams.items()} == GRAMS
+    assert {ch: list(p) for ch, p in index.chars.items()} == CHARS
+    assert index.meta == {"root": "Archive"}
+
+def test_copy_from_mapped_table(tmp_path):
+    path = str(tmp_path / "cache.idx")
+    write_index(path, _table(), GRAMS, CHARS)
+    mapped = IndexFile(path).sentences
+    table = SentenceTable()
+    table.extend_sentences(mapped, [1])
+    table.extend_sentences(mapped, [0])
+    remap = [1, 0]
+    table.copy_locations(mapped, 1, 1, table.add_file("b.txt"), remap)
+    table.copy_locations(mapped, 0, 1, table.add_file("a.txt"), remap)
+    assert _rows(table) == [ROWS[1], ROWS[0]]
+
+def test_sentences_group_their_locations(tmp_path):
+    table = SentenceTable()
+    a, b = table.add_file("a.txt"), table.add_file("b.txt")
+    hello, there = table.add_sentence("hello"), table.add_sentence("there")
+    table.add_location(a, 1, 0, hello)
+    table.add_location(a, 2, 6, there)
+    table.add_location(b, 7, 40, hello)
+    path = str(tmp_path / "cache.idx")
+    write_index(path, table, {}, {})
+    mapped = IndexFile(path).sentences
+    assert len(mapped) == 2 and mapped.location_count == 3
+    assert [mapped.location_at(loc) for loc in mapped.locations_of(hello)] == [("a.txt", 1, 0), ("b.txt", 7, 40)]
+    assert list(mapped.locations_of(there)) == [1]
+
+def test_index_rejects_other_files(tmp_path):
+    path = tmp_path / "cache.idx"
+    path.write_bytes(b"not an index file at all")
+    with pytest.raises(ValueError):
+        IndexFile(str(path))
+
+def test_posting_lookup_misses(tmp_path):
+    path = str(tmp_path / "cache.idx")
+    write_index(path, _table(), GRAMS, CHARS)
+    index = IndexFile(path)
+    assert "llo" in index.grams and "éll" in index.grams
+    assert index.grams.get("xyz") is None
+    assert index.grams.get("hello") is None and index.grams.get("") is None
+    assert "a" not in index.chars and "hel" not in index.chars
+    with pytest.raises(KeyError):
+        index.grams["zzz"]
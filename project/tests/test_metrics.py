@@ -0,0 +1,52 @@
+import pytest
+from project.autocomplete import AutoCompleter
+from project.metrics import Histogram, QueryMetrics, QueryTrace
+from project.result_cache import ResultCache
+from project.text_data import TextDatabase
+
+@pytest.fixture
+def db(tmp_path):
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_text("hello world\nhelp the world\nzebra crossing\n", encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    return db
+
+def test_histogram_renders_cumulative_buckets():
+    h = Histogram("t_seconds", "Test.", (0.1, 1.0), "stage")
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v, "score")
+    text = "\n".join(h.render())
+    assert 't_seconds_bucket{stage="score",le="0.1"} 2' in text
+    assert 't_seconds_bucket{stage="score",le="1"} 3' in text
+    assert 't_seconds_bucket{stage="score",le="+Inf"} 4' in text
+    assert 't_seconds_count{stage="score"} 4' in text
+
+def test_trace_laps_add_up():
+    trace = QueryTrace("q")
+    trace.lap("a")
+    trace.lap("b")
+    trace.lap("a")
+    assert set(trace.stages) == {"a", "b"}
+    assert sum(trace.stages.values()) == pytest.approx(trace.total)
+
+def test_instrumented_queries_match_and_record_stages(db):
+    metrics = QueryMetrics(slow_query_seconds=0)
+    traced = AutoCompleter(db, cache=ResultCache(max_entries=0), metrics=metrics)
+    plain = AutoCompleter(db, cache=ResultCache(max_entries=0))
+    for q in ("hello wor", "helo", "zz"):
+        assert traced.get_best_k_completions(q) == plain.get_best_k_completions(q)
+    session = traced.session()
+    assert session.get_best_k_completions("hell") == plain.get_best_k_completions("hell")
+
+    assert metrics.queries == 4
+    assert metrics.fallbacks == 1
+    first = metrics.slow_queries[0]
+    assert first["query"] == "hello wor"
+    assert {"normalize", "postings", "rank", "score", "results", "cache"} <= set(first["stages_ms"])
+    assert first["counts"]["postings"] > 0 and first["counts"]["candidates"] > 0
+    assert "fallback" in metrics.slow_queries[2]["stages_ms"]
+    text = metrics.render()
+    assert "autocomplete_queries_total 4" in text
+    assert 'autocomplete_stage_seconds_count{stage="score"} 4' in text
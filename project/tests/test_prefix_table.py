@@ -0,0 +1,45 @@
+import random
+from collections import defaultdict
+from project.index_file import SentenceTable
+from project.prefix_table import TOP_K, PrefixTable, build_prefix_table, hot_prefixes
+from project.trigram import _trigram_set
+
+def _table(norms):
+    table = SentenceTable()
+    grams = defaultdict(list)
+    for i, norm in enumerate(norms):
+        table.append(0, i + 1, 0, norm)
+        for g in _trigram_set(norm):
+            grams[g].append(i)
+    return table, grams
+
+def _expected(norms, keys, q):
+    found = sorted((keys[i], i) for i, norm in enumerate(norms) if q in norm)
+    return [i for _, i in found[:TOP_K]] if len(found) >= TOP_K else None
+
+def test_short_queries_and_hot_prefixes_match_a_scan():
+    rng = random.Random(3)
+    words = ["ab", "abc", "bca", "cab", "hello", "help", "held"]
+    norms = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 4))) for _ in range(200)]
+    keys = [norm[::-1] for norm in norms]
+    table, grams = _table(norms)
+    entries = build_prefix_table(table, grams, keys, 2, hot=["hel", "help", "held ab", "zzz"])
+    queries = {norm[i:i + n] for norm in norms for n in (1, 2) for i in range(len(norm) - n + 1)}
+    for q in queries | {"hel", "help", "held ab", "zzz"}:
+        expected = _expected(norms, keys, q)
+        if q.strip() != q:
+            expected = None
+        assert entries.get(q) == expected, q
+    assert "abc" not in entries  # neither short nor hot
+
+def test_hot_prefixes_counts_every_prefix():
+    log = ["Hello world", "hello there", "help", "HELLO", "x"]
+    assert hot_prefixes(log, 2) == ["hel", "hell", "hello"]
+    assert hot_prefixes(log, 2, limit=1) == ["hel"]
+
+def test_prefix_table_lookup():
+    table = PrefixTable.from_entries({"b": list(range(10, 10 + TOP_K)), "a": list(range(TOP_K))})
+    assert table.keys() == ["a", "b"] and len(table) == 2 and "a" in table
+    assert list(table.get("b", 3)) == [10, 11, 12]
+    assert table.get("b", TOP_K + 1) is None
+    assert table.get("c", 1) is None
@@ -0,0 +1,99 @@
+import threading
+import time
+import pytest
+from project.result_cache import ResultCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def test_lru_eviction_and_counters():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["evictions"] == 1
+
+def test_memory_bound():
+    cache = ResultCache(max_bytes=10, sizeof=len)
+    cache.put("a", "xxxxxx")
+    cache.put("b", "yyyyyy")
+    assert cache.get("a") is None
+    assert cache.get("b") == "yyyyyy"
+    cache.put("c", "z" * 11)  # larger than the whole cache
+    assert cache.get("c") is None
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = ResultCache(ttl=5, clock=clock)
+    cache.put("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+def test_get_or_compute_coalesces_concurrent_misses():
+    cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("q", compute)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+    assert cache.get_or_compute("q", compute) == "value"
+    assert len(calls) == 1
+
+def test_get_or_compute_propagates_errors_without_caching():
+    cache = ResultCache()
+    def fail():
+        raise RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("q", fail)
+    assert cache.get_or_compute("q", lambda: 1) == 1
+
+def test_get_or_compute_stops_waiting_at_timeout():
+    cache = ResultCache()
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "slow"
+
+    leader = threading.Thread(target=cache.get_or_compute, args=("q", slow))
+    leader.start()
+    started.wait(5)
+    assert cache.get_or_compute("q", lambda: "own", timeout=0.01) == "own"
+    release.set()
+    leader.join()
+    assert cache.get("q") == "slow"
+
+def test_get_or_compute_caches_only_cacheable_values():
+    cache = ResultCache()
+    assert cache.get_or_compute("q", lambda: "partial", cacheable=lambda v: v != "partial") == "partial"
+    assert cache.get("q") is None
+    assert cache.get_or_compute("q", lambda: "done", cacheable=lambda v: v != "partial") == "done"
+    assert cache.get("q") == "done"
@@ -1,3 +1,4 @@
+import random
 import pytest
 from project.scoring import (
     _penalty_replace, _penalty_add_del,
@@ -117,4 +118,56 @@ def test_best_substring_no_match():
     assert _best_substring_score("xyz", "aaaaa") == 0
 
 def test_best_substring_empty_q():
-    assert _best_substring_score("", "anything") == 0
\ No newline at end of file
+    assert _best_substring_score("", "anything") == 0
+
+# ---------- Bit-parallel matcher vs. window scan ----------
+def _scan_score(q, s):
+    """Reference: the window-by-window scan over _match_one_* helpers."""
+    n = len(q)
+    if n == 0:
+        return 0
+    if q in s:
+        return 2 * n
+    best = 0
+    if len(s) >= n:
+        for start in _find_candidate_windows(s, n, q):
+            ok, score = _match_one_replace(q, s[start:start + n])
+            if ok and score > best:
+                best = score
+    if n >= 2 and len(s) >= n - 1:
+        for start in _find_candidate_windows(s, n - 1, q[:-1]):
+            ok, score = _match_one_add(q, s[start:start + n - 1])
+            if ok and score > best:
+                best = score
+    if len(s) >= n + 1:
+        for start in _find_candidate_windows(s, n + 1, q):
+            ok, score = _match_one_del(q, s[start:start + n + 1])
+            if ok and score > best:
+                best = score
+    return best
+
+@pytest.mark.parametrize("alphabet", ["ab", "abc", "ab cde"])
+def test_best_substring_matches_window_scan(alphabet):
+    rng = random.Random(alphabet)
+    for _ in range(3000):
+        q = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+        s = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 14)))
+        assert _best_substring_score(q, s) == _scan_score(q, s), (q, s)
+
+def test_best_substring_matches_window_scan_on_edits():
+    rng = random.Random(7)
+    words = "hello world this is a small test of the one edit matcher".split()
+    for _ in range(3000):
+        s = " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+        start = rng.randrange(len(s))
+        q = list(s[start:start + rng.randint(1, 12)])
+        pos = rng.randrange(len(q))
+        op = rng.choice("rid")
+        if op == "r":
+            q[pos] = rng.choice("xyz e")
+        elif op == "i":
+            q.insert(pos, rng.choice("xyz e"))
+        elif len(q) > 1:
+            del q[pos]
+        q = "".join(q)
+        assert _best_substring_score(q, s) == _scan_score(q, s), (q, s)
@@ -0,0 +1,87 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from project.autocomplete import AutoCompleter
+from project.models import AutoCompleteData
+from project.result_cache import ResultCache
+from project.sharding import ShardedCompleter, _merge_top_k, shard_index_path
+from project.text_data import TextDatabase
+
+QUERIES = ["hello world", "helo wrld", "the other", "word then", "hold", "xyz",
+           "wide hello there", "thre", "help wide", "h", "other then world"]
+
+@pytest.fixture
+def archive(tmp_path):
+    rng = random.Random(5)
+    words = ["hello", "help", "world", "word", "there", "the", "other", "then", "wide", "hold"]
+    root = tmp_path / "Archive"
+    for f in range(8):
+        lines = [" ".join(rng.choice(words) for _ in range(rng.randint(2, 6))) + f" {f}.{i}"
+                 for i in range(60)]
+        (root / f"d{f % 2}").mkdir(parents=True, exist_ok=True)
+        (root / f"d{f % 2}" / f"f{f}.txt").write_text("\n".join(lines), encoding="utf-8")
+    return root
+
+def _rows(results):
+    return [(r.completed_sentence, r.source_text, r.offset, r.score) for r in results]
+
+def test_sharded_results_match_unsharded(archive, tmp_path):
+    db = TextDatabase()
+    db.load(str(archive), index_path=str(tmp_path / "cache.idx"))
+    single = AutoCompleter(db, cap_per_query=10000, cache=ResultCache(max_entries=0))
+    with ShardedCompleter(str(archive), 3, index_path=str(tmp_path / "cache.idx"),
+                          cap_per_query=10000) as sharded:
+        assert len(sharded) == len(db)
+        assert all(size > 0 for size in sharded.sizes)
+        for k in (1, 5, 20):
+            expected = [_rows(single.get_best_k_completions(q, k=k)) for q in QUERIES]
+            assert [_rows(sharded.get_best_k_completions(q, k=k)) for q in QUERIES] == expected
+            assert [_rows(r) for r in sharded.get_best_k_completions_many(QUERIES, k=k)] == expected
+        # Several queries in flight on the same shards at once
+        expected = {q: _rows(single.get_best_k_completions(q, k=5)) for q in QUERIES}
+        sharded.cache = ResultCache(max_entries=0)
+        with ThreadPoolExecutor(8) as pool:
+            got = list(pool.map(lambda q: (q, _rows(sharded.get_best_k_completions(q, k=5))), QUERIES * 4))
+        assert all(rows == expected[q] for q, rows in got)
+    for i in range(3):
+        assert (tmp_path / f"cache.shard{i}of3.idx").exists()
+
+def test_capped_shards_choose_the_unsharded_candidates(archive, tmp_path):
+    db = TextDatabase()
+    db.load(str(archive), index_path=str(tmp_path / "cache.idx"))
+    queries = ["h", "he", "thn", "hello", "the other", "wide hold", "zzz"]
+    for cap in (3, 20, None):
+        single = AutoCompleter(db, cap_per_query=cap, cache=ResultCache(max_entries=0))
+        with ShardedCompleter(str(archive), 3, index_path=str(tmp_path / "cache.idx"),
+                              cap_per_query=cap) as sharded:
+            for k in (1, 5, 30):
+                expected = [_rows(single.get_best_k_completions(q, k=k)) for q in queries]
+                assert [_rows(sharded.get_best_k_completions(q, k=k)) for q in queries] == expected
+                assert [_rows(r) for r in sharded.get_best_k_completions_many(queries, k=k)] == expected
+
+def test_repeated_lines_across_shards_keep_file_order(tmp_path):
+    root = tmp_path / "Archive"
+    root.mkdir()
+    for f in range(6):
+        (root / f"f{f}.txt").write_text("Hello there\nhello there\nhello world\n", encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    single = AutoCompleter(db, cap_per_query=1, cache=ResultCache(max_entries=0))
+    with ShardedCompleter(str(root), 3, index_path=str(tmp_path / "cache.idx"), cap_per_query=1) as sharded:
+        for k in (1, 4, 12):
+            assert _rows(sharded.get_best_k_completions("hello", k=k)) == _rows(single.get_best_k_completions("hello", k=k))
+
+def test_shards_split_files_disjointly(archive, tmp_path):
+    files = []
+    for i in range(3):
+        db = TextDatabase()
+        db.load(str(archive), index_path=shard_index_path(str(tmp_path / "cache.idx"), i, 3), shard=(i, 3))
+        files.extend(db.sentences.files)
+    assert sorted(files) == sorted(str(p) for p in archive.rglob("*.txt"))
+
+def test_merge_top_k_keeps_result_order():
+    positions = {"x": 0, "y": 1}
+    a = [AutoCompleteData("b", "y", 1, 10), AutoCompleteData("a", "y", 2, 8)]
+    b = [AutoCompleteData("B", "x", 3, 10), AutoCompleteData("c", "x", 2, 9)]
+    assert [(r.completed_sentence, r.source_text) for r in _merge_top_k([a, b], 3, positions)] == \
+        [("B", "x"), ("b", "y"), ("c", "x")]
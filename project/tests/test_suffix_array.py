@@ -0,0 +1,44 @@
+import random
+from project.index_file import SentenceTable
+from project.suffix_array import SuffixArray, build_suffix_array
+
+NORMS = ["hello world", "world of hello", "héllo wörld", "lo", "hello", "ab ab ab"]
+
+def _suffix_array():
+    table = SentenceTable()
+    for norm in NORMS:
+        table.append(0, 1, 0, norm)
+    suffixes = build_suffix_array(table.norm_text, table.norm_offsets)
+    return SuffixArray(suffixes, table.norm_text, table.norm_offsets), table
+
+def test_suffixes_are_sorted_within_sentences():
+    sa, table = _suffix_array()
+    text = bytes(table.norm_text)
+    starts = {table.norm_offsets[i] + len(norm[:j].encode("utf-8"))
+              for i, norm in enumerate(NORMS) for j in range(len(norm))}
+    assert sorted(sa.suffixes) == sorted(starts)
+    keys = [sa._prefix(p, len(text)) for p in sa.suffixes]
+    assert keys == sorted(keys)
+
+def test_sentences_match_substring_search():
+    sa, _ = _suffix_array()
+    for q in ["hello", "lo", "world", "o w", "éllo", "ö", "ab ab", "lohe", "lo w", "x", "hello world of"]:
+        assert sa.sentences(q, 1000) == [i for i, norm in enumerate(NORMS) if q in norm], q
+
+def test_sentences_gives_up_above_limit():
+    sa, _ = _suffix_array()
+    assert sa.find("ab")[1] - sa.find("ab")[0] == 3
+    assert sa.sentences("ab", 2) is None
+    assert sa.sentences("ab", 3) == [5]
+
+def test_matches_sorting_whole_suffixes():
+    rng = random.Random(3)
+    for _ in range(200):
+        table = SentenceTable()
+        alphabet = rng.choice(["ab", "ab c", "aé ö", "a"])
+        for _ in range(rng.randint(1, 8)):
+            table.append(0, 1, 0, "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 60))))
+        text, bounds = bytes(table.norm_text), table.norm_offsets
+        starts = [(text[p:bounds[s + 1]], p) for s in range(len(table))
+                  for p in range(bounds[s], bounds[s + 1]) if text[p] & 0xC0 != 0x80]
+        assert list(build_suffix_array(table.norm_text, bounds)) == [p for _, p in sorted(starts)]
@@ -0,0 +1,294 @@
+import os
+import pytest
+from project.text_data import TextDatabase
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+def _rows(db):
+    return [db.location(i) + (db.norm(i),) for i in range(len(db))]
+
+def _snapshot(db):
+    """Map every gram to the sorted (file, line) locations it indexes."""
+    return {
+        g: sorted(db.location(i) for i in postings)
+        for g, postings in db._gram_index.items()
+    }
+
+def _load(root, index_path):
+    db = TextDatabase()
+    db.load(str(root), index_path=str(index_path))
+    return db
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / "Archive"
+    _write(root / "a.txt", "Hello World\nThe quick brown fox\n")
+    _write(root / "sub" / "b.txt", "hello there\n")
+    return root
+
+def test_load_builds_and_reopens_index(archive, tmp_path):
+    index_path = tmp_path / "cache.idx"
+    first = _load(archive, index_path)
+    assert len(first) == 3
+    second = _load(archive, index_path)
+    assert _rows(second) == _rows(first)
+    assert second.candidates_by_query("hello")
+
+def test_incremental_load_matches_full_rebuild(archive, tmp_path):
+    index_path = tmp_path / "cache.idx"
+    _load(archive, index_path)
+
+    _write(archive / "sub" / "b.txt", "hello there\nhello again\n")
+    _write(archive / "c.txt", "a new hello file\n")
+    os.remove(archive / "a.txt")
+    updated = _load(archive, index_path)
+
+    fresh = _load(archive, tmp_path / "fresh.idx")
+    assert _rows(updated) == _rows(fresh)
+    assert _snapshot(updated) == _snapshot(fresh)
+
+def test_incremental_load_keeps_walk_order(archive, tmp_path, capsys):
+    index_path = tmp_path / "cache.idx"
+    _write(archive / "c.txt", "hello world\nanother line\n")
+    db = _load(archive, index_path)
+    with open(db._files[0][0], "a", encoding="utf-8") as f:  # first file walked
+        f.write("hello again\nanother line\n")
+    updated = _load(archive, index_path)
+    fresh = _load(archive, tmp_path / "fresh.idx")
+    assert _rows(updated) == _rows(fresh)
+    assert [updated.locations(i) for i in range(len(updated))] == [fresh.locations(i) for i in range(len(fresh))]
+    assert {g: list(p) for g, p in updated._gram_index.items()} == {g: list(p) for g, p in fresh._gram_index.items()}
+    assert updated._index.meta == fresh._index.meta
+    capsys.readouterr()
+    _load(archive, index_path)
+    assert "Loaded database from index cache" in capsys.readouterr().out
+
+def test_index_from_other_root_is_rebuilt(archive, tmp_path):
+    index_path = tmp_path / "cache.idx"
+    _load(archive, index_path)
+    other = tmp_path / "Other"
+    _write(other / "x.txt", "completely different\n")
+    db = _load(other, index_path)
+    assert db.originals(range(len(db))) == ["completely different"]
+
+def test_parallel_load_matches_serial(archive, tmp_path):
+    for i in range(6):
+        _write(archive / "more" / f"f{i}.txt", f"line {i} hello\nother {i} words\n")
+    serial = _load(archive, tmp_path / "serial.idx")
+    db = TextDatabase()
+    db.load(str(archive), index_path=str(tmp_path / "parallel.idx"), workers=3)
+    assert _rows(db) == _rows(serial)
+    assert _snapshot(db) == _snapshot(serial)
+
+def test_rank_candidates_matches_full_sort():
+    db = TextDatabase()
+    db._norm_len = [5, 3, 3, 9, 1, 4, 3, 2]
+    counts = {0: 2, 1: 1, 2: 2, 3: 3, 4: 1, 5: 2, 6: 1, 7: 1}
+    expected = [idx for idx, _ in sorted(counts.items(), key=lambda kv: (-kv[1], db._norm_len[kv[0]]))]
+    for cap in range(1, len(counts) + 2):
+        assert db.rank_candidates(counts, cap) == expected[:cap]
+
+def test_fallback_without_trigram_hits_matches_scan(archive, tmp_path):
+    db = _load(archive, tmp_path / "cache.idx")
+    q = "qxz"
+    expected = [i for i in range(len(db)) if q[0] in db.norm(i)]
+    assert expected
+    assert db.candidates_by_query(q) == expected
+    assert db.candidates_by_query(q, cap=1) == expected[:1]
+
+def test_originals_are_read_from_source(tmp_path):
+    root = tmp_path / "Archive"
+    _write(root / "a.txt", "  First, Line!\n\n\u00e9t\u00e9 Two\r\n...\nlast")
+    db = _load(root, tmp_path / "cache.idx")
+    assert [db.location(i) for i in range(len(db))] == [
+        (str(root / "a.txt"), 1), (str(root / "a.txt"), 3), (str(root / "a.txt"), 5)]
+    assert db.originals([2, 0, 1]) == ["last", "First, Line!", "\u00e9t\u00e9 Two"]
+    assert db.norm(0) == "first line"
+
+def test_lone_carriage_returns_end_lines(tmp_path):
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_bytes(b"First line\rSecond, line\r\rFourth\r\nfifth")
+    db = _load(root, tmp_path / "cache.idx")
+    with open(root / "a.txt", encoding="utf-8") as f:  # text mode, as the archive used to be read
+        expected = [(i, line.strip()) for i, line in enumerate(f, start=1) if line.strip()]
+    assert [(db.location(i)[1], db.original(i)) for i in range(len(db))] == expected
+    assert db.norm(1) == "second line"
+
+def test_edited_source_lines_fall_back_to_normalized(tmp_path):
+    root = tmp_path / "Archive"
+    _write(root / "a.txt", "Hello World!\nsecond line\n")
+    db = _load(root, tmp_path / "cache.idx")
+    _write(root / "a.txt", "LINE!!\nHello World!\nsecond line\n")  # edited, not reloaded
+    assert db.originals([0, 1]) == ["hello world", "second line"]
+    assert db.occurrences([0], 1) == [[(str(root / "a.txt"), 1, "hello world")]]
+
+def _reference_index_file(fpath):
+    """Line-by-line indexing, as done before chunked ingestion, with text mode's line breaks."""
+    import re
+    from project.trigram import _normalize, _trigrams
+    rows, grams = [], {}
+    offset = 0
+    with open(fpath, 'rb') as f:
+        data = f.read()
+        for i, raw in enumerate(re.findall(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$', data), start=1):
+            start, offset = offset, offset + len(raw)
+            norm = _normalize(raw.decode('utf-8', errors='ignore').strip())
+            if norm:
+                for g in set(_trigrams(norm)):
+                    grams.setdefault(g, []).append(len(rows))
+                rows.append((i, start, norm))
+    return rows, grams
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 1 << 20])
+def test_chunked_indexing_matches_line_by_line(tmp_path, monkeypatch, chunk_size):
+    from project import text_data
+    monkeypatch.setattr(text_data, "_CHUNK_SIZE", chunk_size)
+    path = tmp_path / "mixed.txt"
+    path.write_bytes(
+        "﻿First line, with punctuation!\r\n\r\n   \n".encode("utf-8")
+        + b"bad \xff\xfe bytes \xe2\x82\n"
+        + "ΟΔΟΣ İstanbul next\x1cpart\n...\n".encode("utf-8")
+        + b"x" * 100 + b"\n"
+        + b"old\rmac\r\rline breaks\r\n\rand one more\r"
+        + "no trailing newline ÄÖ".encode("utf-8"))
+    table, grams, chars = text_data._index_file(str(path))
+    rows, expected_grams = _reference_index_file(str(path))
+    assert [(table.lines[i], table.offsets[i], table.norm(i)) for i in range(len(table))] == rows
+    assert list(table.norm_lengths) == [len(norm) for _, _, norm in rows]
+    assert dict(grams) == expected_grams
+    assert dict(chars) == {ch: [i for i, (_, _, norm) in enumerate(rows) if ch in norm]
+                           for ch in {ch for _, _, norm in rows for ch in norm}}
+
+def test_suffix_array_is_built_and_reused(archive, tmp_path):
+    index_path = tmp_path / "cache.idx"
+    plain = _load(archive, index_path)
+    assert plain.exact_candidates("hello") is None
+    db = TextDatabase()
+    db.load(str(archive), index_path=str(index_path), suffix_array=True)
+    assert db.exact_candidates("hello") == [i for i in range(len(db)) if "hello" in db.norm(i)]
+    assert db.exact_candidates("hello", cap=1) == [0]  # same length: index order
+    assert db.exact_candidates("nothing here") == []
+    again = TextDatabase()
+    again.load(str(archive), index_path=str(index_path))
+    assert again.exact_candidates("quick brown") == [1]
+
+def test_suffix_array_is_skipped_above_size_limit(archive, tmp_path, monkeypatch, capsys):
+    from project import text_data
+    monkeypatch.setattr(text_data, "SUFFIX_ARRAY_MAX_BYTES", 10)
+    index_path = tmp_path / "cache.idx"
+    db = TextDatabase()
+    db.load(str(archive), index_path=str(index_path), suffix_array=True)
+    assert db.exact_candidates("hello") is None
+    assert "Not building a suffix array" in capsys.readouterr().out
+    db.load(str(archive), index_path=str(index_path), suffix_array=True)
+    assert "Loaded database from index cache" in capsys.readouterr().out
+
+def test_refreshed_builds_a_new_generation(archive, tmp_path):
+    db = _load(archive, tmp_path / "cache.idx")
+    assert db.refreshed() is None
+    with open(archive / "a.txt", "a", encoding="utf-8") as f:
+        f.write("an appended line\n")
+    _write(archive / "new" / "c.txt", "brand new file\n")
+    rows = _rows(db)
+    fresh = db.refreshed()
+    assert fresh is not None and fresh is not db
+    assert _rows(db) == rows  # the old generation is untouched
+    assert fresh.generation != db.generation and fresh.version != db.version
+    assert _load(archive, tmp_path / "other.idx").version == fresh.version
+    assert sorted(norm for _, _, norm in _rows(fresh)) == [
+        "an appended line", "brand new file", "hello there", "hello world", "the quick brown fox"]
+    assert fresh.refreshed() is None
+
+def test_version_is_computed_once_per_load(archive, tmp_path):
+    from unittest.mock import patch
+    db = _load(archive, tmp_path / "cache.idx")
+    version = db.version
+    with patch("project.text_data.hashlib.sha1") as sha1:
+        assert db.version == version
+    sha1.assert_not_called()
+
+def test_concurrent_refreshes_rebuild_the_index_once(archive, tmp_path, capsys, monkeypatch):
+    import threading
+    import time
+    from project import text_data
+    dbs = [_load(archive, tmp_path / "cache.idx") for _ in range(3)]
+    write_index = text_data.write_index
+
+    def slow_write(*args, **kwargs):
+        time.sleep(0.1)  # let the other refreshes catch up
+        return write_index(*args, **kwargs)
+
+    monkeypatch.setattr(text_data, "write_index", slow_write)
+    _write(archive / "new" / "c.txt", "brand new file\n")
+    capsys.readouterr()
+    fresh = [None] * len(dbs)
+
+    def refresh(i):
+        fresh[i] = dbs[i].refreshed()
+
+    threads = [threading.Thread(target=refresh, args=(i,)) for i in range(len(dbs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    out = capsys.readouterr().out
+    assert out.count("Saved database index cache") == 1
+    assert out.count("Loaded database from index cache") == len(dbs) - 1
+    assert len({db.version for db in fresh}) == 1
+    assert all(_rows(db) == _rows(fresh[0]) for db in fresh)
+
+def test_prefix_table_is_built_and_reused(tmp_path):
+    root = tmp_path / "Archive"
+    _write(root / "a.txt", "".join(f"hello {i}\n" for i in range(12)) + "help me\n")
+    log = tmp_path / "queries.txt"
+    log.write_text("hello 1\nhello 1\n", encoding="utf-8")
+    index_path = tmp_path / "cache.idx"
+    db = TextDatabase()
+    db.load(str(root), index_path=str(index_path), prefix_table=2, query_log=str(log))
+    assert list(db.prefix_candidates("he", 5)) == [0, 1, 10, 11, 2]  # in result order
+    assert list(db.prefix_candidates("hello", 3)) == [0, 1, 10]  # hot prefix
+    assert db.prefix_candidates("hello 1", 1) is None  # fewer than TOP_K sentences
+    again = TextDatabase()
+    again.load(str(root), index_path=str(index_path), prefix_table=2, query_log=str(log))
+    assert again._index is not None and again._index.meta == db._index.meta
+    assert list(again.prefix_candidates("l", 2)) == [0, 1]
+    assert _load(root, tmp_path / "plain.idx").prefix_candidates("he", 5) is None
+    other = TextDatabase()
+    other.load(str(root), index_path=str(index_path), prefix_table=1)
+    assert other.prefix_candidates("he", 5) is None and other.prefix_candidates("h", 5) is not None
+    off = TextDatabase()
+    off.load(str(root), index_path=str(index_path))  # the stored table is not used
+    assert off._index is not None and off._index.prefixes is not None
+    assert off.prefix_candidates("h", 5) is None
+
+def test_repeated_lines_are_stored_once(tmp_path):
+    root = tmp_path / "Archive"
+    _write(root / "a.txt", "Copyright ACME\nfirst\ncopyright, acme!\n")
+    _write(root / "b.txt", "COPYRIGHT ACME\nsecond\n")
+    index_path = tmp_path / "cache.idx"
+    db = _load(root, index_path)
+    assert len(db) == 3 and db.sentences.location_count == 5
+    copyright = db.candidates_by_query("copyright acme")
+    assert len(copyright) == 1
+    (idx,) = copyright
+    assert sorted(db.locations(idx)) == [(str(root / "a.txt"), 1), (str(root / "a.txt"), 3), (str(root / "b.txt"), 1)]
+    assert sorted(row[2] for row in db.occurrences([idx], 3)[0]) == ["COPYRIGHT ACME", "Copyright ACME", "copyright, acme!"]
+    assert all(len(postings) == 1 for postings in db._gram_index.values() if "acme" in db.norm(postings[0]))
+
+    (root / "a.txt").unlink()
+    _write(root / "c.txt", "copyright acme\nsecond\n")
+    fresh = db.refreshed()
+    assert len(fresh) == 2 and fresh.sentences.location_count == 4
+    assert sorted(fresh.locations(fresh.candidates_by_query("second")[0])) == [
+        (str(root / "b.txt"), 2), (str(root / "c.txt"), 2)]
+    full = _load(root, tmp_path / "full.idx")
+    assert _snapshot(fresh) == _snapshot(full)
+
+def test_find_sentence_and_archive_files(archive, tmp_path):
+    db = _load(archive, tmp_path / "cache.idx")
+    assert TextDatabase.archive_files(str(archive)) == db.sentences.files
+    assert [db.find_sentence(db.norm(i)) for i in range(len(db))] == list(range(len(db)))
+    assert db.find_sentence("hello") is None and db.find_sentence("zz") is None
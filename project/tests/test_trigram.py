@@ -22,3 +22,37 @@ def test_trigram_long_input():
 def test_trigram_long_input_two():
     result = list(_trigrams("this is"))
     assert result==["thi", "his", "is ", "s i", " is"]
+
+def _reference_normalize(s):
+    import re
+    from project.trigram import _PUNC_SET
+    s = ''.join((ch.lower() if ch not in _PUNC_SET else ' ') for ch in s)
+    return re.sub(r'\s+', ' ', s).strip()
+
+def test_normalize_matches_reference_on_every_code_point():
+    for start in range(0, 0x110000, 4096):
+        s = 'x'.join(chr(c) for c in range(start, min(start + 4096, 0x110000)))
+        assert _normalize(s) == _reference_normalize(s), hex(start)
+
+def test_normalize_context_cases():
+    for s in ["ΟΔΟΣ Σ", "İstanbul", " a b\x1c\x1fc　", "ﬁ ẞ Ǆ", "", "  !!  ", "A\tB\r\n"]:
+        assert _normalize(s) == _reference_normalize(s)
+
+def test_normalize_lines_matches_normalize():
+    from project.trigram import _normalize_lines
+    lines = ["Hello, World!", "", "  ΟΔΟΣ\r", "a b", "x\x0by"]
+    assert _normalize_lines("\n".join(lines)) == [_normalize(l) for l in lines]
+
+def test_trigram_set_matches_trigrams():
+    from project.trigram import _trigram_set
+    for s in ["", "a", "ab", "abc", "hello hello"]:
+        assert _trigram_set(s) == set(_trigrams(s))
+
+def test_pack_gram_round_trip_and_order():
+    from project.trigram import _pack_gram, _unpack_gram
+    grams = ["a", "ab", "abc", "b", " a", "\x00", "\U0010ffff\U0010ffff\U0010ffff", "é", "zz"]
+    assert [_unpack_gram(_pack_gram(g)) for g in grams] == grams
+    assert sorted(grams, key=_pack_gram) == sorted(grams)
+    assert _pack_gram("\U0010ffff" * 3) < 2 ** 63
+    with pytest.raises(ValueError):
+        _pack_gram("abcd")
@@ -0,0 +1,24 @@
+from project.autocomplete import AutoCompleter
+from project.text_data import TextDatabase
+from project.watcher import ArchiveWatcher
+
+def test_watcher_switches_to_new_files(tmp_path):
+    root = tmp_path / "Archive"
+    root.mkdir()
+    (root / "a.txt").write_text("hello world\n", encoding="utf-8")
+    db = TextDatabase()
+    db.load(str(root), index_path=str(tmp_path / "cache.idx"))
+    ac = AutoCompleter(db)
+    watcher = ArchiveWatcher(ac)
+    assert [r.completed_sentence for r in ac.get_best_k_completions("hello")] == ["hello world"]
+    assert not watcher.check()
+
+    session = ac.session()
+    session.get_best_k_completions("hello")
+    (root / "b.txt").write_text("hello again\n", encoding="utf-8")
+    assert watcher.check()
+    assert ac.db is not db and len(db) == 1  # queries still running on db are unaffected
+    expected = ["hello again", "hello world"]
+    assert [r.completed_sentence for r in ac.get_best_k_completions("hello")] == expected
+    assert [r.completed_sentence for r in session.get_best_k_completions("hello")] == expected
+    assert watcher.updates == 1
@@ -1,136 +1,949 @@
-from typing import List, Tuple, Dict
-from collections import defaultdict
+from typing import List, Tuple, Dict, Iterable, Iterator, Mapping, Optional, Sequence
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from array import array
+from itertools import accumulate, chain
+import hashlib
+import heapq
+import itertools
 import os
-import pickle
-from trigram import _normalize, _trigrams
+import re
+import zlib
+from index_file import IndexFile, SentenceTable, write_index
+from metrics import Deadline, QueryTrace
+from prefix_table import PrefixTable, build_prefix_table, hot_prefixes
+from suffix_array import SuffixArray, build_suffix_array
+from trigram import _min_shared_trigrams, _normalize, _normalize_lines, _trigram_set, _trigrams
+
+Partial = Tuple[SentenceTable, Dict[str, List[int]], Dict[str, List[int]]]
+
+_CHUNK_SIZE = 1 << 20  # bytes read at a time while indexing a file
+
+# Line breaks, as Python's text mode reads them: '\n', '\r\n' and a lone '\r'
+_LINE_BREAK = re.compile(rb'(\r\n|\r|\n)')
+_LINE_READ = 4096  # bytes read at a time while reading one line back
+
+# Exact queries occurring more often than this are answered from the trigram index
+EXACT_SCAN_LIMIT = 50000
+
+# Most bytes of normalized text a suffix array is built for; building takes
+# about 2 s and 20 bytes of memory per byte of text, on every index build
+SUFFIX_ARRAY_MAX_BYTES = 64 << 20
+
+# Generations are unique across databases, so a completer switching to a
+# newer database never mistakes its cached results for the new ones
+_generations = itertools.count(1)
+
+def _read_chunks(f, size: int = _CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Read a binary file in chunks of about `size` bytes that end at a line break
+    (except possibly the last one), so no line is split across chunks.
+    A chunk never ends between the '\r' and '\n' of one line break.
+    """
+    rest = b''
+    while True:
+        block = f.read(size)
+        if not block:
+            if rest:
+                yield rest
+            return
+        if rest:
+            block = rest + block
+        # A '\r' ending the block may be the first half of '\r\n'
+        cut = max(block.rfind(b'\n'), block.rfind(b'\r', 0, len(block) - 1)) + 1
+        if cut == 0:
+            rest = block
+            continue
+        yield block[:cut]
+        rest = block[cut:]
+
+def _read_line(f) -> bytes:
+    """
+    Read the line at the current position of a binary file, up to the first
+    '\n' or '\r', so a lone '\r' ends it as it does when indexing.
+    """
+    parts = []
+    while True:
+        part = f.readline(_LINE_READ)
+        cr = part.find(b'\r')
+        if cr >= 0:
+            parts.append(part[:cr])
+            break
+        parts.append(part)
+        if len(part) < _LINE_READ or part.endswith(b'\n'):
+            break
+    return b''.join(parts)
+
+def _index_file(fpath: str) -> Partial:
+    """
+    Read, normalize and index a single file by trigrams and by characters.
+
+    The file is read in large chunks; each chunk is decoded and normalized as a
+    whole with `_normalize_lines`, which gives the same text as decoding and
+    normalizing every line on its own. Byte offsets come from the raw lines.
+    Lines end at '\n', '\r\n' or a lone '\r', as in text mode.
+    Runs in worker processes during a parallel build, so it only depends on its argument.
+
+    Args:
+        fpath (str): Path of the .txt file.
+
+    Returns:
+        Partial: The file's sentences (file id 0), and the gram and character
+            indexes over their local (0-based) ids.
+    """
+    lines = array('I')
+    offsets = array('Q')
+    norms: List[str] = []
+    grams: Dict[str, List[int]] = defaultdict(list)
+    chars: Dict[str, List[int]] = defaultdict(list)
+    line_no = 0
+    offset = 0
+    with open(fpath, 'rb') as f:
+        for chunk in _read_chunks(f, _CHUNK_SIZE):
+            if b'\r' in chunk:
+                pieces = _LINE_BREAK.split(chunk)
+                raws, widths = pieces[0::2], iter(list(map(len, pieces[1::2])))
+                chunk = b'\n'.join(raws)
+            else:
+                raws, widths = chunk.split(b'\n'), itertools.repeat(1)
+            texts = _normalize_lines(chunk.decode('utf-8', errors='ignore'))
+            if chunk.endswith(b'\n'):  # drop the empty piece after the last line break
+                raws.pop()
+                texts.pop()
+            for raw, norm in zip(raws, texts):
+                line_no += 1
+                start = offset
+                offset += len(raw) + next(widths, 0)
+                if not norm:  # Ignore empty lines
+                    continue
+                idx = len(norms)
+                lines.append(line_no)
+                offsets.append(start)
+                norms.append(norm)
+                for g in _trigram_set(norm):
+                    grams[g].append(idx)
+                for ch in set(norm):
+                    chars[ch].append(idx)
+    encoded = [norm.encode('utf-8') for norm in norms]
+    table = SentenceTable(
+        [fpath], array('I', [0]) * len(norms), lines, offsets,
+        array('Q', accumulate(map(len, encoded), initial=0)), bytearray(b''.join(encoded)),
+        array('I', map(len, norms)), array('I', range(len(norms))),
+        array('Q', range(len(norms) + 1)), array('I', range(len(norms))),
+    )
+    return table, grams, chars
+
+
+def _version(files: List[Tuple[str, int, int]], options: Optional[Tuple]) -> str:
+    """
+    Short hash of file fingerprints and index options; see `TextDatabase.version`.
+    """
+    return hashlib.sha1(repr((files, options)).encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def _index_lock(index_path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on `<index_path>.lock` for the duration of the block.
+    Without fcntl (Windows) or a writable lock file, nothing is locked.
+    """
+    try:
+        import fcntl
+        f = open(f"{index_path}.lock", "a")
+    except (ImportError, OSError):
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _shard_of(relpath: str, shards: int) -> int:
+    """
+    Shard a file belongs to, from a stable hash of its path relative to the archive root.
+    Adding or removing files never moves other files to a different shard.
+    """
+    return zlib.crc32(relpath.replace(os.sep, '/').encode('utf-8')) % shards
+
 
 class TextDatabase:
     """
     Manages loading and indexing of text data from .txt files in a folder tree.
     Each line in the files is treated as a sentence, stored with metadata,
     and indexed by character trigrams for efficient candidate retrieval.
+    Lines with the same normalized text are one sentence with several
+    locations, so repeated lines are indexed and scored once.
+    Only the normalized text and the locations of each sentence are kept;
+    original lines are read back from the source files when needed.
     """
 
     def __init__(self) -> None:
-        self.items: List[Tuple[str, str, int, str]] = []
-        self._gram_index: Dict[str, List[int]] = defaultdict(list)
+        self.sentences = SentenceTable()
+        self._gram_index: Mapping[str, Sequence[int]] = {}
+        self._char_index: Mapping[str, Sequence[int]] = {}
+        self._norm_len: Sequence[int] = array('I')
+        self._index: Optional[IndexFile] = None
+        self._suffixes: Optional[SuffixArray] = None
+        self._prefixes: Optional[PrefixTable] = None
         self._loaded = False
+        self._source: Optional[Tuple] = None  # load() arguments, for refreshed()
+        self._files: List[Tuple[str, int, int]] = []  # fingerprints of the loaded files
+        self._version = _version(self._files, None)
+        self.generation = 0  # new on every load, so caches can tell indexes apart
+
+    @property
+    def version(self) -> str:
+        """
+        Identifier of the loaded files and index options. Unlike `generation`,
+        it is the same for databases loaded from the same files in any process,
+        so it can tag responses served by several worker processes.
+        Computed once per load.
+        """
+        return self._version
+
+    def _freeze_index(self, gram_index: Dict[str, List[int]], char_index: Dict[str, List[int]]) -> None:
+        """
+        Convert the gram and character indexes built from Python lists into compact posting lists.
+
+        Each posting list becomes an array of unsigned 32-bit item indices,
+        which costs 4 bytes per posting instead of a pointer to a boxed int.
+        Postings are appended in item order while loading, so they are already sorted.
+
+        Args:
+            gram_index (Dict[str, List[int]]): Trigram -> ascending list of item indices.
+            char_index (Dict[str, List[int]]): Character -> ascending list of item indices.
+        """
+        self._gram_index = {g: array('I', postings) for g, postings in gram_index.items()}
+        self._char_index = {ch: array('I', postings) for ch, postings in char_index.items()}
+        self._norm_len = self.sentences.norm_lengths
+
+    def _open_index(self, index_path: str) -> Optional[IndexFile]:
+        """
+        Try to open a memory-mapped index file.
+        Returns the opened index if successful, None otherwise.
+        """
+        if not os.path.exists(index_path):
+            return None
+        try:
+            return IndexFile(index_path)
+        except Exception as e:
+            print(f"[WARN] Failed to open index cache '{index_path}': {e}")
+            return None
 
+    def _use_index(self, index: IndexFile, prefixes: bool = True) -> None:
+        """
+        Serve sentences and posting lists from an opened index file, and its
+        prefix table unless `prefixes` is False.
+        """
+        self._index = index
+        self.generation = next(_generations)
+        self.sentences = index.sentences
+        self._gram_index = index.grams
+        self._char_index = index.chars
+        self._norm_len = index.sentences.norm_lengths
+        self._suffixes = self._suffix_array(index.suffixes)
+        self._prefixes = PrefixTable(*index.prefixes) if prefixes and index.prefixes is not None else None
+        self._loaded = True
+
+    def _suffix_array(self, suffixes: Optional[Sequence[int]]) -> Optional[SuffixArray]:
+        """
+        Wrap a suffix array over the current sentences, or return None without one.
+        """
+        if suffixes is None:
+            return None
+        return SuffixArray(suffixes, self.sentences.norm_text, self.sentences.norm_offsets)
 
-    def _load_pickle(self, pickle_path: str) -> bool:
+    def _save_index(self, index_path: str, gram_index: Dict[str, List[int]],
+                    char_index: Dict[str, List[int]], meta: Dict,
+                    suffixes: Optional[Sequence[int]] = None,
+                    prefixes: Optional[PrefixTable] = None) -> bool:
         """
-        Try to load the database from a pickle file.
+        Save the database to a binary index file.
         Returns True if successful, False otherwise.
         """
-        if not os.path.exists(pickle_path):
-            return False
         try:
-            with open(pickle_path, "rb") as f:
-                data = pickle.load(f)
-            self.items = data["items"]
-            self._gram_index = data["gram_index"]
-            self._loaded = True
-            print(f"Loaded database from pickle cache: {pickle_path}")
+            write_index(index_path, self.sentences, gram_index, char_index, meta, suffixes,
+                        (prefixes.keys(), prefixes.rows()) if prefixes is not None else None)
+            print(f"Saved database index cache: {index_path}")
             return True
-        except (pickle.UnpicklingError, EOFError, KeyError, Exception) as e:
-            print(f"[WARN] Failed to load pickle cache '{pickle_path}': {e}")
+        except Exception as e:
+            print(f"[WARN] Failed to save index cache '{index_path}': {e}")
             return False
 
-    def _save_pickle(self, pickle_path: str) -> None:
+    @staticmethod
+    def _scan(root_folder: str) -> List[Tuple[str, int, int]]:
         """
-        Save the database to a pickle file.
+        Fingerprint every .txt file under the root folder.
+
+        Returns:
+            List[Tuple[str, int, int]]: (file path, size in bytes, mtime in ns) in walk order.
         """
-        try:
-            with open(pickle_path, "wb") as f:
-                pickle.dump({
-                    "items": self.items,
-                    "gram_index": self._gram_index
-                }, f)
-            print(f"Saved database pickle cache: {pickle_path}")
-        except Exception as e:
-            print(f"[WARN] Failed to save pickle cache '{pickle_path}': {e}")
+        files = []
+        for dirpath, _, filenames in os.walk(root_folder):
+            for fn in filenames:
+                if not fn.lower().endswith('.txt'):
+                    continue
+                fpath = os.path.join(dirpath, fn)
+                st = os.stat(fpath)
+                files.append((fpath, st.st_size, st.st_mtime_ns))
+        return files
+
+    @classmethod
+    def _select(cls, root_folder: str, shard: Optional[Tuple[int, int]]) -> List[Tuple[str, int, int]]:
+        """
+        Fingerprint the .txt files under the root folder that belong to a shard (all without one).
+        """
+        files = cls._scan(root_folder)
+        if shard is not None:
+            shard_index, shards = shard
+            files = [f for f in files
+                     if _shard_of(os.path.relpath(f[0], root_folder), shards) == shard_index]
+        return files
+
+    @classmethod
+    def archive_files(cls, root_folder: str) -> List[str]:
+        """
+        Return the path of every .txt file under the root folder, in the walk
+        order an unsharded database indexes them in.
+        """
+        return [fpath for fpath, _, _ in cls._scan(root_folder)]
+
+    def refreshed(self) -> Optional["TextDatabase"]:
+        """
+        Build the next generation of this database if files were added, changed
+        or removed since it was loaded.
+
+        The new database is loaded with the same arguments into a new object,
+        reusing the index cache for unchanged files; a file with appended lines
+        counts as changed and is read again. This database is never modified,
+        so queries keep running against it while the next one is built.
+
+        Returns:
+            Optional[TextDatabase]: The new database, or None if nothing changed.
+        """
+        if self._source is None:
+            raise RuntimeError("the database was never loaded")
+        root_folder, index_path, workers, shard, suffix_array, prefix_table, query_log = self._source
+        if self._select(root_folder, shard) == self._files:
+            return None
+        db = TextDatabase()
+        db.load(root_folder, index_path=index_path, workers=workers, shard=shard,
+                suffix_array=suffix_array, prefix_table=prefix_table, query_log=query_log)
+        return db
+
+    def _carry_over(self, old: SentenceTable, first: int, count: int, fpath: str,
+                    remap: array, ids: Optional[Dict[bytes, int]]) -> List[int]:
+        """
+        Append the locations of a file unchanged since the old index was built,
+        adding the sentences of its lines that are not stored yet, in line order.
+
+        Args:
+            old (SentenceTable): Sentence table of the old index.
+            first (int): Index of the file's first location in `old`.
+            count (int): Number of locations of the file.
+            remap (array): Sentence index in `old` -> index here (-1 if not added yet), updated.
+            ids (Optional[Dict[bytes, int]]): UTF-8 normalized sentence -> index, updated;
+                None if no file is read again, so no sentence can be stored twice.
+
+        Returns:
+            List[int]: Old indices of the sentences already stored from a file
+                read again, whose postings are already in place.
+        """
+        fresh: List[int] = []  # old indices of the sentences added
+        shared: List[int] = []
+        first_new = len(self.sentences)
+        for i in old.loc_sentences[first:first + count]:
+            if remap[i] >= 0:
+                continue
+            new = first_new + len(fresh)
+            idx = new
+            if ids is not None:
+                idx = ids.setdefault(bytes(old.norm_text[old.norm_offsets[i]:old.norm_offsets[i + 1]]), new)
+            (fresh if idx == new else shared).append(i)
+            remap[i] = idx
+        self.sentences.extend_sentences(old, fresh)
+        self.sentences.copy_locations(old, first, count, self.sentences.add_file(fpath), remap)
+        return shared
 
-    def load(self, root_folder: str) -> None:
+    def _merge(self, fpath: str, partial: Partial, gram_index: Dict[str, List[int]],
+               char_index: Dict[str, List[int]], ids: Dict[bytes, int]) -> int:
         """
-        Load database from pickle cache if available,
-        otherwise load recursively from text files and save pickle.
+        Append a per-file partial index. Lines whose normalized sentence is
+        already stored become locations of that sentence; the others add a
+        sentence, and their local postings are shifted to the new indices.
+
+        Args:
+            ids (Dict[bytes, int]): UTF-8 normalized sentence -> index, updated
+                with the added sentences.
+
+        Returns:
+            int: Number of locations added (the file's non-empty lines).
+        """
+        table, grams, chars = partial
+        text, bounds = bytes(table.norm_text), table.norm_offsets
+        keys = [text[a:b] for a, b in zip(bounds, bounds[1:])]
+        first = len(self.sentences)
+        file_id = self.sentences.add_file(fpath)
+        if ids.keys().isdisjoint(keys) and len(set(keys)) == len(keys):
+            # No repeated line: every line adds a sentence and local ids just shift
+            ids.update(zip(keys, range(first, first + len(keys))))
+            self.sentences.extend_sentences(table, range(len(table)))
+            self.sentences.extend_locations(file_id, table.lines, table.offsets, range(first, first + len(keys)))
+            for index, local_index in ((gram_index, grams), (char_index, chars)):
+                for key, local in local_index.items():
+                    index[key].extend(map(first.__add__, local))
+            return len(table)
+        sentence_of = array('I')
+        fresh: List[int] = []  # local ids that add a sentence
+        for j, key in enumerate(keys):
+            idx = ids.get(key)
+            if idx is None:
+                idx = ids[key] = first + len(fresh)
+                fresh.append(j)
+            sentence_of.append(idx)
+        self.sentences.extend_sentences(table, fresh)
+        self.sentences.extend_locations(file_id, table.lines, table.offsets, sentence_of)
+        added = [-1] * len(table)
+        for new, j in enumerate(fresh, first):
+            added[j] = new
+        for index, local_index in ((gram_index, grams), (char_index, chars)):
+            for key, local in local_index.items():
+                postings = [i for i in map(added.__getitem__, local) if i >= 0]
+                if postings:
+                    index[key].extend(postings)
+        return len(table)
+
+    def load(self, root_folder: str, index_path: Optional[str] = None,
+             workers: Optional[int] = 1, shard: Optional[Tuple[int, int]] = None,
+             suffix_array: bool = False, prefix_table: int = 0,
+             query_log: Optional[str] = None) -> None:
+        """
+        Load database from the index cache if it is up to date, otherwise
+        update it from the text files that changed and save the index cache.
+
+        The index cache records the archive root and the path, size and
+        modification time of every file. Files whose fingerprint is unchanged
+        keep their sentences and postings; only added or changed files are read.
+        Processes sharing an index cache load it one at a time (see `_index_lock`):
+        when several notice the same change, the first one updates the cache
+        and the others find it up to date and only open it.
 
         Args:
             root_folder (str): Path to the root folder containing .txt files.
+            index_path (Optional[str]): Index cache file. Defaults to cache.idx next to this module.
+            workers (Optional[int]): Number of processes reading files. 1 reads serially,
+                None uses every CPU core.
+            shard (Optional[Tuple[int, int]]): (shard index, shard count) to load only
+                the files assigned to one shard of the archive. Each shard needs its own index_path.
+            suffix_array (bool): Also build a suffix array over the normalized
+                sentences and store it in the index cache, for `exact_candidates`.
+                It is rebuilt in full whenever any file changes, and skipped with a
+                warning above SUFFIX_ARRAY_MAX_BYTES of normalized text.
+            prefix_table (int): Also store the answers of every query of up to this
+                many characters in the index cache, for `prefix_candidates` (0 = none).
+            query_log (Optional[str]): File of logged queries, one per line; the
+                most frequent longer prefixes are stored in the prefix table too.
 
         Process:
-            - Clears existing data and index.
-            - Opens each .txt file found.
-            - Reads each line, normalizes it.
-            - Stores tuple of (original line, file path, line number, normalized line).
-            - Indexes each unique character trigram of the normalized line.
+            - Fingerprints each .txt file found.
+            - Reuses the sentences and postings of unchanged files from the cache,
+              in walk order among the files read again, as a full rebuild would add them.
+            - Reads each line of added or changed files, normalizes it
+              (in a process pool when workers > 1, merged back in file order).
+            - Stores each distinct normalized line once, with the file, line
+              number and byte offset of every line it occurs on.
+            - Indexes each unique character trigram of the normalized line,
+              and each unique character for queries without trigram hits.
+            - With suffix_array, sorts the suffixes of all normalized sentences.
+            - With prefix_table or query_log, reads the original lines back and
+              finds the first sentences in result order containing every
+              short query and hot prefix (see `prefix_table`).
+            - Writes the index cache and serves it memory-mapped, or keeps
+              compact array posting lists in memory if it cannot be written.
+        """
+        if index_path is None:
+            index_path = os.path.join(os.path.dirname(__file__), "cache.idx")
+        with _index_lock(index_path):
+            self._load(root_folder, index_path, workers, shard, suffix_array, prefix_table, query_log)
+
+    def _load(self, root_folder: str, index_path: str, workers: Optional[int],
+              shard: Optional[Tuple[int, int]], suffix_array: bool, prefix_table: int,
+              query_log: Optional[str]) -> None:
+        """
+        Body of `load`, run while holding the lock of the index cache.
         """
+        root = os.path.abspath(root_folder)
+        files = self._select(root_folder, shard)
+        self._source = (root_folder, index_path, workers, shard, suffix_array, prefix_table, query_log)
+        self._files = files
+        self._version = _version(files, self._source[3:])
+        prefix_options = None
+        if prefix_table or query_log:
+            hot = []
+            if query_log is not None:
+                with open(query_log, encoding="utf-8") as f:
+                    hot = hot_prefixes(f, prefix_table)
+            prefix_options = [prefix_table, hot]
 
-        pickle_path = os.path.join(os.path.dirname(__file__), "cache.pkl")
-        if self._load_pickle(pickle_path):
-            self._loaded = True
+        old = self._open_index(index_path)
+        if old is not None and old.meta.get("root") != root:
+            old = None
+        old_files = old.meta.get("files", []) if old is not None else []
+        if (old is not None and [tuple(r[:3]) for r in old_files] == files
+                and (not suffix_array or old.suffixes is not None or old.meta.get("suffix_array") == "too large")
+                and (prefix_options is None or old.meta.get("prefix_table") == prefix_options)):
+            self._use_index(old, prefixes=prefix_options is not None)  # a table stored earlier stays unused
+            print(f"Loaded database from index cache: {index_path}")
             return  # loaded successfully
 
+        self._index = None
+        self._suffixes = None
+        self._prefixes = None
+        self.sentences = SentenceTable()
+        gram_index: Dict[str, List[int]] = defaultdict(list)
+        char_index: Dict[str, List[int]] = defaultdict(list)
+        records = []
 
-        self.items.clear()
-        self._gram_index.clear()
-        files_num = 0
-        for dirpath, _, filenames in os.walk(root_folder):
-            for fn in filenames:
-                if not fn.lower().endswith('.txt'):
-                    continue
-                fpath = os.path.join(dirpath, fn)
-                with open(fpath, 'r', encoding='utf-8', errors='ignore') as f:
-                    for i, line in enumerate(f, start=1):
-                        original = line.strip()
-                        if not original: # Ignore empty lines
-                            continue
-                        norm = _normalize(original)
-                        if not norm:
-                            continue
-                        idx = len(self.items)
-                        self.items.append((original, fpath, i, norm))
-                        seen = set()
-                        for g in _trigrams(norm):
-                            if g not in seen:
-                                self._gram_index[g].append(idx)
-                                seen.add(g)
-
-                files_num += 1
-                print(f'loading {files_num}')
-
-        self._save_pickle(pickle_path)
+        # Files are added in walk order, whether carried over from the old index
+        # or read again, so the result is the same as a full rebuild and the
+        # next load finds the index cache up to date
+        old_records = {tuple(r[:3]): r[3:] for r in old_files}
+        to_read = [f for f in files if f not in old_records]
+        remap = array('i', [-1]) * len(old.sentences) if old is not None else array('i')
+        # UTF-8 normalized sentence -> index, so a sentence read again gets a location, not a copy
+        ids: Optional[Dict[bytes, int]] = {} if to_read else None
+        shared: List[int] = []
+        if workers is None:
+            workers = os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(to_read) > 1 else None
+        try:
+            if pool is not None:
+                chunksize = max(1, len(to_read) // (workers * 8))
+                partials = pool.map(_index_file, [f[0] for f in to_read], chunksize=chunksize)
+            else:
+                partials = map(_index_file, [f[0] for f in to_read])
+            files_num = 0
+            for fingerprint in files:
+                fpath, size, mtime = fingerprint
+                start = self.sentences.location_count
+                if fingerprint in old_records:
+                    first, count = old_records[fingerprint]
+                    shared += self._carry_over(old.sentences, first, count, fpath, remap, ids)
+                else:
+                    count = self._merge(fpath, next(partials), gram_index, char_index, ids)
+                    files_num += 1
+                    print(f'loading {files_num}')
+                records.append([fpath, size, mtime, start, count])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if old is not None:
+            # Postings of the carried-over sentences join those of the files read
+            for i in shared:
+                remap[i] = -1
+            for old_table, table in ((old.grams, gram_index), (old.chars, char_index)):
+                for key, postings in old_table.items():
+                    moved = [r for r in map(remap.__getitem__, postings) if r >= 0]
+                    if moved:
+                        moved.extend(table.get(key, ()))
+                        moved.sort()
+                        table[key] = moved
+        if old is not None:
+            paths = {fpath for fpath, _, _ in files}
+            removed = sum(1 for r in old_files if r[0] not in paths)
+            print(f"Updated index cache: {len(files) - files_num} unchanged, {files_num} read, {removed} removed")
+        old = None
+
+        meta = {"root": root, "files": records}
+        suffixes = None
+        if suffix_array and len(self.sentences.norm_text) > SUFFIX_ARRAY_MAX_BYTES:
+            print(f"[WARN] Not building a suffix array over {len(self.sentences.norm_text)} bytes "
+                  f"of text (limit {SUFFIX_ARRAY_MAX_BYTES})")
+            meta["suffix_array"] = "too large"
+        elif suffix_array:
+            suffixes = build_suffix_array(self.sentences.norm_text, self.sentences.norm_offsets)
+        prefixes = None
+        if prefix_options is not None:
+            meta["prefix_table"] = prefix_options
+            prefixes = PrefixTable.from_entries(
+                build_prefix_table(self.sentences, gram_index, self._result_keys(), *prefix_options))
+        if self._save_index(index_path, gram_index, char_index, meta, suffixes, prefixes):
+            index = self._open_index(index_path)
+            if index is not None:
+                self._use_index(index)
+                return
+        self.sentences.group_locations()
+        self._freeze_index(gram_index, char_index)
+        self._suffixes = self._suffix_array(suffixes)
+        self._prefixes = prefixes
+        self.generation = next(_generations)
         self._loaded = True
-        
 
     def __len__(self) -> int:
-        return len(self.items)
+        return len(self.sentences)
 
-    def candidates_by_query(self, q_norm: str, cap: int = 500) -> List[int]:
+    def norm(self, idx: int) -> str:
         """
-        Given a normalized query string, retrieve a list of candidate sentence indices
-        that share character trigrams with the query, ranked by number of shared trigrams
-        and normalized sentence length.
+        Return the normalized text of sentence `idx`.
+        """
+        return self.sentences.norm(idx)
+
+    def find_sentence(self, norm: str) -> Optional[int]:
+        """
+        Return the index of the sentence whose normalized text is `norm`, or None
+        if there is none. Only the shortest posting list among its grams is scanned.
+        """
+        postings = [self._gram_index.get(g) for g in _trigram_set(norm)]
+        if not postings or any(p is None for p in postings):
+            return None
+        lengths = self._norm_len
+        for idx in min(postings, key=len):
+            if lengths[idx] == len(norm) and self.norm(idx) == norm:
+                return idx
+        return None
+
+    def location(self, idx: int) -> Tuple[str, int]:
+        """
+        Return the (file path, line number) of the first line sentence `idx` occurs on.
+        """
+        fpath, line, _ = self.sentences.location(idx)
+        return fpath, line
+
+    def locations(self, idx: int) -> List[Tuple[str, int]]:
+        """
+        Return the (file path, line number) of every line sentence `idx` occurs on, in file order.
+        """
+        return [self.sentences.location_at(loc)[:2] for loc in self.sentences.locations_of(idx)]
+
+    def location_count(self, idx: int) -> int:
+        """
+        Return the number of lines sentence `idx` occurs on.
+        """
+        return len(self.sentences.locations_of(idx))
+
+    def _read_lines(self, locs: Sequence[int]) -> List[Optional[str]]:
+        """
+        Read the original (stripped) lines at the given locations.
+
+        Each file is opened once and read at the recorded byte offsets, in offset
+        order. A line that no longer normalizes to its sentence (the file was
+        edited since it was indexed), or whose file can no longer be read, is None.
+        """
+        by_file: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for pos, loc in enumerate(locs):
+            fpath, _, offset = self.sentences.location_at(loc)
+            by_file[fpath].append((offset, pos))
+        out: List[Optional[str]] = [None] * len(locs)
+        for fpath, wanted in by_file.items():
+            try:
+                with open(fpath, 'rb') as f:
+                    for offset, pos in sorted(wanted):
+                        f.seek(offset)
+                        line = _read_line(f).decode('utf-8', errors='ignore').strip()
+                        if _normalize(line) == self.norm(self.sentences.loc_sentences[locs[pos]]):
+                            out[pos] = line
+            except OSError as e:
+                print(f"[WARN] Failed to read source file '{fpath}': {e}")
+        return out
+
+    def _result_keys(self) -> List[str]:
+        """
+        Sort key of every sentence for `build_prefix_table`: the lowercased
+        original of the line it lists first in results (see `occurrences`).
+        """
+        rows = self.occurrences(range(len(self.sentences)), 1)
+        return [row[0][2].lower() for row in rows]
+
+    def originals(self, indices: Sequence[int]) -> List[str]:
+        """
+        Read the original (stripped) lines of the given sentences from their source files,
+        at the first line each sentence occurs on.
+
+        If a source file can no longer be read, or the line changed since it was
+        indexed, the normalized sentence is returned instead.
+
+        Args:
+            indices (Sequence[int]): Sentence indices.
+
+        Returns:
+            List[str]: Original lines, in the order of `indices`.
+        """
+        lines = self._read_lines([self.sentences.locations_of(idx)[0] for idx in indices])
+        return [line if line else self.norm(idx) for line, idx in zip(lines, indices)]
+
+    def original(self, idx: int) -> str:
+        """
+        Read the original (stripped) line of sentence `idx` from its source file.
+        """
+        return self.originals([idx])[0]
+
+    def occurrences(self, indices: Sequence[int], limit: int) -> List[List[Tuple[str, int, str]]]:
+        """
+        Expand sentences into the lines they occur on, with their original text.
+
+        A sentence on more than `limit` lines has all of them read, and keeps
+        the ones results list first: by lowercased original, then in file order.
+
+        Args:
+            indices (Sequence[int]): Sentence indices.
+            limit (int): Most lines per sentence.
+
+        Returns:
+            List[List[Tuple[str, int, str]]]: For each sentence, (file path,
+                line number, original line) of up to `limit` lines, in that
+                order when some were left out; the normalized sentence stands
+                in for lines that cannot be read or changed since they were indexed.
+        """
+        per_sentence = [self.sentences.locations_of(idx) for idx in indices]
+        lines = iter(self._read_lines([loc for locs in per_sentence for loc in locs]))
+        out = []
+        for idx, locs in zip(indices, per_sentence):
+            rows = []
+            for loc in locs:
+                fpath, line_no, _ = self.sentences.location_at(loc)
+                rows.append((fpath, line_no, next(lines) or self.norm(idx)))
+            if len(rows) > limit:
+                rows = sorted(rows, key=lambda row: row[2].lower())[:limit]  # stable: file order on ties
+            out.append(rows)
+        return out
+
+    def postings(self, grams: Iterable[str]) -> Dict[str, Sequence[int]]:
+        """
+        Fetch the posting list of every distinct gram once, to count several
+        queries from (see `count_grams`). Grams without postings are left out.
+        """
+        index = self._gram_index
+        found = {}
+        for g in set(grams):
+            p = index.get(g)
+            if p is not None:
+                found[g] = p
+        return found
+
+    def count_grams(self, grams: Iterable[str], counts: Optional[Counter] = None,
+                    trace: Optional[QueryTrace] = None, deadline: Optional[Deadline] = None,
+                    fetched: Optional[Mapping[str, Sequence[int]]] = None) -> Counter:
+        """
+        Count, for each sentence, how many of the given grams it contains.
+
+        The posting lists of all grams are chained and counted in one
+        `Counter.update` call, which runs the counting loop in C. With a
+        deadline, lists are counted one at a time, shortest first, until the
+        deadline passes; the counts then cover only some of the grams.
+
+        Args:
+            grams (Iterable[str]): Query grams; a gram listed twice counts twice.
+            counts (Optional[Counter]): Existing counts to add to. A new Counter if omitted.
+            trace (Optional[QueryTrace]): Records the time as the "postings" stage
+                and the number of postings read.
+            deadline (Optional[Deadline]): Time budget of the query.
+            fetched (Optional[Mapping[str, Sequence[int]]]): Posting lists from
+                `postings` covering every gram, shared by a batch of queries.
+                Read from the index if omitted.
+
+        Returns:
+            Counter: Item index -> number of shared grams.
+        """
+        if counts is None:
+            counts = Counter()
+        lookup = self._gram_index.get if fetched is None else fetched.get
+        postings = [p for p in map(lookup, grams) if p is not None]
+        if deadline is None:
+            counts.update(chain.from_iterable(postings))
+        else:
+            postings.sort(key=len)
+            for i, p in enumerate(postings):
+                if deadline.passed():
+                    del postings[i:]
+                    break
+                counts.update(p)
+        if trace is not None:
+            trace.add("postings", sum(map(len, postings)))
+            trace.lap("postings")
+        return counts
+
+    def rank_candidates(self, counts: Mapping[int, int], cap: int = 500, q_len: int = 0,
+                        trace: Optional[QueryTrace] = None) -> List[int]:
+        """
+        Select the `cap` best items by number of shared grams, then by shorter
+        normalized sentence.
+
+        With `q_len`, items that cannot match a query of that length within one
+        edit are dropped first: those sharing fewer than `_min_shared_trigrams(q_len)`
+        trigrams with it, and those shorter than q_len - 1 characters. The filter
+        is lossless, so the cap only limits how many possible matches are scored.
+
+        Instead of sorting every hit, a histogram of the counts gives the lowest
+        count that still makes the cut. Items above it are sorted fully (there
+        are fewer than `cap` of them) and only the tied items at the threshold
+        go through a partial selection on sentence length. The order is the
+        same as a stable sort of all hits.
+
+        Args:
+            counts (Mapping[int, int]): Item index -> number of shared grams.
+            cap (int, optional): Maximum number of candidates to return. Defaults to 500.
+            q_len (int, optional): Length of the normalized query, 0 to keep every item.
+            trace (Optional[QueryTrace]): Counts the items dropped as "filtered".
+
+        Returns:
+            List[int]: Item indices, best first.
+        """
+        lengths = self._norm_len
+        min_count = _min_shared_trigrams(q_len)
+        min_len = q_len - 1
+        if min_count > 1 or min_len > 1:
+            kept = {idx: c for idx, c in counts.items() if c >= min_count and lengths[idx] >= min_len}
+            if trace is not None:
+                trace.add("filtered", len(counts) - len(kept))
+            counts = kept
+        if len(counts) <= cap:
+            ranked = sorted(counts.items(), key=lambda kv: (-kv[1], lengths[kv[0]]))
+            return [idx for idx, _ in ranked]
+
+        hist = Counter(counts.values())
+        remaining = cap
+        threshold = 0
+        for c in sorted(hist, reverse=True):
+            threshold = c
+            if hist[c] >= remaining:
+                break
+            remaining -= hist[c]
+        above = sorted(((idx, c) for idx, c in counts.items() if c > threshold),
+                       key=lambda kv: (-kv[1], lengths[kv[0]]))
+        tied = [idx for idx, c in counts.items() if c == threshold]
+        return [idx for idx, _ in above] + heapq.nsmallest(remaining, tied, key=lengths.__getitem__)
+
+    def fallback_candidates(self, q_norm: str, cap: int = 500) -> List[int]:
+        """
+        Candidates for a query that shares no trigram with any sentence:
+        the first `cap` sentences containing the query's first character.
 
         Args:
             q_norm (str): The normalized query string.
             cap (int, optional): Maximum number of candidates to return. Defaults to 500.
 
         Returns:
-            List[int]: List of indices into `self.items` representing candidate sentences.
+            List[int]: Sentence indices in ascending order.
         """
-        if not self._loaded or not q_norm:
+        if not q_norm:
             return []
+        rough = self._char_index.get(q_norm[0], ())
+        return list(rough[:cap])
+
+    def prefix_candidates(self, q_norm: str, k: int,
+                          trace: Optional[QueryTrace] = None) -> Optional[Sequence[int]]:
+        """
+        The first k sentences in result order containing a normalized query,
+        looked up in the prefix table in O(1).
+
+        Args:
+            q_norm (str): The normalized query string.
+            k (int): Number of sentences wanted.
+            trace (Optional[QueryTrace]): Records the time as the "prefix" stage
+                and the number of sentences found.
+
+        Returns:
+            Optional[Sequence[int]]: Sentence indices, or None if there is no
+                prefix table, the query is not in it or k is above `prefix_table.TOP_K`.
+        """
+        if self._prefixes is None:
+            return None
+        found = self._prefixes.get(q_norm, k)
+        if trace is not None:
+            trace.add("prefix", len(found) if found is not None else 0)
+            trace.lap("prefix")
+        return found
+
+    def exact_candidates(self, q_norm: str, cap: int = 500,
+                         trace: Optional[QueryTrace] = None) -> Optional[List[int]]:
+        """
+        Sentences containing the normalized query exactly, found with the suffix
+        array in O(|q| log N) without reading any posting list.
+
+        Args:
+            q_norm (str): The normalized query string.
+            cap (int, optional): Maximum number of sentences to return; the shortest
+                are kept, as in `rank_candidates`. Defaults to 500.
+            trace (Optional[QueryTrace]): Records the time as the "exact" stage
+                and the number of sentences found.
+
+        Returns:
+            Optional[List[int]]: Sentence indices, or None if there is no suffix
+                array or the query occurs more than EXACT_SCAN_LIMIT times.
+        """
+        if self._suffixes is None or not q_norm:
+            return None
+        found = self._suffixes.sentences(q_norm, EXACT_SCAN_LIMIT)
+        if found is not None and len(found) > cap:
+            found = heapq.nsmallest(cap, found, key=self._norm_len.__getitem__)
+        if trace is not None:
+            trace.add("exact", len(found) if found is not None else 0)
+            trace.lap("exact")
+        return found
+
+    def candidates_with_counts(self, q_norm: str, cap: int = 500, trace: Optional[QueryTrace] = None,
+                               deadline: Optional[Deadline] = None) -> Tuple[List[int], Optional[Mapping[int, int]]]:
+        """
+        Like `candidates_by_query`, but also return the shared-trigram counts the
+        candidates were ranked by.
+
+        If the deadline passes while counting, candidates are ranked by the
+        counts of the grams read so far, without the count filter (which needs
+        complete counts), and no counts are returned.
+
+        Args:
+            q_norm (str): The normalized query string.
+            cap (int, optional): Maximum number of candidates to return. Defaults to 500.
+            trace (Optional[QueryTrace]): Records the "postings", "rank" and
+                "fallback" stages and the posting, filtered, candidate and fallback counters.
+            deadline (Optional[Deadline]): Time budget of the query.
+
+        Returns:
+            Tuple[List[int], Optional[Mapping[int, int]]]: Candidate sentence indices and
+                sentence index -> number of shared trigrams, or None for fallback
+                candidates and incomplete counts.
+        """
+        if not self._loaded or not q_norm:
+            return [], None
         grams = list(_trigrams(q_norm))
         if not grams:
-            return []
-        counts: Dict[int, int] = defaultdict(int)
-        for g in grams:
-            for idx in self._gram_index.get(g, ()):
-                counts[idx] += 1
+            return [], None
+        counts = self.count_grams(grams, trace=trace, deadline=deadline)
+        complete = deadline is None or not deadline.expired
         if not counts:
-            first = q_norm[0]
-            rough = [i for i, (_, _, _, s) in enumerate(self.items) if first in s]
-            return rough[:cap]
-        ranked = sorted(counts.items(), key=lambda kv: (-kv[1], len(self.items[kv[0]][3])))
-        return [idx for idx, _ in ranked[:cap]]
+            if complete and _min_shared_trigrams(len(q_norm)):
+                # Long enough that any match shares a trigram with it: nothing can match
+                if trace is not None:
+                    trace.add("candidates", 0)
+                    trace.lap("rank")
+                return [], None
+            candidates = self.fallback_candidates(q_norm, cap)
+            if trace is not None:
+                trace.add("fallback")
+                trace.add("candidates", len(candidates))
+                trace.lap("fallback")
+            return candidates, None
+        candidates = self.rank_candidates(counts, cap, len(q_norm) if complete else 0, trace)
+        if trace is not None:
+            trace.add("candidates", len(candidates))
+            trace.lap("rank")
+        return candidates, counts if complete else None
+
+    def candidates_by_query(self, q_norm: str, cap: int = 500) -> List[int]:
+        """
+        Given a normalized query string, retrieve a list of candidate sentence indices
+        that share character trigrams with the query, ranked by number of shared trigrams
+        and normalized sentence length.
+
+        Args:
+            q_norm (str): The normalized query string.
+            cap (int, optional): Maximum number of candidates to return. Defaults to 500.
+
+        Returns:
+            List[int]: List of indices into `self.sentences` representing candidate sentences.
+        """
+        return self.candidates_with_counts(q_norm, cap)[0]
@@ -1,10 +1,24 @@
 from dataclasses import dataclass
-from typing import Iterable
-import re
+from typing import Iterable, List, Set
 import string
 
 _PUNC_SET = set(string.punctuation)
 
+class _NormalizeTable(dict):
+    """
+    `str.translate` table for `_normalize`: punctuation -> space, any other
+    character -> its own lowercase. Entries are filled in on first use, so the
+    table only holds characters that actually occur.
+    """
+
+    def __missing__(self, code: int) -> str:
+        ch = chr(code)
+        value = ' ' if ch in _PUNC_SET else ch.lower()
+        self[code] = value
+        return value
+
+_NORMALIZE_TABLE = _NormalizeTable()
+
 def _normalize(s: str) -> str:
     """
     Normalize the input string by lowercasing all characters,
@@ -12,15 +26,29 @@ def _normalize(s: str) -> str:
     collapsing multiple spaces into a single space,
     and stripping leading and trailing whitespace.
 
+    Each character is lowercased on its own (so a final 'Σ' becomes 'σ', not 'ς').
+    The translation table also applies to a whole batch of lines at once:
+    `_normalize_lines` gives the same result as `_normalize` on each line.
+
     Args:
         s (str): The input string to normalize.
 
     Returns:
         str: The normalized string.
     """
-    s = ''.join((ch.lower() if ch not in _PUNC_SET else ' ') for ch in s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
+    return ' '.join(s.translate(_NORMALIZE_TABLE).split())
+
+def _normalize_lines(text: str) -> List[str]:
+    """
+    Normalize every '\n'-separated line of a text in one pass.
+
+    Args:
+        text (str): Lines separated by '\n'.
+
+    Returns:
+        List[str]: `_normalize` of each line, in order (empty strings included).
+    """
+    return [' '.join(line.split()) for line in text.translate(_NORMALIZE_TABLE).split('\n')]
 
 def _trigrams(s: str) -> Iterable[str]:
     """
@@ -40,6 +68,59 @@ def _trigrams(s: str) -> Iterable[str]:
     for i in range(len(s) - 2):
         yield s[i:i+3]
 
+def _trigram_set(s: str) -> Set[str]:
+    """
+    The distinct trigrams of s, or {s} if it is shorter than 3 characters
+    (the empty set for an empty string). Same as set(_trigrams(s)), built without a generator.
+    """
+    if len(s) < 3:
+        return {s} if s else set()
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def _min_shared_trigrams(n: int) -> int:
+    """
+    Fewest query trigrams a sentence must contain to match a query of length n
+    within one edit (the q-gram count lemma). The query has n - 2 trigrams and
+    one replace, add or delete touches at most 3 of them; every other trigram
+    occurs unchanged in the matching window.
+
+    Args:
+        n (int): Length of the normalized query.
+
+    Returns:
+        int: Lower bound on the shared-trigram count, 0 when it filters nothing.
+    """
+    return max(0, n - 2 - 3)
+
+_CODE_BITS = 21  # enough for any Unicode code point plus one
+
+def _pack_gram(gram: str) -> int:
+    """
+    Pack a gram of one to three characters into an integer key: each character
+    takes 21 bits holding its code point plus one, and missing trailing
+    characters are 0. Packed keys sort in the same order as the grams.
+
+    Args:
+        gram (str): A trigram, or a shorter gram such as a single character.
+
+    Returns:
+        int: The packed key, below 2**63.
+    """
+    if not 0 < len(gram) <= 3:
+        raise ValueError(f"cannot pack a gram of length {len(gram)}")
+    key = 0
+    for ch in gram:
+        key = (key << _CODE_BITS) | (ord(ch) + 1)
+    return key << _CODE_BITS * (3 - len(gram))
+
+def _unpack_gram(key: int) -> str:
+    """
+    Inverse of `_pack_gram`.
+    """
+    mask = (1 << _CODE_BITS) - 1
+    codes = [(key >> shift) & mask for shift in (2 * _CODE_BITS, _CODE_BITS, 0)]
+    return ''.join(chr(c - 1) for c in codes if c)
+
 @dataclass
 class AutoCompleteData:
     completed_sentence: str
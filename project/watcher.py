@@ -0,0 +1,74 @@
+"""
+Live index updates: poll the archive and switch a completer to each new database generation.
+"""
+
+import threading
+from typing import Optional
+from autocomplete import AutoCompleter
+
+
+class ArchiveWatcher:
+    """
+    Keeps a completer's database in step with its archive folder.
+
+    Every check builds the next database generation with `TextDatabase.refreshed`
+    in the calling thread while queries keep using the current one, then
+    switches the completer to it with a single attribute assignment. A query
+    reads the completer's database once when it starts, so it never waits for
+    an update or sees a half-built index. Checks run one at a time.
+    """
+
+    def __init__(self, completer: AutoCompleter, interval: float = 30.0) -> None:
+        """
+        Args:
+            completer (AutoCompleter): Completer over a loaded `TextDatabase`.
+            interval (float): Seconds between two polls of the archive.
+        """
+        self.completer = completer
+        self.interval = interval
+        self.updates = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """
+        Look for added, changed or removed files and switch to a new generation if there are any.
+
+        Returns:
+            bool: True if the completer now uses a new database.
+        """
+        with self._lock:
+            db = self.completer.db.refreshed()
+            if db is None:
+                return False
+            self.completer.use_database(db)
+            self.updates += 1
+            print(f"Switched to index generation {db.generation} ({len(db)} sentences)")
+            return True
+
+    def start(self) -> None:
+        """
+        Poll the archive every `interval` seconds in a daemon thread.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="archive-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop polling and wait for a check in progress to finish.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"[WARN] Failed to update the index: {e}")